@@ -1,17 +1,19 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from shopbase.adminscale import EstimatedCountPaginator, IndexedSearchMixin
 from .models import User
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(IndexedSearchMixin, BaseUserAdmin):
     # Fields to display in the user list
     list_display = ('username', 'email', 'first_name', 'last_name', 'role', 'is_active', 'is_staff', 'date_joined')
     
     # Fields that can be used for filtering
     list_filter = ('role', 'is_active', 'is_staff', 'is_superuser', 'date_joined')
     
-    # Fields that can be searched
-    search_fields = ('username', 'email', 'first_name', 'last_name')
+    # Fields that can be searched; case-sensitive prefixes so the username/email indexes apply
+    search_fields = ('username__startswith', 'email__startswith')
+    search_help_text = 'Start of a username or email (case-sensitive)'
     
     # How many users to show per page
     list_per_page = 25
@@ -19,8 +21,12 @@ class UserAdmin(BaseUserAdmin):
     # Fields that can be edited directly from the list view
     list_editable = ('role', 'is_active')
     
-    # Ordering
-    ordering = ('-date_joined',)
+    # Ordering - newest first through the primary key, so the default page needs no sort
+    ordering = ('-pk',)
+
+    # Estimated counts instead of COUNT(*) over the whole table
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     # Fieldsets for the user detail/edit page
     fieldsets = (
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.utils.translation import gettext_lazy as _
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -8,6 +9,8 @@ class User(AbstractUser):
     )
 
     role = models.CharField(max_length=10, choices=ROLE_CHOICES, default='user')
+    # Indexed for admin search and lookups by email
+    email = models.EmailField(_('email address'), blank=True, db_index=True)
 
     def __str__(self):
         return self.username
\ No newline at end of file
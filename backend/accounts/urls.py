@@ -1,14 +1,14 @@
 from django.urls import path
 from .views import (
-    RegisterView, UserMeView, UserListCreateView, 
+    RegisterView, LoginView, UserMeView, UserListCreateView, 
     UserRetrieveUpdateDeleteView, user_profile, toggle_user_status
 )
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.views import TokenRefreshView
 
 urlpatterns = [
     # Authentication endpoints
     path('register/', RegisterView.as_view(), name='register'),
-    path('login/', TokenObtainPairView.as_view(), name='login'),
+    path('login/', LoginView.as_view(), name='login'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     
     # User profile endpoints
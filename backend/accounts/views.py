@@ -2,8 +2,12 @@ from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
+from django.contrib.auth.signals import user_logged_in
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
 from .models import User
 from .serializers import UserRegisterSerializer, UserDisplaySerializer, UserSerializer
+from shopbase.querybudget import query_budget
 
 User = get_user_model()
 
@@ -12,11 +16,26 @@ class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserRegisterSerializer
     permission_classes = [permissions.AllowAny]
+    query_budget = 2
+
+class LoginView(TokenObtainPairView):
+    """Obtain a JWT pair and announce the login, so a guest cart is merged into the user's cart"""
+    query_budget = 13  # Merging a guest cart into a cart it has to create
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+        user_logged_in.send(sender=serializer.user.__class__, request=request._request, user=serializer.user)
+        return Response(serializer.validated_data, status=status.HTTP_200_OK)
 
 class UserMeView(generics.RetrieveUpdateAPIView):
     """Get and update current user profile"""
     serializer_class = UserDisplaySerializer
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 2
 
     def get_object(self):
         return self.request.user
@@ -26,6 +45,7 @@ class UserListCreateView(generics.ListCreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAdminUser]
+    query_budget = 2
 
     def get_queryset(self):
         return User.objects.all().order_by('-date_joined')
@@ -41,6 +61,7 @@ class UserRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
             return UserDisplaySerializer
         return UserSerializer
 
+@query_budget(0)
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def user_profile(request):
@@ -55,6 +76,7 @@ def user_profile(request):
         }
     })
 
+@query_budget(2)
 @api_view(['POST'])
 @permission_classes([permissions.IsAdminUser])
 def toggle_user_status(request, user_id):
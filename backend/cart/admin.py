@@ -1,21 +1,47 @@
 from django.contrib import admin
+from django.db.models import DecimalField, ExpressionWrapper, F
+from shopbase.adminscale import EstimatedCountPaginator, IndexedSearchMixin
 from .models import Cart, CartItem
 
 class CartItemInline(admin.TabularInline):
     model = CartItem
     extra = 0
+    autocomplete_fields = ['product']
 
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
-    list_display = ['user', 'total_items', 'total_price', 'created_at', 'updated_at']
+class CartAdmin(IndexedSearchMixin, admin.ModelAdmin):
+    # total_items/total_price are stored columns (see CartQuerySet.refresh_totals), not per-row queries
+    list_display = ['user', 'total_items', 'total_price', 'version', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
-    search_fields = ['user__username', 'user__email']
-    readonly_fields = ['total_items', 'total_price', 'created_at', 'updated_at']
+    list_select_related = ['user']
+    search_fields = ['user__username__startswith', 'user__email__startswith']
+    search_help_text = 'Start of a username or email (case-sensitive)'
+    readonly_fields = ['total_items', 'total_price', 'version', 'created_at', 'updated_at']
+    autocomplete_fields = ['user']
     inlines = [CartItemInline]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['cart', 'product', 'quantity', 'subtotal', 'created_at', 'updated_at']
     list_filter = ['created_at', 'updated_at']
-    search_fields = ['cart__user__username', 'product__name']
+    list_select_related = ['cart__user', 'product']
+    search_fields = ['cart__user__username__startswith', 'product__sku__exact']
+    search_help_text = 'Start of a username (case-sensitive) or an exact product SKU'
     readonly_fields = ['subtotal', 'created_at', 'updated_at']
+    autocomplete_fields = ['cart', 'product']
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            admin_subtotal=ExpressionWrapper(
+                F('quantity') * F('product__price'), output_field=DecimalField(max_digits=12, decimal_places=2)
+            )
+        )
+
+    @admin.display(description='Subtotal', ordering='admin_subtotal')
+    def subtotal(self, obj):
+        return obj.admin_subtotal
@@ -0,0 +1,95 @@
+"""
+Planning for POST /api/cart/batch/.
+
+apply_operations() replays an ordered list of validated add/set/remove
+operations against the cart's current quantities in memory, checking
+stock as it goes. Failed operations leave the quantities untouched, so
+the rest of the batch still applies. The caller then writes the net
+difference with one bulk insert, update and delete.
+"""
+
+
+from .serializers import CartOperationSerializer
+
+
+class OperationError(Exception):
+    pass
+
+
+def parse_operations(raw_operations):
+    """Validate each operation on its own; returns a list of (data, errors) pairs."""
+    parsed = []
+    for raw in raw_operations:
+        serializer = CartOperationSerializer(data=raw)
+        if serializer.is_valid():
+            parsed.append((serializer.validated_data, None))
+        else:
+            parsed.append(({'op': raw.get('op')}, serializer.errors))
+    return parsed
+
+
+def referenced_products(parsed, items):
+    """Ids of every product the operations touch, for one batched lookup."""
+    item_products = {item.pk: product_id for product_id, item in items.items()}
+    ids = set()
+    for operation, errors in parsed:
+        if errors is None:
+            ids.add(operation.get('product_id') or item_products.get(operation.get('item_id')))
+    ids.discard(None)
+    return ids
+
+
+def apply_operations(parsed, items, products):
+    """
+    Return (results, quantities) for parsed operations applied to items.
+
+    items maps product id -> CartItem already in the cart, products maps
+    product id -> Product for every product the batch mentions. quantities
+    maps product id -> final quantity, 0 meaning not in the cart.
+    """
+    quantities = {product_id: item.quantity for product_id, item in items.items()}
+    item_products = {item.pk: product_id for product_id, item in items.items()}
+    results = []
+    for index, (operation, errors) in enumerate(parsed):
+        result = {'index': index, 'op': operation['op']}
+        if errors is not None:
+            result.update(status='error', error=errors)
+            results.append(result)
+            continue
+        try:
+            product_id = resolve_product(operation, item_products)
+            result['product_id'] = product_id
+            quantity = apply_operation(operation, quantities.get(product_id, 0), products.get(product_id))
+        except OperationError as exc:
+            result.update(status='error', error=str(exc))
+        else:
+            quantities[product_id] = quantity
+            result.update(status='ok', quantity=quantity)
+        results.append(result)
+    return results, quantities
+
+
+def resolve_product(operation, item_products):
+    if operation.get('item_id') is None:
+        return operation['product_id']
+    product_id = item_products.get(operation['item_id'])
+    if product_id is None:
+        raise OperationError('Cart item not found')
+    return product_id
+
+
+def apply_operation(operation, current, product):
+    op = operation['op']
+    if op == 'remove':
+        if not current:
+            raise OperationError('Product is not in the cart')
+        return 0
+    if op == 'set' and operation['quantity'] == 0:
+        return 0
+
+    if product is None or not product.is_active:
+        raise OperationError('Product not found or not available')
+    quantity = current + operation['quantity'] if op == 'add' else operation['quantity']
+    if quantity > product.stock:
+        raise OperationError(f'Only {product.stock} items available in stock')
+    return quantity
@@ -0,0 +1,136 @@
+"""
+Carts for anonymous visitors, kept in Django's cache instead of the database.
+
+A guest cart is a compact list of [product_id, quantity] pairs stored
+under a random token. The token travels in a signed cookie, and both the
+cookie and the cache entry expire GUEST_CART_TTL seconds after the last
+change. The cart views serve guests through GuestCart with the same
+response shapes as database carts; a guest line's item id is its product
+id. On login (the user_logged_in signal sent by accounts.views.LoginView)
+the guest cart is merged into the user's Cart with one bulk upsert.
+"""
+import secrets
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from products.loaders import get_product_loader
+from .models import Cart, CartItem
+
+COOKIE_NAME = 'guest_cart'
+COOKIE_SALT = 'cart.guest'
+CACHE_KEY = 'cart:guest:{}'
+
+
+def get_ttl():
+    return getattr(settings, 'GUEST_CART_TTL', 7 * 24 * 60 * 60)
+
+
+def read_token(request):
+    request = getattr(request, '_request', request)
+    return request.get_signed_cookie(COOKIE_NAME, default=None, salt=COOKIE_SALT, max_age=get_ttl())
+
+
+class GuestCart:
+    def __init__(self, request, token=None, lines=None):
+        self.request = request
+        self.token = token
+        self.quantities = dict(lines or ())  # product id -> quantity, in insertion order
+        self.changed = False
+
+    @classmethod
+    def load(cls, request):
+        token = read_token(request)
+        lines = cache.get(CACHE_KEY.format(token)) if token else None
+        return cls(request, token, lines)
+
+    def set(self, product_id, quantity):
+        if quantity:
+            self.quantities[product_id] = quantity
+        else:
+            self.quantities.pop(product_id, None)
+        self.changed = True
+
+    def clear(self):
+        self.quantities.clear()
+        self.changed = True
+
+    def save(self, response):
+        """Store the cart and (re)issue the cookie, sliding both expiry times."""
+        if not self.changed:
+            return response
+        if self.token is None:
+            self.token = secrets.token_urlsafe(16)
+        key = CACHE_KEY.format(self.token)
+        if self.quantities:
+            cache.set(key, list(self.quantities.items()), get_ttl())
+        else:
+            cache.delete(key)
+        response.set_signed_cookie(
+            COOKIE_NAME, self.token, salt=COOKIE_SALT, max_age=get_ttl(), httponly=True,
+            secure=not settings.DEBUG,
+            samesite=getattr(settings, 'GUEST_CART_COOKIE_SAMESITE', 'Lax'),
+        )
+        return response
+
+    def items(self):
+        """Unsaved CartItems for the lines whose products still exist, keyed by product id."""
+        products = get_product_loader(self.request).load_many(self.quantities)
+        now = timezone.now()
+        return {
+            product_id: CartItem(pk=product_id, product=products[product_id], quantity=quantity,
+                                 created_at=now, updated_at=now)
+            for product_id, quantity in self.quantities.items()
+            if product_id in products
+        }
+
+    def snapshot(self):
+        """An object CartSerializer can render like a database cart."""
+        items = list(self.items().values())
+        now = timezone.now()
+        return SimpleNamespace(
+            id=None,
+            version=None,
+            items=items,
+            total_items=sum(item.quantity for item in items),
+            total_price=sum((item.subtotal for item in items), 0),
+            created_at=now,
+            updated_at=now,
+        )
+
+
+def merge_into(user, request):
+    """Move the request's guest cart into the user's Cart; quantities add up, capped at stock."""
+    token = read_token(request)
+    if not token:
+        return None
+    key = CACHE_KEY.format(token)
+    lines = cache.get(key)
+    if not lines:
+        return None
+
+    products = get_product_loader(request).load_many(product_id for product_id, _ in lines)
+    with transaction.atomic():
+        cart = Cart.objects.claim(user)
+        existing = dict(CartItem.objects.filter(cart=cart, product__in=products).values_list('product_id', 'quantity'))
+        now = timezone.now()
+        merged = []
+        for product_id, quantity in lines:
+            product = products.get(product_id)
+            if product is None or not product.is_active:
+                continue
+            quantity = min(existing.get(product_id, 0) + quantity, product.stock)
+            if quantity > 0:
+                merged.append(CartItem(cart=cart, product=product, quantity=quantity, version=cart.version,
+                                       created_at=now, updated_at=now))
+        if merged:
+            CartItem.objects.bulk_create(
+                merged, update_conflicts=True, unique_fields=['cart', 'product'],
+                update_fields=['quantity', 'version', 'updated_at'],
+            )
+            Cart.objects.filter(pk=cart.pk).refresh_totals()
+    cache.delete(key)
+    return cart
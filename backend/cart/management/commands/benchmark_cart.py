@@ -0,0 +1,80 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, models, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+from cart.models import Cart, CartItem
+from cart.views import CartView
+from products.models import Category, Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Compare per-item cart total computation with the stored cart totals (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[1, 10, 100, 1000], help='Items per cart')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement')
+
+    def handle(self, *args, **options):
+        view = CartView.as_view()
+        factory = APIRequestFactory()
+        self.stdout.write(
+            f'{"items":>6} {"computed totals":>16} {"stored totals":>14} {"GET /api/cart/":>16}'
+        )
+
+        with transaction.atomic():
+            category = Category.objects.create(name='Cart Benchmark', slug='cart-benchmark')
+            for size in options['sizes']:
+                user = User.objects.create(username=f'cart-benchmark-{size}')
+                products = Product.objects.bulk_create([
+                    Product(name=f'Cart Benchmark {size}-{i}', price=Decimal('4.99'), stock=100, category=category)
+                    for i in range(size)
+                ])
+                cart = Cart.objects.create(user=user)
+                CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2) for product in products])
+                Cart.objects.filter(pk=cart.pk).refresh_totals()
+
+                def get_cart():
+                    request = factory.get('/api/cart/')
+                    force_authenticate(request, user=user)
+                    view(request).render()
+
+                computed = self.measure(lambda: self.computed_totals(cart.pk), options['repeat'])
+                stored = self.measure(
+                    lambda: Cart.objects.values_list('total_items', 'total_price').get(pk=cart.pk),
+                    options['repeat'],
+                )
+                snapshot = self.measure(get_cart, options['repeat'])
+                self.stdout.write(
+                    f'{size:>6} {self.format(computed):>16} {self.format(stored):>14} {self.format(snapshot):>16}'
+                )
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; seeded rows were rolled back'))
+
+    def computed_totals(self, pk):
+        # What the serializer used to do: an aggregate plus one product fetch per item
+        cart = Cart.objects.get(pk=pk)
+        total_items = cart.items.aggregate(total=models.Sum('quantity'))['total'] or 0
+        total_price = sum(item.quantity * item.product.price for item in cart.items.all())
+        return total_items, total_price
+
+    def measure(self, run, repeat):
+        with CaptureQueriesContext(connection) as queries:
+            run()  # Warm caches and count queries
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples), len(queries)
+
+    def format(self, result):
+        milliseconds, queries = result
+        return f'{milliseconds:.2f}ms/{queries}q'
@@ -0,0 +1,105 @@
+import threading
+import time
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection
+from cart.models import Cart, CartItem
+from products.models import Product
+
+User = get_user_model()
+
+
+def read_modify_write(cart_id, product_id, quantity):
+    """The add_to_cart logic before conditional updates, kept for comparison."""
+    product = Product.objects.get(pk=product_id)
+    item, created = CartItem.objects.get_or_create(
+        cart_id=cart_id, product_id=product_id, defaults={'quantity': quantity}
+    )
+    if created:
+        if quantity > product.stock:
+            item.delete()
+            return False
+        return True
+    if item.quantity + quantity > product.stock:
+        return False
+    item.quantity += quantity
+    item.save()
+    return True
+
+
+def conditional(cart_id, product_id, quantity):
+    return CartItem.objects.add_quantity(cart_id, product_id, quantity)
+
+
+STRATEGIES = {'read-modify-write': read_modify_write, 'conditional': conditional}
+
+
+class Command(BaseCommand):
+    help = 'Hammer one cart line from many threads and compare add strategies (creates and removes its own rows)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--adds', type=int, default=100, help='Adds of one unit per thread')
+        parser.add_argument('--stock', type=int, default=500, help='Stock of the hot product')
+
+    def handle(self, *args, **options):
+        # Threads need their own connections, so this cannot run inside a rolled-back transaction
+        user = User.objects.create(username=f'contention-benchmark-{time.time_ns()}')
+        product = Product.objects.create(name='Contention Benchmark', price=Decimal('1.00'), stock=options['stock'])
+        cart = Cart.objects.create(user=user)
+        self.stdout.write(
+            f'{options["threads"]} threads x {options["adds"]} adds against stock {options["stock"]} '
+            f'({connection.vendor})'
+        )
+        self.stdout.write(
+            f'{"strategy":<18} {"adds/sec":>9} {"accepted":>9} {"errors":>7} {"final qty":>10} {"correct":>8}'
+        )
+        try:
+            for name, strategy in STRATEGIES.items():
+                CartItem.objects.filter(cart=cart).delete()
+                self.run(name, strategy, cart.pk, product.pk, options)
+        finally:
+            user.delete()
+            product.delete()
+
+    def run(self, name, strategy, cart_id, product_id, options):
+        accepted, errors = [0], [0]
+        lock = threading.Lock()
+        barrier = threading.Barrier(options['threads'])
+
+        def worker():
+            barrier.wait()
+            try:
+                for _ in range(options['adds']):
+                    try:
+                        ok = strategy(cart_id, product_id, 1)
+                    except DatabaseError:
+                        ok = None
+                    with lock:
+                        if ok is None:
+                            errors[0] += 1
+                        elif ok:
+                            accepted[0] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        final = CartItem.objects.filter(cart_id=cart_id, product_id=product_id).values_list(
+            'quantity', flat=True
+        ).first() or 0
+        correct = final == accepted[0] and final <= options['stock']
+        total = options['threads'] * options['adds']
+        line = (
+            f'{name:<18} {total / elapsed:>9.0f} {accepted[0]:>9} {errors[0]:>7} {final:>10} '
+            f'{"yes" if correct else "NO":>8}'
+        )
+        self.stdout.write(self.style.SUCCESS(line) if correct else self.style.ERROR(line))
@@ -0,0 +1,54 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from cart.purge import prune_removed_items, purge_carts, stale_carts
+
+
+class Command(BaseCommand):
+    help = ('Delete carts untouched for --days in short keyset-ordered chunks, optionally archiving their lines, '
+            'and prune old removal records of the rest')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Purge carts not updated for this many days')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Carts per chunk and transaction')
+        parser.add_argument('--archive', action='store_true', help='Copy item lines to ArchivedCartItem first')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between chunks')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the carts that would be purged')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be at least 1')
+        cutoff = timezone.now() - timedelta(days=options['days'])
+
+        if options['dry_run']:
+            self.stdout.write(f'{stale_carts(cutoff).count()} carts not updated since {cutoff:%Y-%m-%d %H:%M}')
+            return
+
+        started = time.perf_counter()
+        carts = items = archived = 0
+        for chunk in purge_carts(cutoff, options['chunk_size'], options['archive'], options['pause']):
+            carts += chunk.carts
+            items += chunk.items
+            archived += chunk.archived
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{carts} carts, {items} items deleted, {archived} lines archived, '
+                f'{(carts + items) / elapsed if elapsed else 0:.0f} rows/sec'
+            )
+
+        # Live carts' removal records past the ?since= window
+        pruned = prune_removed_items(chunk_size=options['chunk_size'])
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Purged {carts} carts and {items} items in {elapsed:.1f}s '
+                f'({(carts + items) / elapsed if elapsed else 0:.0f} rows/sec)'
+                + (f', archived {archived} lines' if options['archive'] else '')
+                + f', pruned {pruned} removal records'
+            )
+        )
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:38
+
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def backfill_totals(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    Cart.objects.update(
+        total_items=Coalesce(models.Subquery(items.annotate(total=models.Sum('quantity')).values('total')), 0),
+        total_price=Coalesce(
+            models.Subquery(items.annotate(
+                total=models.Sum(models.F('quantity') * models.F('product__price'), output_field=price)
+            ).values('total')),
+            Decimal('0'),
+            output_field=price,
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_items',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(backfill_totals, migrations.RunPython.noop),
+    ]
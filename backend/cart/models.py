@@ -1,39 +1,184 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import connections, models
+from django.db.models.functions import Coalesce
 from django.contrib.auth import get_user_model
 from products.models import Product
 from django.utils import timezone
 
 User = get_user_model()
 
+class CartVersionMismatch(Exception):
+    """Raised by CartQuerySet.claim() when the cart is no longer at the expected version."""
+
+    def __init__(self, version):
+        super().__init__(f'Cart is at version {version}')
+        self.version = version
+
+def computed_totals():
+    """Subquery expressions for a cart's item count and price, evaluated per cart row."""
+    items = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+    return {
+        'total_items': Coalesce(
+            models.Subquery(items.annotate(total=models.Sum('quantity')).values('total')),
+            0,
+        ),
+        'total_price': Coalesce(
+            models.Subquery(items.annotate(
+                total=models.Sum(models.F('quantity') * models.F('product__price'),
+                                 output_field=models.DecimalField(max_digits=12, decimal_places=2))
+            ).values('total')),
+            Decimal('0'),
+            output_field=models.DecimalField(max_digits=12, decimal_places=2),
+        ),
+    }
+
+def items_prefetch():
+    return models.Prefetch('items', queryset=CartItem.objects.select_related('product__category'))
+
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        """Prefetch items with their products and categories in two queries."""
+        return self.prefetch_related(items_prefetch())
+
+    def refresh_totals(self):
+        """Recompute the denormalized totals of every cart in the queryset with one UPDATE."""
+        return self.update(updated_at=timezone.now(), **computed_totals())
+
+    def bump_version(self):
+        return self.update(version=models.F('version') + 1)
+
+    def claim(self, user, version=None):
+        """
+        Start a write to the user's cart: bump its version and return it.
+
+        The bump comes first so that it takes the row lock, serializing
+        concurrent writers, and so every item the write touches can be
+        stamped with the new version. With version given this is the
+        If-Match precondition: CartVersionMismatch unless the cart is at
+        exactly that version (0 for a cart that does not exist yet).
+        """
+        carts = self.filter(user=user)
+        if version is not None:
+            carts = carts.filter(version=version)
+        if carts.bump_version():
+            return self.get(user=user)
+        cart, created = self.get_or_create(user=user, defaults={'version': 1})
+        if created:
+            if version not in (None, 0):
+                raise CartVersionMismatch(0)
+            return cart
+        if version is not None:
+            raise CartVersionMismatch(cart.version)
+        # No precondition, and a concurrent request created the cart after the bump above missed it
+        self.filter(pk=cart.pk).bump_version()
+        return self.get(pk=cart.pk)
+
 class Cart(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized from the items; kept current by refresh_totals() in every cart write
+    total_items = models.PositiveIntegerField(default=0, editable=False)
+    total_price = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False)
+    # Bumped by every write (CartQuerySet.claim); items and removals record the version that touched them
+    version = models.PositiveBigIntegerField(default=0, editable=False)
+
+    objects = CartQuerySet.as_manager()
 
     class Meta:
         ordering = ['-updated_at']
+        # Keyset scans for stale carts (cart.purge)
+        indexes = [models.Index(fields=['updated_at', 'id'], name='cart_updated_at_idx')]
 
     def __str__(self):
         return f"Cart for {self.user.username}"
 
-    @property
-    def total_items(self):
-        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
+    def refresh_totals(self):
+        Cart.objects.filter(pk=self.pk).refresh_totals()
+        self.refresh_from_db(fields=['total_items', 'total_price', 'updated_at'])
 
-    @property
-    def total_price(self):
-        total = 0
-        for item in self.items.all():
-            total += item.subtotal
-        return total
+class CartItemQuerySet(models.QuerySet):
+    """
+    Stock-checked quantity changes as single conditional statements.
+
+    Each method reports success from the affected row count instead of
+    reading quantity and stock first, so concurrent requests cannot lose
+    an update or push a cart past the product's stock.
+    """
+
+    def with_stock(self):
+        return self.alias(stock=models.Subquery(
+            Product.objects.filter(pk=models.OuterRef('product_id')).order_by().values('stock')[:1]
+        ))
+
+    def add_quantity(self, cart_id, product_id, quantity, version=0):
+        """Add to the cart's line for a product, creating it if needed. Returns False if stock is short."""
+        if (self.increment(cart_id, product_id, quantity, version)
+                or self.insert_if_in_stock(cart_id, product_id, quantity, version)):
+            return True
+        # Either stock is short or a concurrent request created the line first
+        return bool(self.increment(cart_id, product_id, quantity, version))
+
+    def increment(self, cart_id, product_id, quantity, version=0):
+        return self.with_stock().filter(
+            cart_id=cart_id, product_id=product_id, stock__gte=models.F('quantity') + quantity,
+        ).update(quantity=models.F('quantity') + quantity, version=version, updated_at=timezone.now())
+
+    def set_quantity(self, pk, quantity, version=0):
+        """Set a line's quantity if the product has that much stock. Returns the affected row count."""
+        return self.with_stock().filter(pk=pk, stock__gte=quantity).update(
+            quantity=quantity, version=version, updated_at=timezone.now()
+        )
+
+    def insert_if_in_stock(self, cart_id, product_id, quantity, version=0):
+        """INSERT ... SELECT ... ON CONFLICT DO NOTHING; 0 when stock is short or the line exists."""
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(CartItem._meta.db_table)} '
+                f'(cart_id, product_id, quantity, version, created_at, updated_at) '
+                f'SELECT %s, id, %s, %s, %s, %s FROM {quote(Product._meta.db_table)} '
+                f'WHERE id = %s AND is_active AND stock >= %s '
+                f'ON CONFLICT (cart_id, product_id) DO NOTHING',
+                [cart_id, quantity, version, now, now, product_id, quantity],
+            )
+            return cursor.rowcount
+
+    def stamp(self):
+        """Mark the items as changed in their cart's current version (run after claiming the cart)."""
+        return self.update(version=models.Subquery(
+            Cart.objects.filter(pk=models.OuterRef('cart_id')).order_by().values('version')[:1]
+        ))
+
+    def remove(self):
+        """Delete the items, leaving RemovedCartItem rows stamped with their cart's current version."""
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        select, params = self.order_by().values('pk', 'cart_id', 'cart__version').query.sql_with_params()
+        with connection.cursor() as cursor:
+            # INSERT ... SELECT, so the statement count does not grow with the number of items
+            cursor.execute(
+                f'INSERT INTO {quote(RemovedCartItem._meta.db_table)} (item_id, cart_id, version) {select}',
+                params,
+            )
+            removed = cursor.rowcount
+        if removed:
+            self.delete()
+        return removed
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
+    version = models.PositiveBigIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('cart', 'product')
         ordering = ['-created_at']
@@ -51,3 +196,39 @@ class CartItem(models.Model):
             raise ValidationError("Quantity must be greater than 0")
         if self.product.stock < self.quantity:
             raise ValidationError(f"Only {self.product.stock} items available in stock")
+
+# Removal tombstones are kept for this many versions of their cart; cart.purge prunes older ones,
+# and a ?since= further back than this is answered with the whole cart
+REMOVED_ITEMS_WINDOW = 100
+
+class RemovedCartItem(models.Model):
+    """Tombstone for a deleted CartItem, so ?since= cart deltas can report the removal."""
+    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='removed_items')
+    item_id = models.PositiveBigIntegerField()
+    version = models.PositiveBigIntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['cart', 'version'], name='cart_removed_version_idx')]
+
+    def __str__(self):
+        return f"Item {self.item_id} removed at version {self.version}"
+
+class ArchivedCartItem(models.Model):
+    """
+    A line of a purged cart, kept for analytics.
+
+    Deliberately compact: plain ids instead of foreign keys and no
+    secondary indexes, so archiving costs one INSERT ... SELECT per chunk
+    and never blocks deletes elsewhere.
+    """
+    cart_id = models.BigIntegerField()
+    user_id = models.BigIntegerField()
+    product_id = models.BigIntegerField()
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    added_at = models.DateTimeField()
+    abandoned_at = models.DateTimeField()  # The cart's last update
+    archived_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.quantity}x product {self.product_id} from cart {self.cart_id}"
@@ -0,0 +1,99 @@
+"""
+Deletion of abandoned carts, for the purge_carts command or any scheduler.
+
+Carts not written to since a cutoff (by updated_at) are found with a
+keyset scan over the (updated_at, id) index and deleted in chunks, each
+in its own short transaction. Inside the transaction a chunk is re-read
+with SELECT ... FOR UPDATE SKIP LOCKED and the cutoff re-checked, so a
+cart that a request is writing to, or that was touched after the scan,
+is left alone, and two purges running at once never fight over rows.
+Optionally the chunk's item lines are first copied to ArchivedCartItem.
+
+Live carts keep a RemovedCartItem tombstone per removed line for ?since=
+deltas. prune_removed_items() deletes the ones REMOVED_ITEMS_WINDOW or
+more versions behind their cart, in chunks, so the table stays bounded
+by the number of carts rather than growing with every removal.
+"""
+import time
+from dataclasses import dataclass
+
+from django.db import connections, models, transaction
+from django.utils import timezone
+
+from .models import REMOVED_ITEMS_WINDOW, ArchivedCartItem, Cart, CartItem, RemovedCartItem
+
+
+@dataclass
+class ChunkResult:
+    carts: int = 0
+    items: int = 0
+    archived: int = 0
+
+
+def stale_carts(cutoff):
+    return Cart.objects.filter(updated_at__lt=cutoff)
+
+
+def purge_carts(cutoff, chunk_size=1000, archive=False, pause=0):
+    """Delete carts untouched since cutoff; yields a ChunkResult per chunk."""
+    last = None
+    while True:
+        carts = stale_carts(cutoff).order_by('updated_at', 'id')
+        if last is not None:
+            carts = carts.filter(
+                models.Q(updated_at__gt=last[0]) | models.Q(updated_at=last[0], id__gt=last[1])
+            )
+        keys = list(carts.values_list('updated_at', 'id')[:chunk_size])
+        if not keys:
+            return
+        last = keys[-1]
+        yield purge_chunk([pk for _, pk in keys], cutoff, archive)
+        if pause:
+            time.sleep(pause)  # Let live traffic have the tables between chunks
+
+
+def purge_chunk(ids, cutoff, archive=False):
+    with transaction.atomic():
+        ids = list(
+            stale_carts(cutoff).filter(pk__in=ids).select_for_update(skip_locked=True)
+            .order_by().values_list('pk', flat=True)
+        )
+        if not ids:
+            return ChunkResult()
+        archived = archive_items(ids) if archive else 0
+        deleted, per_model = Cart.objects.filter(pk__in=ids).delete()
+    return ChunkResult(
+        carts=per_model.get(Cart._meta.label, 0),
+        items=per_model.get(CartItem._meta.label, 0),
+        archived=archived,
+    )
+
+
+def prune_removed_items(window=REMOVED_ITEMS_WINDOW, chunk_size=1000):
+    """Delete removal tombstones window or more versions behind their cart; returns how many."""
+    pruned = 0
+    while True:
+        ids = list(
+            RemovedCartItem.objects.filter(version__lte=models.F('cart__version') - window)
+            .order_by().values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return pruned
+        pruned += RemovedCartItem.objects.filter(pk__in=ids).delete()[0]
+
+
+def archive_items(cart_ids):
+    """Copy the carts' lines into ArchivedCartItem with one INSERT ... SELECT."""
+    lines = CartItem.objects.filter(cart_id__in=cart_ids).order_by().values(
+        'cart_id', 'cart__user_id', 'product_id', 'quantity', 'product__price', 'created_at', 'cart__updated_at',
+        archived_at=models.Value(timezone.now(), output_field=models.DateTimeField()),
+    )
+    select, params = lines.query.sql_with_params()
+    connection = connections[lines.db]
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(column) for column in (
+        'cart_id', 'user_id', 'product_id', 'quantity', 'unit_price', 'added_at', 'abandoned_at', 'archived_at',
+    ))
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(ArchivedCartItem._meta.db_table)} ({columns}) {select}', params)
+        return cursor.rowcount
@@ -1,8 +1,22 @@
 from rest_framework import serializers
 from .models import Cart, CartItem
+from products.loaders import get_product_loader
 from products.serializers import ProductSerializer
 
-class CartItemSerializer(serializers.ModelSerializer):
+class ProductLookupMixin:
+    """Product lookups through the request's shared ProductLoader."""
+
+    @property
+    def product_loader(self):
+        if not hasattr(self, '_product_loader'):
+            self._product_loader = get_product_loader(self.context.get('request'))
+        return self._product_loader
+
+    def get_active_product(self, pk):
+        product = self.product_loader.load(pk)
+        return product if product is not None and product.is_active else None
+
+class CartItemSerializer(ProductLookupMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     product_id = serializers.IntegerField(write_only=True)
     subtotal = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -18,35 +32,56 @@ class CartItemSerializer(serializers.ModelSerializer):
         return value
 
     def validate_product_id(self, value):
-        from products.models import Product
-        try:
-            product = Product.objects.get(id=value, is_active=True)
-        except Product.DoesNotExist:
+        if self.get_active_product(value) is None:
             raise serializers.ValidationError("Product not found or not available")
         return value
 
     def validate(self, data):
         if 'product_id' in data and 'quantity' in data:
-            from products.models import Product
-            try:
-                product = Product.objects.get(id=data['product_id'], is_active=True)
-                if product.stock < data['quantity']:
-                    raise serializers.ValidationError(f"Only {product.stock} items available in stock")
-            except Product.DoesNotExist:
+            product = self.get_active_product(data['product_id'])
+            if product is None:
                 raise serializers.ValidationError("Product not found")
+            if product.stock < data['quantity']:
+                raise serializers.ValidationError(f"Only {product.stock} items available in stock")
         return data
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     total_items = serializers.IntegerField(read_only=True)
-    total_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
 
     class Meta:
         model = Cart
-        fields = ['id', 'items', 'total_items', 'total_price', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'version', 'items', 'total_items', 'total_price', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'version', 'created_at', 'updated_at']
+
+class CartDeltaSerializer(serializers.ModelSerializer):
+    """Items added or changed after version context['since'], ids of items removed after it, and the totals"""
+    since = serializers.SerializerMethodField()
+    items = serializers.SerializerMethodField()
+    removed = serializers.SerializerMethodField()
+    total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+    class Meta:
+        model = Cart
+        fields = ['id', 'version', 'since', 'items', 'removed', 'total_items', 'total_price', 'updated_at']
+        read_only_fields = fields
 
-class AddToCartSerializer(serializers.Serializer):
+    def get_since(self, cart):
+        return self.context['since']
+
+    def get_items(self, cart):
+        if self.context['since'] >= cart.version:
+            return []
+        items = cart.items.filter(version__gt=self.context['since']).select_related('product__category')
+        return CartItemSerializer(items, many=True).data
+
+    def get_removed(self, cart):
+        if self.context['since'] >= cart.version:
+            return []
+        return list(cart.removed_items.filter(version__gt=self.context['since']).values_list('item_id', flat=True))
+
+class AddToCartSerializer(ProductLookupMixin, serializers.Serializer):
     product_id = serializers.IntegerField()
     quantity = serializers.IntegerField(default=1)
 
@@ -56,19 +91,34 @@ class AddToCartSerializer(serializers.Serializer):
         return value
 
     def validate_product_id(self, value):
-        from products.models import Product
-        try:
-            product = Product.objects.get(id=value, is_active=True)
-        except Product.DoesNotExist:
+        if self.get_active_product(value) is None:
             raise serializers.ValidationError("Product not found or not available")
         return value
 
     def validate(self, data):
-        from products.models import Product
-        try:
-            product = Product.objects.get(id=data['product_id'], is_active=True)
-            if product.stock < data['quantity']:
-                raise serializers.ValidationError(f"Only {product.stock} items available in stock")
-        except Product.DoesNotExist:
+        product = self.get_active_product(data['product_id'])
+        if product is None:
             raise serializers.ValidationError("Product not found")
+        if product.stock < data['quantity']:
+            raise serializers.ValidationError(f"Only {product.stock} items available in stock")
         return data
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=['add', 'set', 'remove'])
+    product_id = serializers.IntegerField(required=False)
+    item_id = serializers.IntegerField(required=False)
+    quantity = serializers.IntegerField(required=False, min_value=0)
+
+    def validate(self, data):
+        if ('product_id' in data) == ('item_id' in data):
+            raise serializers.ValidationError("Provide either product_id or item_id")
+        if data['op'] == 'add':
+            data.setdefault('quantity', 1)
+            if data['quantity'] <= 0:
+                raise serializers.ValidationError("Quantity must be greater than 0")
+        elif data['op'] == 'set' and 'quantity' not in data:
+            raise serializers.ValidationError("Quantity is required")
+        return data
+
+class CartBatchSerializer(serializers.Serializer):
+    operations = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=100)
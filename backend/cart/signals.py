@@ -0,0 +1,52 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete
+from django.dispatch import receiver
+
+from products.models import Product
+from . import guest
+from .models import Cart, CartItem
+
+# Carts store their totals, so product price changes and deletions have to reach them.
+
+
+def reprice(products):
+    """Bring the carts holding products up to their current prices; for writes that skip post_save."""
+    carts = Cart.objects.filter(items__product__in=products)
+    carts.bump_version()
+    CartItem.objects.filter(product__in=products).stamp()  # Subtotals changed
+    carts.refresh_totals()
+
+
+@receiver(post_init, sender=Product)
+def remember_loaded_price(sender, instance, **kwargs):
+    instance._cart_loaded_price = instance.__dict__.get('price')
+
+
+@receiver(post_save, sender=Product)
+def reprice_carts(sender, instance, created=False, raw=False, **kwargs):
+    price = instance.__dict__.get('price')  # Deferred means it was not changed
+    if not created and not raw and price is not None and price != instance._cart_loaded_price:
+        reprice([instance])
+    instance._cart_loaded_price = price
+
+
+@receiver(pre_delete, sender=Product)
+def remove_product_from_carts(sender, instance, **kwargs):
+    instance._cart_ids = list(Cart.objects.filter(items__product=instance).values_list('pk', flat=True))
+    if instance._cart_ids:
+        # Removed here rather than by the cascade so that the carts' deltas report it
+        Cart.objects.filter(pk__in=instance._cart_ids).bump_version()
+        CartItem.objects.filter(product=instance).remove()
+
+
+@receiver(post_delete, sender=Product)
+def refresh_product_carts(sender, instance, **kwargs):
+    cart_ids = getattr(instance, '_cart_ids', None)
+    if cart_ids:
+        Cart.objects.filter(pk__in=cart_ids).refresh_totals()
+
+
+@receiver(user_logged_in)
+def merge_guest_cart(sender, request, user, **kwargs):
+    if request is not None:
+        guest.merge_into(user, request)
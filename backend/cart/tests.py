@@ -1,3 +1,339 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order, OrderItem
+from payments.models import Payment
+from products.models import Category, Product
+from . import guest, purge
+from .models import (
+    REMOVED_ITEMS_WINDOW, ArchivedCartItem, Cart, CartItem, CartQuerySet, CartVersionMismatch, RemovedCartItem,
+)
+
+User = get_user_model()
+
+
+class CartTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='cart-shopper', email='cart@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Cart', slug='cart')
+        self.lamp = Product.objects.create(name='Lamp', price=Decimal('12.50'), stock=2, category=category)
+        self.rug = Product.objects.create(name='Rug', price=Decimal('40.00'), stock=10, category=category)
+
+    def add(self, product, quantity=1, **headers):
+        return self.client.post(reverse('cart:add_to_cart'), {'product_id': product.pk, 'quantity': quantity},
+                                format='json', headers=headers)
+
+
+class CartVersionTests(CartTestCase):
+    """Every write bumps the cart version; If-Match guards writes and ?since= returns deltas."""
+
+    def test_adding_more_than_the_remaining_stock_is_a_400_and_changes_nothing(self):
+        self.assertEqual(self.add(self.lamp).status_code, 200)
+        version = Cart.objects.get(user=self.user).version
+
+        response = self.add(self.lamp, 2)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], 'Cannot add 2 items. Only 1 more available.')
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 1)
+        self.assertEqual(Cart.objects.get(user=self.user).version, version)
+
+    def test_if_match_rejects_writes_to_a_cart_that_moved_on(self):
+        first = self.add(self.lamp)
+        etag = first['ETag']
+        self.assertEqual(self.add(self.rug, **{'If-Match': etag}).status_code, 200)
+
+        response = self.add(self.rug, **{'If-Match': etag})  # Stale: the cart is a version further
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(response.data['version'], Cart.objects.get(user=self.user).version)
+        self.assertEqual(CartItem.objects.get(product=self.rug).quantity, 1)
+
+        self.assertEqual(self.client.get(reverse('cart:cart'), headers={'If-None-Match': response['ETag']})
+                         .status_code, 304)
+
+    def test_since_returns_only_the_changes_after_a_version(self):
+        version = self.add(self.lamp).data['cart']['version']
+        rug = self.add(self.rug).data['cart']
+        lamp_item = CartItem.objects.get(product=self.lamp)
+        self.client.delete(reverse('cart:remove_cart_item', args=[lamp_item.pk]))
+
+        response = self.client.get(reverse('cart:cart'), {'since': version})
+        self.assertEqual(response.data['since'], version)
+        self.assertEqual([item['product']['id'] for item in response.data['items']], [self.rug.pk])
+        self.assertEqual(response.data['removed'], [lamp_item.pk])
+        self.assertEqual(response.data['total_items'], 1)
+
+        response = self.client.get(reverse('cart:cart'), {'since': rug['version'] + 5})  # Unknown: full cart
+        self.assertNotIn('since', response.data)
+
+        # Removals further back than the window may be pruned, so those versions get the full cart too
+        Cart.objects.filter(user=self.user).update(version=F('version') + REMOVED_ITEMS_WINDOW)
+        self.assertNotIn('since', self.client.get(reverse('cart:cart'), {'since': version}).data)
+        self.assertIn('since', self.client.get(reverse('cart:cart'), {'since': rug['version'] + 5}).data)
+
+    def created_meanwhile(self):
+        """Make claim's first bump find no cart, as if another request created the cart just after it."""
+        bump = CartQuerySet.bump_version
+        misses = iter([True])
+        return mock.patch.object(CartQuerySet, 'bump_version', autospec=True,
+                                 side_effect=lambda carts: 0 if next(misses, False) else bump(carts))
+
+    def test_a_cart_created_concurrently_is_claimed_without_if_match(self):
+        cart = Cart.objects.create(user=self.user, version=3)
+        with self.created_meanwhile():
+            self.assertEqual(Cart.objects.claim(self.user).version, 4)
+        with self.created_meanwhile(), self.assertRaises(CartVersionMismatch):
+            Cart.objects.claim(self.user, version=3)  # The precondition named a version; the cart is at 4
+        cart.refresh_from_db()
+        self.assertEqual(cart.version, 4)
+
+
+class AddToCartTests(CartTestCase):
+    """Adding to the cart reads each product once and checks stock in the write itself."""
+
+    def test_adding_reads_the_product_once(self):
+        self.add(self.rug)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.add(self.lamp).status_code, 200)
+        reads = [query['sql'] for query in queries.captured_queries
+                 if query['sql'].startswith('SELECT') and 'FROM "products_product"' in query['sql']]
+        self.assertEqual(len(reads), 1, reads)
+
+    def sold_meanwhile(self, product, stock):
+        """Make another request sell product down to stock between this request's read and its write."""
+        claim = Cart.objects.claim
+
+        def claim_after_the_sale(*args, **kwargs):
+            Product.objects.filter(pk=product.pk).update(stock=stock)
+            return claim(*args, **kwargs)
+        return mock.patch.object(Cart.objects, 'claim', side_effect=claim_after_the_sale)
+
+    def test_stock_sold_between_the_read_and_the_write_is_not_oversold(self):
+        self.add(self.lamp)
+        with self.sold_meanwhile(self.rug, 1):
+            response = self.add(self.rug, 2)  # The product read still said 10
+        self.assertEqual(response.data['error'], 'Only 1 items available in stock')
+        self.assertFalse(CartItem.objects.filter(product=self.rug).exists())
+
+        self.add(self.rug)
+        with self.sold_meanwhile(self.rug, 1):
+            response = self.add(self.rug)
+        self.assertEqual(response.data['error'], 'Cannot add 1 items. Only 0 more available.')
+
+        item = CartItem.objects.get(product=self.rug)
+        Product.objects.filter(pk=self.rug.pk).update(stock=10)
+        with self.sold_meanwhile(self.rug, 2):
+            response = self.client.put(reverse('cart:update_cart_item', args=[item.pk]), {'quantity': 3},
+                                       format='json')
+        self.assertEqual(response.data['error'], 'Only 2 items available in stock')
+        self.assertEqual(CartItem.objects.get(pk=item.pk).quantity, 1)
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 2)
+
+    def test_paid_orders_take_stock_down_to_zero_at_most(self):
+        self.rug.delete()
+        payment = Payment.objects.create(user=self.user, stripe_checkout_session_id='cs_race', amount=Decimal('1'),
+                                         product_name='Race')
+        Order.objects.place(payment, [OrderItem.snapshot('Lamp', '12.50', 2, product=self.lamp),
+                                      OrderItem.snapshot('Lamp', '12.50', 1, product=self.lamp)])
+        self.assertEqual(OrderItem.objects.filter(order__payment=payment).decrement_stock(), 1)
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 0)
+
+
+class CartBatchTests(CartTestCase):
+    """Batched operations apply in order; failed ones are reported and skipped, the rest written at once."""
+
+    def batch(self, *operations):
+        return self.client.post(reverse('cart:batch_update_cart'), {'operations': list(operations)}, format='json')
+
+    def test_operations_apply_in_order_and_failures_are_skipped(self):
+        self.add(self.lamp)
+        lamp_item = CartItem.objects.get(product=self.lamp)
+        response = self.batch(
+            {'op': 'add', 'product_id': self.rug.pk, 'quantity': 4},
+            {'op': 'set', 'item_id': lamp_item.pk, 'quantity': 3},  # Only 2 in stock
+            {'op': 'add', 'product_id': self.lamp.pk},
+            {'op': 'set', 'product_id': self.rug.pk, 'quantity': 1},
+            {'op': 'remove', 'product_id': 404},
+            {'op': 'explode', 'product_id': self.rug.pk},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(result['status'], result.get('quantity')) for result in response.data['results']], [
+            ('ok', 4), ('error', None), ('ok', 2), ('ok', 1), ('error', None), ('error', None),
+        ])
+        self.assertEqual(response.data['results'][1]['error'], 'Only 2 items available in stock')
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(dict(cart.items.values_list('product__name', 'quantity')), {'Lamp': 2, 'Rug': 1})
+        self.assertEqual((cart.total_items, cart.total_price), (3, Decimal('65.00')))
+        self.assertEqual(CartItem.objects.get(product=self.lamp).pk, lamp_item.pk)
+
+        response = self.batch({'op': 'remove', 'item_id': lamp_item.pk}, {'op': 'set', 'product_id': self.rug.pk,
+                                                                          'quantity': 0})
+        self.assertEqual(response.data['cart']['total_items'], 0)
+        self.assertEqual(response.data['cart']['version'], cart.version + 1)  # One version per batch
+
+    def test_the_query_count_does_not_grow_with_the_batch(self):
+        self.add(self.lamp)
+        self.add(self.rug)
+        extra = [Product.objects.create(name=f'Extra {i}', price=Decimal('1.00'), stock=5) for i in range(6)]
+        with CaptureQueriesContext(connection) as small:  # One insert, update and removal
+            self.batch({'op': 'add', 'product_id': extra[0].pk},
+                       {'op': 'set', 'product_id': self.lamp.pk, 'quantity': 2},
+                       {'op': 'remove', 'product_id': self.rug.pk})
+        with CaptureQueriesContext(connection) as large:
+            self.batch(*[{'op': 'add', 'product_id': product.pk, 'quantity': 2} for product in extra[1:]],
+                       {'op': 'set', 'product_id': extra[0].pk, 'quantity': 4},
+                       {'op': 'add', 'product_id': extra[0].pk},
+                       {'op': 'remove', 'product_id': self.lamp.pk})
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 15)
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(self.batch(*[{'op': 'add', 'product_id': self.rug.pk}] * 101).status_code, 400)
+
+class CartRepricingTests(CartTestCase):
+    """Stored cart totals follow product prices, however the price changes."""
+
+    def setUp(self):
+        super().setUp()
+        self.add(self.lamp, 2)
+        self.add(self.rug)
+        self.cart = Cart.objects.get(user=self.user)
+
+    def assertTotal(self, total, version):
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_price, self.cart.version), (Decimal(total), version))
+
+    def test_saving_a_new_price_refreshes_the_carts_holding_the_product(self):
+        version = self.cart.version
+        self.lamp.stock = 1
+        self.lamp.save()  # Same price: nothing to do
+        self.assertTotal('65.00', version)
+
+        self.lamp.price = Decimal('10.00')
+        self.lamp.save()
+        self.assertTotal('60.00', version + 1)
+        self.assertEqual(CartItem.objects.get(product=self.lamp).version, version + 1)
+
+    def test_imported_prices_refresh_the_carts_holding_the_products(self):
+        Product.objects.filter(pk=self.lamp.pk).update(sku='LAMP')
+        Product.objects.filter(pk=self.rug.pk).update(sku='RUG')
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = Path(directory) / 'feed.csv'
+        path.write_text('sku,name,price,stock\nLAMP,Lamp,15.00,2\nRUG,Rug,40.00,10\n')
+        version = self.cart.version
+
+        call_command('import_products', str(path), stdout=StringIO())
+        self.assertTotal('70.00', version + 1)
+        self.assertEqual(self.client.get(reverse('cart:cart')).data['total_price'], '70.00')
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class GuestCartTests(CartTestCase):
+    """Anonymous carts live behind a signed cookie and are merged into the user's cart on login."""
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user.set_password('guest-pass-123')
+        self.user.save()
+        self.guest = APIClient()
+
+    def test_guest_lines_merge_on_login_capped_at_stock(self):
+        self.add(self.lamp)  # Already in the user's own cart
+        for product, quantity in ((self.lamp, 2), (self.rug, 3)):
+            response = self.guest.post(reverse('cart:add_to_cart'), {'product_id': product.pk, 'quantity': quantity},
+                                       format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.guest.get(reverse('cart:cart')).data['total_items'], 5)
+        token = self.guest.cookies[guest.COOKIE_NAME].value
+
+        response = self.guest.post(reverse('login'), {'username': 'cart-shopper', 'password': 'guest-pass-123'})
+        self.assertEqual(response.status_code, 200)
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(dict(cart.items.values_list('product__name', 'quantity')), {'Lamp': 2, 'Rug': 3})
+        self.assertEqual((cart.total_items, cart.total_price), (5, Decimal('145.00')))
+        self.assertIsNone(cache.get(guest.CACHE_KEY.format(token.split(':')[0])))
+
+        response = self.guest.post(reverse('login'), {'username': 'cart-shopper', 'password': 'guest-pass-123'})
+        self.assertEqual(Cart.objects.get(user=self.user).total_items, 5)  # Nothing left to merge twice
+
+    def test_a_tampered_cookie_is_an_empty_cart(self):
+        self.guest.post(reverse('cart:add_to_cart'), {'product_id': self.rug.pk}, format='json')
+        self.guest.cookies[guest.COOKIE_NAME] = 'forged:token'
+        self.assertEqual(self.guest.get(reverse('cart:cart')).data['total_items'], 0)
+
+    def test_only_listed_origins_may_send_the_cookie(self):
+        for origin, allowed in (('http://localhost:3000', True), ('https://shop-base-xi.vercel.app', True),
+                                ('https://evil.example.com', False)):
+            response = self.guest.options(reverse('cart:add_to_cart'), headers={
+                'Origin': origin, 'Access-Control-Request-Method': 'POST',
+            })
+            self.assertEqual(response.get('Access-Control-Allow-Origin'), origin if allowed else None)
+            self.assertEqual(response.get('Access-Control-Allow-Credentials'), 'true' if allowed else None)
+
+
+class PurgeCartsTests(CartTestCase):
+    """purge_carts deletes carts untouched since the cutoff in chunks, optionally archiving their lines."""
+
+    def setUp(self):
+        super().setUp()
+        self.carts = []
+        for i in range(5):
+            cart = Cart.objects.create(user=User.objects.create(username=f'purge-{i}'))
+            CartItem.objects.create(cart=cart, product=self.lamp, quantity=1)
+            CartItem.objects.create(cart=cart, product=self.rug, quantity=2)
+            self.carts.append(cart)
+        # The first three were abandoned 40 days ago
+        Cart.objects.filter(pk__in=[cart.pk for cart in self.carts[:3]]).update(
+            updated_at=timezone.now() - timedelta(days=40))
+
+    def call(self, *args):
+        out = StringIO()
+        call_command('purge_carts', '--chunk-size=2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_stale_carts_are_purged_in_chunks_and_archived(self):
+        self.assertIn('3 carts not updated since', self.call('--dry-run'))
+        self.assertEqual(Cart.objects.count(), 5)
+
+        output = self.call('--archive')
+        self.assertIn('2 carts, 4 items deleted, 4 lines archived', output)  # The first chunk
+        self.assertIn('Purged 3 carts and 6 items', output)
+        self.assertEqual(set(Cart.objects.values_list('pk', flat=True)), {cart.pk for cart in self.carts[3:]})
+        self.assertEqual(CartItem.objects.count(), 4)
+        archived = ArchivedCartItem.objects.filter(cart_id=self.carts[0].pk, product_id=self.rug.pk).get()
+        self.assertEqual((archived.user_id, archived.quantity, archived.unit_price),
+                         (self.carts[0].user_id, 2, Decimal('40.00')))
+
+    def test_removal_records_past_the_window_are_pruned(self):
+        cart = self.carts[3]
+        RemovedCartItem.objects.bulk_create([
+            RemovedCartItem(cart=cart, item_id=1, version=1),
+            RemovedCartItem(cart=cart, item_id=2, version=REMOVED_ITEMS_WINDOW + 1),
+        ])
+        Cart.objects.filter(pk=cart.pk).update(version=REMOVED_ITEMS_WINDOW + 1)
+        self.assertIn('pruned 1 removal records', self.call())
+        self.assertEqual(list(RemovedCartItem.objects.values_list('item_id', flat=True)), [2])
+
+    def test_a_cart_touched_after_the_scan_is_left_alone(self):
+        stale = [cart.pk for cart in self.carts[:3]]
+        Cart.objects.filter(pk=stale[0]).refresh_totals()  # A request wrote to it meanwhile
+        result = purge.purge_chunk(stale, timezone.now() - timedelta(days=30))
+        self.assertEqual((result.carts, result.items, result.archived), (2, 4, 0))
+        self.assertTrue(Cart.objects.filter(pk=stale[0]).exists())
+        self.assertFalse(ArchivedCartItem.objects.exists())
@@ -1,64 +1,131 @@
 from rest_framework import generics, permissions, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, prefetch_related_objects
 from django.shortcuts import get_object_or_404
-from .models import Cart, CartItem
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_etags
+from . import batch
+from .guest import GuestCart
+from .models import REMOVED_ITEMS_WINDOW, Cart, CartItem, CartVersionMismatch, items_prefetch
+from products.loaders import get_product_loader
 from products.models import Product
-from .serializers import CartSerializer, CartItemSerializer, AddToCartSerializer
+from .serializers import (
+    CartSerializer, CartDeltaSerializer, CartItemSerializer, AddToCartSerializer, CartBatchSerializer
+)
+from shopbase.querybudget import query_budget
+
+# Carts carry a version that every write bumps. Responses send it as the ETag;
+# mutations honour If-Match (412 when the cart moved on), and ?since=<version>
+# returns only the items changed or removed after that version.
+
+def make_etag(version):
+    return f'"{version}"'
+
+def requested_version(request):
+    """The cart version named by If-Match, or None when the header is absent or '*'."""
+    etags = parse_etags(request.headers.get('If-Match', ''))
+    if not etags or etags == ['*']:
+        return None
+    try:
+        return int(etags[0].removeprefix('W/').strip('"'))
+    except ValueError:
+        return -1  # Matches no version
+
+def since_version(request):
+    try:
+        return int(request.query_params['since'])
+    except (KeyError, ValueError):
+        return None
+
+def cart_data(cart, since=None):
+    """
+    The serialized cart, or only its changes after version since when that
+    is a version it had within the last REMOVED_ITEMS_WINDOW, whose removals
+    are still on record.
+    """
+    if since is not None and max(cart.version - REMOVED_ITEMS_WINDOW, 0) <= since <= cart.version:
+        return CartDeltaSerializer(cart, context={'since': since}).data
+    prefetch_related_objects([cart], items_prefetch())
+    return CartSerializer(cart).data
+
+def changes_since(request, cart):
+    """With ?since=, the cart delta for responses that otherwise leave the cart out."""
+    since = since_version(request)
+    return {'cart': cart_data(Cart.objects.get(pk=cart.pk), since)} if since is not None else {}
+
+def with_version(response, version):
+    response['ETag'] = make_etag(version)
+    return response
+
+def version_mismatch(exc):
+    return with_version(Response({
+        'error': 'Cart has been changed since the given version',
+        'version': exc.version
+    }, status=status.HTTP_412_PRECONDITION_FAILED), exc.version)
 
 class CartView(generics.RetrieveAPIView):
     """Get current user's cart"""
     serializer_class = CartSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.AllowAny]  # Anonymous visitors get a cache-backed guest cart
+    query_budget = 3
 
-    def get_object(self):
-        cart, created = Cart.objects.get_or_create(user=self.request.user)
-        return cart
+    def retrieve(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return Response(self.get_serializer(GuestCart.load(request).snapshot()).data)
+        cart, created = Cart.objects.get_or_create(user=request.user)
+        response = get_conditional_response(request, etag=make_etag(cart.version))
+        if response is None:
+            response = Response(cart_data(cart, since_version(request)))
+        return with_version(response, cart.version)
 
+@query_budget(13)  # A shopper's first add also creates their cart
 @api_view(['POST'])
-@permission_classes([permissions.IsAuthenticated])
+@permission_classes([permissions.AllowAny])
 def add_to_cart(request):
     """Add product to cart or update quantity"""
-    serializer = AddToCartSerializer(data=request.data)
+    serializer = AddToCartSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         product_id = serializer.validated_data['product_id']
         quantity = serializer.validated_data['quantity']
         
         try:
-            product = Product.objects.get(id=product_id, is_active=True)
-            cart, created = Cart.objects.get_or_create(user=request.user)
-            
-            # Check if item already exists in cart
-            cart_item, item_created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={'quantity': quantity}
-            )
+            product = serializer.get_active_product(product_id)
+            if product is None:
+                raise Product.DoesNotExist
+            if not request.user.is_authenticated:
+                return add_to_guest_cart(request, product, quantity)
+            with transaction.atomic():
+                cart = Cart.objects.claim(request.user, requested_version(request))
             
-            if not item_created:
-                # Update existing item quantity
-                new_quantity = cart_item.quantity + quantity
-                if new_quantity > product.stock:
+                # One conditional UPDATE or INSERT; no read-modify-write of quantity or stock
+                if not CartItem.objects.add_quantity(cart.pk, product.pk, quantity, cart.version):
+                    # Re-read stock, which may have dropped since the product was loaded, and the line
+                    # before marking the rollback; no queries may run in the block after that
+                    stock, in_cart = Product.objects.filter(pk=product.pk).values_list('stock', Subquery(
+                        CartItem.objects.filter(cart=cart, product=OuterRef('pk')).values('quantity')[:1]
+                    )).get()
+                    transaction.set_rollback(True)
+                    if in_cart:
+                        return Response({
+                            'error': f'Cannot add {quantity} items. Only {max(stock - in_cart, 0)} more available.'
+                        }, status=status.HTTP_400_BAD_REQUEST)
                     return Response({
-                        'error': f'Cannot add {quantity} items. Only {product.stock - cart_item.quantity} more available.'
-                    }, status=status.HTTP_400_BAD_REQUEST)
-                cart_item.quantity = new_quantity
-                cart_item.save()
-            else:
-                # Validate stock for new item
-                if quantity > product.stock:
-                    cart_item.delete()  # Remove the created item
-                    return Response({
-                        'error': f'Only {product.stock} items available in stock'
+                        'error': f'Only {stock} items available in stock'
                     }, status=status.HTTP_400_BAD_REQUEST)
+                Cart.objects.filter(pk=cart.pk).refresh_totals()
             
             # Return updated cart
-            cart_serializer = CartSerializer(cart)
-            return Response({
+            cart = Cart.objects.get(pk=cart.pk)
+            return with_version(Response({
                 'message': 'Product added to cart successfully',
-                'cart': cart_serializer.data
-            }, status=status.HTTP_200_OK)
+                'cart': cart_data(cart, since_version(request))
+            }, status=status.HTTP_200_OK), cart.version)
             
+        except CartVersionMismatch as exc:
+            return version_mismatch(exc)
         except Product.DoesNotExist:
             return Response({
                 'error': 'Product not found'
@@ -66,12 +133,15 @@ def add_to_cart(request):
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(10)
 @api_view(['PUT'])
-@permission_classes([permissions.IsAuthenticated])
+@permission_classes([permissions.AllowAny])
 def update_cart_item(request, item_id):
     """Update cart item quantity"""
+    if not request.user.is_authenticated:
+        return update_guest_cart_item(request, item_id)
     try:
-        cart_item = CartItem.objects.get(
+        cart_item = CartItem.objects.select_related('product__category').get(
             id=item_id,
             cart__user=request.user
         )
@@ -87,55 +157,214 @@ def update_cart_item(request, item_id):
                 'error': f'Only {cart_item.product.stock} items available in stock'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        with transaction.atomic():
+            cart = Cart.objects.claim(request.user, requested_version(request))
+            # Re-checks stock in the UPDATE itself, in case it dropped since the read above
+            if not CartItem.objects.set_quantity(cart_item.pk, quantity, cart.version):
+                stock = Product.objects.filter(pk=cart_item.product_id).values_list('stock', flat=True).get()
+                transaction.set_rollback(True)
+                return Response({
+                    'error': f'Only {stock} items available in stock'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            Cart.objects.filter(pk=cart.pk).refresh_totals()
         cart_item.quantity = quantity
-        cart_item.save()
+        cart_item.version = cart.version
         
         serializer = CartItemSerializer(cart_item)
-        return Response({
+        return with_version(Response({
             'message': 'Cart item updated successfully',
-            'item': serializer.data
-        }, status=status.HTTP_200_OK)
+            'item': serializer.data,
+            **changes_since(request, cart),
+        }, status=status.HTTP_200_OK), cart.version)
         
+    except CartVersionMismatch as exc:
+        return version_mismatch(exc)
     except CartItem.DoesNotExist:
         return Response({
             'error': 'Cart item not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+@query_budget(11)
 @api_view(['DELETE'])
-@permission_classes([permissions.IsAuthenticated])
+@permission_classes([permissions.AllowAny])
 def remove_cart_item(request, item_id):
     """Remove item from cart"""
+    if not request.user.is_authenticated:
+        return remove_guest_cart_item(request, item_id)
     try:
-        cart_item = CartItem.objects.get(
+        cart_item = CartItem.objects.select_related('product').get(
             id=item_id,
             cart__user=request.user
         )
         product_name = cart_item.product.name
-        cart_item.delete()
+        with transaction.atomic():
+            cart = Cart.objects.claim(request.user, requested_version(request))
+            if not CartItem.objects.filter(pk=cart_item.pk).remove():
+                raise CartItem.DoesNotExist  # Removed by a concurrent request
+            Cart.objects.filter(pk=cart.pk).refresh_totals()
         
-        return Response({
-            'message': f'{product_name} removed from cart successfully'
-        }, status=status.HTTP_200_OK)
+        return with_version(Response({
+            'message': f'{product_name} removed from cart successfully',
+            **changes_since(request, cart),
+        }, status=status.HTTP_200_OK), cart.version)
         
+    except CartVersionMismatch as exc:
+        return version_mismatch(exc)
     except CartItem.DoesNotExist:
         return Response({
             'error': 'Cart item not found'
         }, status=status.HTTP_404_NOT_FOUND)
 
+@query_budget(10)
 @api_view(['DELETE'])
-@permission_classes([permissions.IsAuthenticated])
+@permission_classes([permissions.AllowAny])
 def clear_cart(request):
     """Clear all items from cart"""
+    if not request.user.is_authenticated:
+        guest_cart = GuestCart.load(request)
+        items_count = len(guest_cart.quantities)
+        guest_cart.clear()
+        return guest_cart.save(Response({
+            'message': f'{items_count} items removed from cart'
+        }, status=status.HTTP_200_OK))
     try:
-        cart = Cart.objects.get(user=request.user)
-        items_count = cart.items.count()
-        cart.items.all().delete()
+        with transaction.atomic():
+            cart = Cart.objects.claim(request.user, requested_version(request))
+            items_count = cart.items.all().remove()
+            if not items_count:
+                transaction.set_rollback(True)
+                return with_version(Response({
+                    'message': 'Cart is already empty'
+                }, status=status.HTTP_200_OK), cart.version - 1)
+            Cart.objects.filter(pk=cart.pk).refresh_totals()
         
-        return Response({
-            'message': f'{items_count} items removed from cart'
-        }, status=status.HTTP_200_OK)
+        return with_version(Response({
+            'message': f'{items_count} items removed from cart',
+            **changes_since(request, cart),
+        }, status=status.HTTP_200_OK), cart.version)
         
-    except Cart.DoesNotExist:
+    except CartVersionMismatch as exc:
+        return version_mismatch(exc)
+
+@query_budget(14)
+@api_view(['POST'])
+@permission_classes([permissions.AllowAny])
+def batch_update_cart(request):
+    """Apply ordered add/set/remove operations in one transaction"""
+    serializer = CartBatchSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    parsed = batch.parse_operations(serializer.validated_data['operations'])
+    if not request.user.is_authenticated:
+        return batch_update_guest_cart(request, parsed)
+
+    try:
+        with transaction.atomic():
+            cart = Cart.objects.claim(request.user, requested_version(request))
+            items = {item.product_id: item for item in CartItem.objects.select_for_update().filter(cart=cart)}
+            # Every product the batch touches, with its stock, in one query
+            products = get_product_loader(request).load_many(batch.referenced_products(parsed, items))
+            results, quantities = batch.apply_operations(parsed, items, products)
+
+            now = timezone.now()
+            to_create, to_update, to_delete = [], [], []
+            for product_id, quantity in quantities.items():
+                item = items.get(product_id)
+                if item is None:
+                    if quantity:
+                        to_create.append(CartItem(cart=cart, product_id=product_id, quantity=quantity,
+                                                  version=cart.version))
+                elif not quantity:
+                    to_delete.append(item.pk)
+                elif quantity != item.quantity:
+                    item.quantity = quantity
+                    item.version = cart.version
+                    item.updated_at = now
+                    to_update.append(item)
+
+            if to_create:
+                CartItem.objects.bulk_create(to_create)
+            if to_update:
+                CartItem.objects.bulk_update(to_update, ['quantity', 'version', 'updated_at'])
+            if to_delete:
+                CartItem.objects.filter(pk__in=to_delete).remove()
+            if to_create or to_update or to_delete:
+                Cart.objects.filter(pk=cart.pk).refresh_totals()
+    except CartVersionMismatch as exc:
+        return version_mismatch(exc)
+
+    cart = Cart.objects.get(pk=cart.pk)
+    return with_version(Response({
+        'results': results,
+        'cart': cart_data(cart, since_version(request))
+    }, status=status.HTTP_200_OK), cart.version)
+
+# Guest carts: the same operations against the cache-backed GuestCart,
+# where a line's item id is its product id.
+
+def add_to_guest_cart(request, product, quantity):
+    guest_cart = GuestCart.load(request)
+    in_cart = guest_cart.quantities.get(product.pk, 0)
+    if in_cart + quantity > product.stock:
+        if in_cart:
+            return Response({
+                'error': f'Cannot add {quantity} items. Only {max(product.stock - in_cart, 0)} more available.'
+            }, status=status.HTTP_400_BAD_REQUEST)
         return Response({
-            'message': 'Cart is already empty'
-        }, status=status.HTTP_200_OK)
+            'error': f'Only {product.stock} items available in stock'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    guest_cart.set(product.pk, in_cart + quantity)
+    return guest_cart.save(Response({
+        'message': 'Product added to cart successfully',
+        'cart': CartSerializer(guest_cart.snapshot()).data
+    }, status=status.HTTP_200_OK))
+
+def update_guest_cart_item(request, product_id):
+    guest_cart = GuestCart.load(request)
+    cart_item = guest_cart.items().get(product_id)
+    if cart_item is None:
+        return Response({
+            'error': 'Cart item not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+
+    quantity = request.data.get('quantity')
+    if not quantity or not isinstance(quantity, int) or quantity <= 0:
+        return Response({
+            'error': 'Valid quantity is required'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if quantity > cart_item.product.stock:
+        return Response({
+            'error': f'Only {cart_item.product.stock} items available in stock'
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    guest_cart.set(product_id, quantity)
+    cart_item.quantity = quantity
+    return guest_cart.save(Response({
+        'message': 'Cart item updated successfully',
+        'item': CartItemSerializer(cart_item).data
+    }, status=status.HTTP_200_OK))
+
+def remove_guest_cart_item(request, product_id):
+    guest_cart = GuestCart.load(request)
+    cart_item = guest_cart.items().get(product_id)
+    if cart_item is None:
+        return Response({
+            'error': 'Cart item not found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    guest_cart.set(product_id, 0)
+    return guest_cart.save(Response({
+        'message': f'{cart_item.product.name} removed from cart successfully'
+    }, status=status.HTTP_200_OK))
+
+def batch_update_guest_cart(request, parsed):
+    guest_cart = GuestCart.load(request)
+    items = guest_cart.items()
+    products = get_product_loader(request).load_many(batch.referenced_products(parsed, items))
+    results, quantities = batch.apply_operations(parsed, items, products)
+    for product_id, quantity in quantities.items():
+        if quantity != guest_cart.quantities.get(product_id, 0):
+            guest_cart.set(product_id, quantity)
+    return guest_cart.save(Response({
+        'results': results,
+        'cart': CartSerializer(guest_cart.snapshot()).data
+    }, status=status.HTTP_200_OK))
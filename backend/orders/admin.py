@@ -0,0 +1,32 @@
+from django.contrib import admin
+from shopbase.adminscale import EstimatedCountPaginator, IndexedSearchMixin
+from .models import Order, OrderItem
+
+class ReadOnlyAdminMixin:
+    """Orders are a record of what was charged; they are only ever written by checkout and the webhook."""
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+class OrderItemInline(ReadOnlyAdminMixin, admin.TabularInline):
+    model = OrderItem
+    fields = ['product', 'product_name', 'sku', 'unit_price_cents', 'quantity', 'line_total_cents']
+
+@admin.register(Order)
+class OrderAdmin(ReadOnlyAdminMixin, IndexedSearchMixin, admin.ModelAdmin):
+    list_display = ['id', 'user', 'status', 'item_count', 'total', 'currency', 'created_at', 'paid_at']
+    list_filter = ['status', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['user__username__startswith', 'user__email__startswith',
+                     'payment__stripe_checkout_session_id__exact']
+    search_help_text = 'Start of a username or email (case-sensitive), or an exact Stripe checkout session id'
+    inlines = [OrderItemInline]
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,183 @@
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connections, models, transaction
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
+from django.utils import timezone
+from payments.models import Payment
+from products import conditional
+from products.models import Product
+from .signals import order_settled
+
+User = get_user_model()
+
+def to_cents(amount):
+    """Dollars (Decimal or str) to integer cents, the unit Stripe charges in."""
+    return int((Decimal(amount) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def from_cents(cents):
+    return Decimal(cents) / 100
+
+class SnapshotMismatch(Exception):
+    """The cart no longer adds up to the lines a checkout was priced from."""
+
+class OrderQuerySet(models.QuerySet):
+    def place(self, payment, lines):
+        """
+        Create the pending order for a payment from unsaved OrderItems.
+
+        Call it in the transaction that creates the payment, so the
+        payment, order and lines commit together.
+        """
+        order = self.create_for(payment, lines)
+        for line in lines:
+            line.order = order
+        OrderItem.objects.bulk_create(lines)
+        return order
+
+    def place_from_cart(self, payment, items, lines):
+        """
+        Like place(), but copy the cart items into the order with one INSERT ... SELECT.
+
+        bulk_create would take several statements for a large cart on
+        SQLite. lines are the snapshots Stripe was given; if the copied
+        rows do not add up to them, because a price or the cart changed
+        meanwhile, SnapshotMismatch is raised so the transaction rolls back.
+        """
+        order = self.create_for(payment, lines)
+        unit_price_cents = Cast(Round(models.F('product__price') * 100), models.BigIntegerField())
+        rows = items.values(  # In the cart's order, like the Stripe line items
+            line_order=models.Value(order.pk, output_field=models.BigIntegerField()),
+            line_product=models.F('product_id'),
+            line_name=models.F('product__name'),
+            line_sku=Coalesce(models.F('product__sku'), models.Value('')),
+            line_unit_price=unit_price_cents,
+            line_quantity=models.F('quantity'),
+            line_total=unit_price_cents * models.F('quantity'),
+        )
+        select, params = rows.query.sql_with_params()
+        connection = connections[self.db]
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(column) for column in (
+            'order_id', 'product_id', 'product_name', 'sku', 'unit_price_cents', 'quantity', 'line_total_cents',
+        ))
+        with connection.cursor() as cursor:
+            cursor.execute(f'INSERT INTO {quote(OrderItem._meta.db_table)} ({columns}) {select}', params)
+        copied = OrderItem.objects.filter(order=order).aggregate(
+            total_cents=models.Sum('line_total_cents'), item_count=models.Sum('quantity'),
+        )
+        if (copied['total_cents'], copied['item_count']) != (order.total_cents, order.item_count):
+            raise SnapshotMismatch(order.payment_id)
+        return order
+
+    def create_for(self, payment, lines):
+        return self.create(
+            user_id=payment.user_id,
+            payment=payment,
+            currency=payment.currency,
+            total_cents=sum(line.line_total_cents for line in lines),
+            item_count=sum(line.quantity for line in lines),
+            created_at=payment.created_at,
+        )
+
+    def settle(self, status):
+        """
+        Move the pending orders to status with one conditional UPDATE. Returns the row count.
+
+        The settled orders are locked and read first, so order_settled can
+        name exactly the orders this call moved.
+        """
+        ids = list(self.filter(status='pending').select_for_update().order_by().values_list('pk', flat=True))
+        if not ids:
+            return 0
+        changes = {'status': status}
+        if status == 'paid':
+            changes['paid_at'] = timezone.now()
+        updated = Order.objects.filter(pk__in=ids, status='pending').update(**changes)
+        order_settled.send(sender=Order, order_ids=ids, status=status)
+        return updated
+
+class Order(models.Model):
+    """
+    What a checkout bought, at the prices it was charged.
+
+    Written once by OrderQuerySet.place() next to its Payment; afterwards
+    only status and paid_at change, as the payment webhook settles it.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('paid', 'Paid'),
+        ('failed', 'Failed'),
+        ('cancelled', 'Cancelled'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='order')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    currency = models.CharField(max_length=3, default='USD')
+    total_cents = models.PositiveBigIntegerField()
+    item_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    paid_at = models.DateTimeField(null=True, blank=True)
+
+    objects = OrderQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # rebuild_rollups reads orders a range of days at a time
+            models.Index(fields=['created_at'], name='order_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order {self.id} - {self.status} - ${self.total}"
+
+    @property
+    def total(self):
+        return from_cents(self.total_cents)
+
+class OrderItemQuerySet(models.QuerySet):
+    def decrement_stock(self):
+        """Take the lines' quantities off their products' stock with one UPDATE, stopping at zero."""
+        ordered = self.filter(product_id=models.OuterRef('pk')).order_by().values('product_id').annotate(
+            total=models.Sum('quantity')
+        ).values('total')
+        updated = Product.objects.filter(pk__in=self.values('product_id')).update(
+            stock=Greatest(models.F('stock') - models.Subquery(ordered), 0),
+            updated_at=timezone.now(),
+        )
+        if updated:
+            # A queryset update skips the product signals, so invalidate cached catalog reads here
+            transaction.on_commit(conditional.bump_catalog_version)
+        return updated
+
+class OrderItem(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    # Null for single-product checkouts and once the product is deleted; the name and price below stay
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    product_name = models.CharField(max_length=255)
+    sku = models.CharField(max_length=64, blank=True)
+    unit_price_cents = models.PositiveIntegerField()
+    quantity = models.PositiveIntegerField()
+    line_total_cents = models.PositiveBigIntegerField()
+
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_name} in order {self.order_id}"
+
+    @classmethod
+    def snapshot(cls, product_name, unit_price, quantity=1, product=None):
+        """An unsaved line for OrderQuerySet.place(), with the price fixed in cents."""
+        unit_price_cents = to_cents(unit_price)
+        return cls(
+            product=product,
+            product_name=product_name,
+            sku=(product.sku or '') if product else '',
+            unit_price_cents=unit_price_cents,
+            quantity=quantity,
+            line_total_cents=unit_price_cents * quantity,
+        )
@@ -0,0 +1,8 @@
+from rest_framework import serializers
+from .models import Order
+
+class OrderSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'currency', 'total_cents', 'item_count', 'paid_at']
+        read_only_fields = fields
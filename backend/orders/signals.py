@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent by OrderQuerySet.settle() inside the settling transaction, with order_ids and status,
+# for every batch of orders that left pending
+order_settled = Signal()
@@ -1,10 +1,35 @@
 from django.contrib import admin
-from .models import Payment
+from django.utils import timezone
+from shopbase.adminscale import EstimatedCountPaginator, IndexedSearchMixin
+from .models import Payment, WebhookEvent
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(IndexedSearchMixin, admin.ModelAdmin):
     list_display = ['id', 'user', 'product_name', 'amount', 'status', 'created_at']
-    list_filter = ['status', 'created_at', 'currency']
-    search_fields = ['user__username', 'user__email', 'product_name', 'stripe_checkout_session_id']
-    readonly_fields = ['stripe_checkout_session_id', 'created_at', 'updated_at']
-    ordering = ['-created_at']
+    # No currency filter: its choices would come from a DISTINCT over the whole table
+    list_filter = ['status', 'created_at']
+    list_select_related = ['user']
+    search_fields = ['user__username__startswith', 'user__email__startswith', 'stripe_checkout_session_id__exact']
+    search_help_text = 'Start of a username or email (case-sensitive), or an exact Stripe checkout session id'
+    readonly_fields = ['stripe_checkout_session_id', 'checkout_key', 'expires_at', 'created_at', 'updated_at']
+    autocomplete_fields = ['user']
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'status', 'attempts', 'received_at', 'next_attempt_at', 'processed_at']
+    list_filter = ['status', 'received_at']
+    search_fields = ['event_id__exact']
+    search_help_text = 'Exact Stripe event id'
+    readonly_fields = ['event_id', 'type', 'payload', 'received_at', 'processed_at', 'last_error']
+    ordering = ['-received_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['retry_now']
+
+    @admin.action(description='Retry selected events now')
+    def retry_now(self, request, queryset):
+        count = queryset.exclude(status='processed').update(status='pending', next_attempt_at=timezone.now())
+        self.message_user(request, f'{count} events queued for the next process_webhooks batch.')
@@ -0,0 +1,184 @@
+"""
+Reuse of open Stripe checkout sessions for repeated submissions.
+
+A checkout is keyed by checkout_key(): the user, what they are buying at
+which prices, and the client's Idempotency-Key header if it sent one. A
+double-click or retry with the same key gets the session that is already
+open instead of a new Stripe round trip and another pending Payment.
+
+get_or_create_session() looks for the key's session in the cache first,
+then in the database. The database copy is Payment.checkout_key, which a
+partial unique constraint keeps to one pending payment per key. If neither
+has a session that stays open long enough, the request takes a short
+cache lock (cache.add) and calls create(). Identical requests arriving
+meanwhile wait for that one result instead of calling Stripe themselves
+(single-flight). With a shared cache such as Redis this also coalesces
+requests across processes. Outcomes are counted per process, see
+metrics().
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.utils import timezone
+
+from .models import Payment
+
+CACHE_KEY = 'payments:checkout:{}'
+LOCK_KEY = 'payments:checkout-lock:{}'
+
+OUTCOMES = ('cache', 'database', 'coalesced', 'created')
+_outcomes = Counter()
+_outcomes_lock = threading.Lock()
+
+
+def get_session_ttl():
+    return getattr(settings, 'CHECKOUT_SESSION_TTL', 24 * 60 * 60)
+
+
+def get_reuse_margin():
+    """Sessions closer than this to expiring are not handed out again."""
+    return timedelta(seconds=getattr(settings, 'CHECKOUT_REUSE_MARGIN_SECONDS', 10 * 60))
+
+
+def get_lock_timeout():
+    return getattr(settings, 'CHECKOUT_LOCK_SECONDS', 30)
+
+
+class CheckoutInProgress(Exception):
+    """An identical checkout is still being created elsewhere and did not finish in time."""
+
+
+@dataclass
+class CheckoutSession:
+    session_id: str
+    url: str
+    expires_at: datetime
+
+    @classmethod
+    def from_stripe(cls, session):
+        return cls(session.id, session.url, datetime.fromtimestamp(session.expires_at, dt_timezone.utc))
+
+    def reusable(self):
+        return self.expires_at > timezone.now() + get_reuse_margin()
+
+
+def checkout_key(user_id, lines, idempotency_key=None):
+    """Fingerprint of a checkout: the buyer, each line's product, price and quantity, and the client's key."""
+    parts = [
+        user_id,
+        idempotency_key or '',
+        [[line.product_id, line.product_name, line.unit_price_cents, line.quantity] for line in lines],
+    ]
+    return hashlib.sha256(json.dumps(parts, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def expires_at():
+    """The expires_at to create a session with, as a Unix timestamp."""
+    return int(time.time()) + get_session_ttl()
+
+
+def get_or_create_session(key, create):
+    """
+    Return (CheckoutSession, outcome) for the checkout key.
+
+    create() is called only when no reusable session exists and no other
+    request is creating one. It must save a Payment with checkout_key=key
+    and return its CheckoutSession. The outcome is one of OUTCOMES.
+    """
+    session = cached(key)
+    if session is not None:
+        return session, count('cache')
+
+    lock = LOCK_KEY.format(key)
+    deadline = time.monotonic() + get_lock_timeout()
+    while not cache.add(lock, True, get_lock_timeout()):
+        # Someone else is creating this checkout; wait for their session rather than make another
+        if time.monotonic() > deadline:
+            raise CheckoutInProgress(key)
+        time.sleep(0.05)
+        session = cached(key)
+        if session is not None:
+            return session, count('coalesced')
+    try:
+        session = stored(key)
+        if session is not None:
+            remember(key, session)
+            return session, count('database')
+        try:
+            session = create()
+        except IntegrityError:
+            # A request that outlived its lock saved this key first; theirs stands
+            session = stored(key)
+            if session is None:
+                raise
+            remember(key, session)
+            return session, count('database')
+        remember(key, session)
+        return session, count('created')
+    finally:
+        cache.delete(lock)
+
+
+def cached(key):
+    data = cache.get(CACHE_KEY.format(key))
+    if data is None:
+        return None
+    session = CheckoutSession(**data)
+    return session if session.reusable() else None
+
+
+def stored(key):
+    """The key's pending payment, if its session stays open long enough; otherwise the key is released."""
+    payments = Payment.objects.filter(checkout_key=key, status='pending')
+    row = payments.values('stripe_checkout_session_id', 'checkout_url', 'expires_at').first()
+    if row is None:
+        return None
+    session = CheckoutSession(row['stripe_checkout_session_id'], row['checkout_url'], row['expires_at'])
+    if row['expires_at'] is None or not session.reusable():
+        payments.update(checkout_key=None)  # Let a fresh session take the key
+        return None
+    return session
+
+
+def remember(key, session):
+    timeout = (session.expires_at - timezone.now() - get_reuse_margin()).total_seconds()
+    if timeout > 0:
+        cache.set(CACHE_KEY.format(key), asdict(session), timeout)
+
+
+def forget(key):
+    """Stop handing out the key's session, once its payment has settled."""
+    cache.delete(CACHE_KEY.format(key))
+
+
+def forget_many(keys):
+    cache.delete_many([CACHE_KEY.format(key) for key in keys])
+
+
+def count(outcome):
+    with _outcomes_lock:
+        _outcomes[outcome] += 1
+    return outcome
+
+
+def metrics():
+    """Checkout requests by outcome in this process, with the reuse hit rate and Stripe calls saved."""
+    with _outcomes_lock:
+        counts = {outcome: _outcomes[outcome] for outcome in OUTCOMES}
+    requests = sum(counts.values())
+    saved = requests - counts['created']
+    return {**counts, 'requests': requests, 'stripe_calls_saved': saved,
+            'hit_rate': saved / requests if requests else None}
+
+
+def reset_metrics():
+    with _outcomes_lock:
+        _outcomes.clear()
@@ -0,0 +1,208 @@
+"""
+An in-process stand-in for the parts of the Stripe API that checkout uses.
+
+FakeStripe serves POST /v1/checkout/sessions, GET /v1/checkout/sessions/<id>
+and POST /v1/checkout/sessions/<id>/expire over real HTTP on a loopback
+port, keeping sessions in memory. Point the gateway at it with
+override_settings(STRIPE_API_BASE=fake.url) to exercise checkout, and its
+timeouts, retries and idempotency keys, without a network or Stripe keys.
+
+Faults can be injected: `latency` delays every response, `failure_rate`
+answers that share of requests with a 500, `reset_rate` drops that share
+of connections, and fail_next() queues specific faults. A fault is an HTTP status, answered before the request
+is applied, or 'reset', which applies the request and then drops the
+connection, the case idempotency keys exist for. Like Stripe, a write
+repeated with the same Idempotency-Key replays the first response.
+"""
+import json
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+SESSION_PATH = re.compile(r'^/v1/checkout/sessions/(?P<id>[\w-]+)(?P<expire>/expire)?$')
+NESTED_KEY = re.compile(r'\[([^\]]*)\]')
+
+
+def parse_form(body):
+    """Stripe's form encoding (line_items[0][price_data][currency]=usd) back into nested dicts and lists."""
+    data = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        head = key.split('[', 1)[0]
+        parts = [head, *NESTED_KEY.findall(key)]
+        node = data
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return listify(data)
+
+
+def listify(node):
+    if not isinstance(node, dict):
+        return node
+    if node and all(key.isdigit() for key in node):
+        return [listify(node[key]) for key in sorted(node, key=int)]
+    return {key: listify(value) for key, value in node.items()}
+
+
+class FakeStripe:
+    def __init__(self, latency=0, failure_rate=0, reset_rate=0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.reset_rate = reset_rate
+        self.random = random.Random(seed)
+        self.sessions = {}
+        self.replays = {}
+        self.faults = deque()
+        self.requests = []
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.server = FakeStripeServer(('127.0.0.1', 0), FakeStripeHandler)
+        self.server.fake = self
+        threading.Thread(target=self.server.serve_forever, name='fake-stripe', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def fail_next(self, *faults):
+        """Queue faults for the next requests: HTTP statuses, or 'reset' to drop the connection after applying."""
+        with self.lock:
+            self.faults.extend(faults)
+
+    def next_fault(self):
+        with self.lock:
+            if self.faults:
+                return self.faults.popleft()
+            roll = self.random.random()
+        if roll < self.failure_rate:
+            return 500
+        if roll < self.failure_rate + self.reset_rate:
+            return 'reset'
+        return None
+
+    def handle(self, method, path, params, idempotency_key):
+        """Apply a request; returns (status, body)."""
+        with self.lock:
+            self.requests.append((method, path, idempotency_key))
+            if idempotency_key and (method, idempotency_key) in self.replays:
+                return self.replays[method, idempotency_key]
+            response = self.route(method, path, params)
+            if idempotency_key and method == 'POST' and response[0] < 500:
+                self.replays[method, idempotency_key] = response
+            return response
+
+    def route(self, method, path, params):
+        if path == '/v1/checkout/sessions' and method == 'POST':
+            return 200, self.create_session(params)
+        match = SESSION_PATH.match(path)
+        session = self.sessions.get(match['id']) if match else None
+        if session is None:
+            return 404, error('invalid_request_error', f'No such checkout.session: {path}')
+        if match['expire'] and method == 'POST':
+            if session['status'] != 'open':
+                return 400, error('invalid_request_error', f'Session is {session["status"]}')
+            session['status'] = 'expired'
+            return 200, session
+        if not match['expire'] and method == 'GET':
+            return 200, session
+        return 404, error('invalid_request_error', f'Unrecognized request URL ({method}: {path})')
+
+    def create_session(self, params):
+        session_id = f'cs_fake_{uuid.uuid4().hex}'
+        line_items = params.get('line_items', [])
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'mode': params.get('mode', 'payment'),
+            'status': 'open',
+            'payment_status': 'unpaid',
+            'currency': line_items[0]['price_data']['currency'] if line_items else 'usd',
+            'amount_total': sum(
+                int(line['price_data']['unit_amount']) * int(line.get('quantity', 1)) for line in line_items
+            ),
+            'metadata': params.get('metadata', {}),
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'url': f'{self.url}/pay/{session_id}',
+            'created': int(time.time()),
+            'expires_at': int(params.get('expires_at') or time.time() + 24 * 60 * 60),
+            'livemode': False,
+        }
+        self.sessions[session_id] = session
+        return session
+
+
+def error(kind, message):
+    return {'error': {'type': kind, 'message': message}}
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):  # A client that timed out and hung up
+            super().handle_error(request, client_address)
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so the gateway's pooled connections are reused
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond('GET')
+
+    def do_POST(self):
+        self.respond('POST')
+
+    def respond(self, method):
+        fake = self.server.fake
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode() if length else ''
+        path, _, query = self.path.partition('?')
+        params = parse_form(body if method == 'POST' else query)
+        if fake.latency:
+            time.sleep(fake.latency)
+
+        fault = fake.next_fault()
+        if isinstance(fault, int):
+            self.send_json(fault, error('api_error', f'Injected {fault}'))
+            return
+        status, payload = fake.handle(method, path, params, self.headers.get('Idempotency-Key'))
+        if fault == 'reset':
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return
+        self.send_json(status, payload)
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Request-Id', f'req_fake_{uuid.uuid4().hex[:14]}')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
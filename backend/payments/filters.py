@@ -0,0 +1,14 @@
+import django_filters
+
+from .models import Payment
+
+
+class PaymentHistoryFilter(django_filters.FilterSet):
+    """?status= (repeatable) and ?created_after=/?created_before= (ISO 8601), all within payment_user_history_idx."""
+    status = django_filters.MultipleChoiceFilter(choices=Payment.STATUS_CHOICES)
+    created_after = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = django_filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+
+    class Meta:
+        model = Payment
+        fields = ['status', 'created_after', 'created_before']
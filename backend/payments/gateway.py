@@ -0,0 +1,198 @@
+"""
+All calls to the Stripe API go through here.
+
+StripeGateway wraps a StripeClient whose HTTP client is a keep-alive
+requests session with a bounded connection pool and connect/read timeouts,
+so a slow Stripe holds a worker for seconds, not the SDK's 80. Calls that
+fail with a connection error, 409 lock conflict, 429 or 5xx are retried
+after a doubling, jittered delay (honouring Stripe-Should-Retry). Every
+attempt of a write reuses one idempotency key, so Stripe applies it at
+most once however many attempts it takes. Each attempt's latency is
+recorded in a per-operation LatencyHistogram, see metrics().
+
+STRIPE_API_BASE points the gateway at another server, such as the
+in-process fake in payments.fakestripe.
+"""
+import bisect
+import logging
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in milliseconds; slower calls land in a final overflow bucket
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """The process-wide gateway, built from settings on first use."""
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = StripeGateway(
+                    api_key=settings.STRIPE_SECRET_KEY,
+                    api_base=getattr(settings, 'STRIPE_API_BASE', None),
+                    connect_timeout=getattr(settings, 'STRIPE_CONNECT_TIMEOUT', 3),
+                    read_timeout=getattr(settings, 'STRIPE_READ_TIMEOUT', 10),
+                    max_retries=getattr(settings, 'STRIPE_MAX_RETRIES', 2),
+                    retry_base=getattr(settings, 'STRIPE_RETRY_BASE_SECONDS', 0.25),
+                    pool_size=getattr(settings, 'STRIPE_POOL_SIZE', 10),
+                )
+    return _gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting.startswith('STRIPE_'):
+        with _gateway_lock:
+            if _gateway is not None:
+                _gateway.close()
+            _gateway = None
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram, safe to share between threads."""
+
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, ms):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+            self.count += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (the maximum seen, for the overflow bucket)."""
+        with self.lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for bound, count in zip(self.buckets, self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean_ms': self.total_ms / self.count if self.count else None,
+            'p50_ms': self.quantile(0.5),
+            'p95_ms': self.quantile(0.95),
+            'p99_ms': self.quantile(0.99),
+            'max_ms': self.max_ms,
+            'buckets': dict(zip([*self.buckets, float('inf')], self.counts)),
+        }
+
+
+def should_retry(error):
+    headers = getattr(error, 'headers', None) or {}
+    hint = headers.get('stripe-should-retry') or headers.get('Stripe-Should-Retry')
+    if hint in ('true', 'false'):
+        return hint == 'true'
+    if isinstance(error, stripe.error.APIConnectionError):
+        return True
+    status = getattr(error, 'http_status', None) or 0
+    return status in (409, 429) or status >= 500
+
+
+class StripeGateway:
+    def __init__(self, api_key, api_base=None, connect_timeout=3, read_timeout=10, max_retries=2,
+                 retry_base=0.25, retry_max=2, pool_size=10):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.client = stripe.StripeClient(
+            api_key,
+            base_addresses={'api': api_base} if api_base else {},
+            max_network_retries=0,  # Retried here instead, with the same idempotency key
+            http_client=stripe.RequestsClient(timeout=(connect_timeout, read_timeout), session=self.session),
+        )
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.latency = {}
+        self.outcomes = Counter()
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+
+    def create_checkout_session(self, params, idempotency_key=None):
+        return self.call('checkout.sessions.create', self.client.checkout.sessions.create,
+                         params=params, idempotency_key=idempotency_key or uuid.uuid4().hex)
+
+    def retrieve_checkout_session(self, session_id):
+        return self.call('checkout.sessions.retrieve', self.client.checkout.sessions.retrieve, session_id)
+
+    def expire_checkout_session(self, session_id):
+        return self.call('checkout.sessions.expire', self.client.checkout.sessions.expire, session_id,
+                         idempotency_key=uuid.uuid4().hex)
+
+    def call(self, operation, method, *args, params=None, idempotency_key=None):
+        """Run one Stripe call with retries; raises the last StripeError once they are used up."""
+        options = {'idempotency_key': idempotency_key} if idempotency_key else {}
+        attempt = 0
+        while True:
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                result = method(*args, params=params or {}, options=options)
+            except stripe.error.StripeError as error:
+                retry = attempt <= self.max_retries and should_retry(error)
+                self.record(operation, started, 'retried' if retry else type(error).__name__)
+                if not retry:
+                    raise
+                delay = min(self.retry_max, self.retry_base * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+                logger.warning('Stripe %s attempt %d failed (%s); retrying in %.2fs', operation, attempt, error, delay)
+                time.sleep(delay)
+            else:
+                self.record(operation, started, 'ok')
+                return result
+
+    def record(self, operation, started, outcome):
+        ms = (time.perf_counter() - started) * 1000
+        with self.lock:
+            histogram = self.latency.get(operation)
+            if histogram is None:
+                histogram = self.latency[operation] = LatencyHistogram()
+            self.outcomes[operation, outcome] += 1
+        histogram.observe(ms)
+        logger.debug('Stripe %s %s in %.1fms', operation, outcome, ms)
+
+    def metrics(self):
+        """{operation: latency snapshot plus an 'outcomes' count per result}"""
+        with self.lock:
+            operations = dict(self.latency)
+            outcomes = dict(self.outcomes)
+        return {
+            operation: {
+                **histogram.snapshot(),
+                'outcomes': {outcome: count for (op, outcome), count in outcomes.items() if op == operation},
+            }
+            for operation, histogram in operations.items()
+        }
@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from cart.models import Cart, CartItem
+from payments import checkout, gateway
+from payments.fakestripe import FakeStripe
+from payments.gateway import LatencyHistogram
+from payments.models import Payment
+from products.models import Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Load-test cart checkout against an in-process fake Stripe (creates and removes its own rows)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent shoppers, one cart each')
+        parser.add_argument('--checkouts', type=int, default=50, help='Checkouts per shopper')
+        parser.add_argument('--items', type=int, default=3, help='Lines per cart')
+        parser.add_argument('--latency', type=float, default=0.05, help='Seconds fake Stripe takes per call')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Share of Stripe calls answered with a 500')
+        parser.add_argument('--reset-rate', type=float, default=0,
+                            help='Share of Stripe calls applied, then dropped before the response')
+        parser.add_argument('--read-timeout', type=float, help='Defaults to settings.STRIPE_READ_TIMEOUT')
+        parser.add_argument('--duplicates', type=int, default=1,
+                            help='Identical requests each checkout is submitted as at once (a double-click is 2)')
+
+    def handle(self, *args, **options):
+        if min(options['threads'], options['checkouts'], options['items'], options['duplicates']) < 1:
+            raise CommandError('--threads, --checkouts, --items and --duplicates must be at least 1')
+        overrides = {'STRIPE_SECRET_KEY': 'sk_test_benchmark'}
+        if options['read_timeout'] is not None:
+            overrides['STRIPE_READ_TIMEOUT'] = options['read_timeout']
+
+        # Threads need their own connections, so this cannot run inside a rolled-back transaction
+        stamp = time.time_ns()
+        products = Product.objects.bulk_create([
+            Product(name=f'Checkout Benchmark {i}', price=Decimal('19.99') + i, stock=1_000_000)
+            for i in range(options['items'])
+        ])
+        users = User.objects.bulk_create([
+            User(username=f'checkout-benchmark-{stamp}-{i}') for i in range(options['threads'])
+        ])
+        carts = Cart.objects.bulk_create([Cart(user=user) for user in users])
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=2) for cart in carts for product in products
+        ])
+        Cart.objects.filter(pk__in=[cart.pk for cart in carts]).refresh_totals()
+
+        fake = FakeStripe(latency=options['latency'], failure_rate=options['failure_rate'],
+                          reset_rate=options['reset_rate'], seed=42)
+        checkout.reset_metrics()
+        try:
+            with fake, override_settings(STRIPE_API_BASE=fake.url, **overrides):
+                statuses, latency, elapsed = self.run(users, options['checkouts'], options['duplicates'])
+                metrics = gateway.get_gateway().metrics()
+                reuse = checkout.metrics()
+            payments = Payment.objects.filter(user__in=users).count()
+        finally:
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+
+        total = sum(statuses.values())
+        self.stdout.write(
+            f'{options["threads"]} shoppers x {options["checkouts"]} checkouts, fake Stripe '
+            f'{options["latency"] * 1000:.0f}ms, {options["failure_rate"]:.0%} 500s, '
+            f'{options["reset_rate"]:.0%} dropped, each sent {options["duplicates"]}x ({connection.vendor})'
+        )
+        self.stdout.write(f'{total / elapsed:.1f} checkouts/sec; responses '
+                          + ', '.join(f'{count} x {code}' for code, count in sorted(statuses.items())))
+        self.stdout.write(f'{"call":<26} {"count":>6} {"p50":>9} {"p95":>9} {"p99":>9}  outcomes')
+        self.write_row('checkout request', latency.snapshot())
+        for operation, snapshot in sorted(metrics.items()):
+            self.write_row(operation, snapshot)
+        self.stdout.write(
+            f'session reuse: {reuse["hit_rate"] or 0:.1%} of {reuse["requests"]} requests, '
+            f'{reuse["stripe_calls_saved"]} Stripe calls saved ('
+            + ', '.join(f'{reuse[outcome]} {outcome}' for outcome in checkout.OUTCOMES) + ')'
+        )
+
+        # Every session Stripe created must belong to exactly one recorded payment
+        sessions = sum(1 for session in fake.sessions.values() if session['status'] == 'open')
+        line = f'{sessions} open Stripe sessions for {payments} recorded payments'
+        self.stdout.write(self.style.SUCCESS(line) if sessions == payments else self.style.ERROR(line))
+
+    def run(self, users, checkouts, duplicates):
+        statuses = Counter()
+        latency = LatencyHistogram()
+        lock = threading.Lock()
+        barrier = threading.Barrier(len(users) * duplicates)
+        url = reverse('payments:create_cart_checkout_session')
+
+        def shopper(user):
+            client = Client()
+            client.force_login(user)
+            barrier.wait()
+            try:
+                for number in range(checkouts):
+                    # The same cart would reuse one session every round; the key makes each round a new checkout
+                    headers = {'Idempotency-Key': f'benchmark-{user.pk}-{number}'}
+                    started = time.perf_counter()
+                    response = client.post(url, headers=headers)
+                    latency.observe((time.perf_counter() - started) * 1000)
+                    with lock:
+                        statuses[response.status_code] += 1
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=shopper, args=(user,))
+                   for user in users for _ in range(duplicates)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return statuses, latency, time.perf_counter() - started
+
+    def write_row(self, label, snapshot):
+        def ms(value):
+            return f'{value:.1f}ms' if value is not None else '-'
+
+        outcomes = ', '.join(f'{count} {outcome}' for outcome, count in sorted(snapshot.get('outcomes', {}).items()))
+        self.stdout.write(
+            f'{label:<26} {snapshot["count"]:>6} {ms(snapshot["p50_ms"]):>9} {ms(snapshot["p95_ms"]):>9} '
+            f'{ms(snapshot["p99_ms"]):>9}  {outcomes}'
+        )
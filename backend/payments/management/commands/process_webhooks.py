@@ -0,0 +1,46 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from payments import webhooks
+
+
+class Command(BaseCommand):
+    help = 'Apply queued Stripe webhook events from the inbox, retrying failures with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Events claimed per batch')
+        parser.add_argument('--once', action='store_true', help='Exit once no events are due instead of polling')
+        parser.add_argument('--poll-interval', type=float, default=5, help='Seconds to wait when the inbox is idle')
+        parser.add_argument('--max-attempts', type=int, help='Defaults to settings.WEBHOOK_MAX_ATTEMPTS')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        started = time.perf_counter()
+        totals = {}
+        try:
+            while True:
+                counts = webhooks.process_pending(options['batch_size'], options['max_attempts'])
+                if counts:
+                    for status, count in counts.items():
+                        totals[status] = totals.get(status, 0) + count
+                    self.report(counts)
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        handled = sum(totals.values())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Handled {handled} events in {elapsed:.1f}s ({handled / elapsed if elapsed else 0:.0f} events/sec)'
+                + ''.join(f', {count} {status}' for status, count in sorted(totals.items()))
+            )
+        )
+
+    def report(self, counts):
+        line = ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+        self.stdout.write(self.style.WARNING(line) if counts.get('failed') else line)
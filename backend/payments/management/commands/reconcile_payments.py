@@ -0,0 +1,97 @@
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from payments.reconcile import reconcile_payments, stale_payments
+
+
+class Command(BaseCommand):
+    help = 'Settle payments left pending by missed webhooks from their Stripe checkout sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=60,
+                            help='Reconcile payments pending for at least this many minutes')
+        parser.add_argument('--batch-size', type=int, default=100, help='Payments fetched and updated per batch')
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent Stripe requests')
+        parser.add_argument('--checkpoint', type=Path,
+                            help='File recording progress after each batch; an existing one is resumed from')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without applying them')
+
+    def handle(self, *args, **options):
+        if options['minutes'] < 0:
+            raise CommandError('--minutes must not be negative')
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be at least 1')
+        checkpoint = options['checkpoint']
+        cutoff, after = self.load_checkpoint(checkpoint)
+        if cutoff is None:
+            cutoff = timezone.now() - timedelta(minutes=options['minutes'])
+        else:
+            self.stdout.write(f'Resuming from payment {after[1]} ({after[0]:%Y-%m-%d %H:%M:%S})')
+        self.stdout.write(f'{stale_payments(cutoff).count()} payments pending since before {cutoff:%Y-%m-%d %H:%M}')
+
+        started = time.perf_counter()
+        scanned = unchanged = 0
+        changes, errors = [], {}
+        for batch in reconcile_payments(cutoff, batch_size=options['batch_size'], workers=options['workers'],
+                                        after=after, dry_run=options['dry_run']):
+            scanned += batch.scanned
+            unchanged += batch.unchanged
+            changes += batch.changes
+            errors.update(batch.errors)
+            if checkpoint and not options['dry_run']:
+                self.save_checkpoint(checkpoint, cutoff, batch.last)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{scanned} payments checked, {sum(change.applied for change in changes)} settled, '
+                f'{len(errors)} errors, {scanned / elapsed if elapsed else 0:.0f} payments/sec'
+            )
+        if checkpoint and not options['dry_run']:
+            checkpoint.unlink(missing_ok=True)  # Done; the next run starts a fresh scan
+
+        self.report(changes, errors, options['dry_run'], options['verbosity'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Checked {scanned} payments in {elapsed:.1f}s '
+                f'({scanned / elapsed if elapsed else 0:.0f} payments/sec), {unchanged} still pending at Stripe'
+            )
+        )
+
+    def report(self, changes, errors, dry_run, verbosity):
+        """The diff: a count per transition, every changed payment at -v 2, and every error."""
+        totals = {}
+        for change in changes:
+            outcome = 'would change' if dry_run else 'changed' if change.applied else 'settled meanwhile'
+            key = (change.status, outcome)
+            totals[key] = totals.get(key, 0) + 1
+            if verbosity >= 2:
+                self.stdout.write(f'  payment {change.payment_id} ({change.session_id}): '
+                                  f'pending -> {change.status}, {outcome}')
+        for (status, outcome), count in sorted(totals.items()):
+            self.stdout.write(f'pending -> {status}: {count} {outcome}')
+        for session_id, error in sorted(errors.items()):
+            self.stdout.write(self.style.ERROR(f'{session_id}: {error}'))
+
+    def load_checkpoint(self, path):
+        if not path or not path.exists():
+            return None, None
+        try:
+            state = json.loads(path.read_text())
+            cutoff = parse_datetime(state['cutoff'])
+            after = (parse_datetime(state['created_at']), state['id'])
+            if cutoff is None or after[0] is None:
+                raise ValueError('bad timestamp')
+        except (ValueError, KeyError, TypeError) as exc:
+            raise CommandError(f'Unreadable checkpoint {path}: {exc}')
+        return cutoff, after
+
+    def save_checkpoint(self, path, cutoff, last):
+        temporary = path.with_name(path.name + '.tmp')
+        temporary.write_text(json.dumps({'cutoff': cutoff.isoformat(), 'created_at': last[0].isoformat(),
+                                         'id': last[1]}))
+        temporary.replace(path)  # Atomic, so an interrupted run never leaves half a checkpoint
@@ -18,11 +18,57 @@ class Payment(models.Model):
     currency = models.CharField(max_length=3, default='USD')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     product_name = models.CharField(max_length=255)
+    # payments.checkout fingerprint, so a repeated submission reuses the open session below
+    checkout_key = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    checkout_url = models.TextField(blank=True, editable=False)
+    expires_at = models.DateTimeField(null=True, blank=True, editable=False)  # When the Stripe session closes
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['checkout_key'], condition=models.Q(status='pending'),
+                                    name='payment_pending_checkout_key_uniq'),
+        ]
+        # Payment history pages, filters and per-status totals; status and amount ride along so the
+        # status filter and the summary are answered from the index alone
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id', 'status', 'amount'], name='payment_user_history_idx'),
+            # reconcile_payments' keyset scan; only pending rows are indexed, and few stay pending for long
+            models.Index(fields=['created_at', 'id'], condition=models.Q(status='pending'),
+                         name='payment_pending_created_idx'),
+        ]
     
     def __str__(self):
         return f"Payment {self.id} - {self.user.email} - ${self.amount}"
+
+class WebhookEvent(models.Model):
+    """A verified Stripe event, stored once per event id until process_webhooks applies it."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, primary_key=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    # When the event is next due; claiming a batch pushes it out by the lease, failures by the backoff
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received_at = models.DateTimeField(default=timezone.now)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at']
+        indexes = [
+            models.Index(fields=['next_attempt_at'], condition=models.Q(status='pending'),
+                         name='webhook_event_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id} ({self.status})"
@@ -0,0 +1,11 @@
+from products.pagination import ProductCursorPagination
+
+
+class PaymentHistoryPagination(ProductCursorPagination):
+    """
+    Keyset pages of one user's payments, newest first.
+
+    Pages on (created_at, id) like the catalog, walking payment_user_history_idx.
+    Unlike the catalog paging is not opt-in: the history only grows.
+    """
+    opt_in = False
@@ -0,0 +1,151 @@
+"""
+Reconciliation of payments whose webhooks never arrived, for the reconcile_payments command.
+
+Payments pending since before a cutoff are found with a keyset scan over
+the partial (created_at, id) index of pending payments and handled in
+batches. Each batch's checkout sessions are fetched from Stripe
+concurrently on a bounded thread pool; only the HTTP calls run there,
+the database work stays on the calling thread. The client is anything
+with retrieve_checkout_session(session_id), the gateway by default.
+
+A session Stripe reports as paid completes its payment, an expired one
+cancels it; open sessions and delayed payment methods stay pending. A
+batch's changes are applied in one transaction: the payments still
+pending are locked and moved with one bulk_update, and their orders with
+one settle() per status. Only a payment that is still pending moves, so
+a webhook settling it meanwhile wins. The paid orders then come off
+stock with one UPDATE, and the bought lines of cart checkouts leave their
+carts once the batch commits, one cart at a time as the webhook does it.
+
+A batch result carries the last key it scanned, which callers can save
+and pass back as `after` to resume.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+
+import stripe
+from django.db import models, transaction
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from . import checkout, gateway, webhooks
+from .models import Payment
+
+
+@dataclass
+class Change:
+    payment_id: int
+    session_id: str
+    status: str
+    cart: bool = False  # A cart checkout, whose bought lines leave the cart once it is paid
+    applied: bool = False
+
+
+@dataclass
+class BatchResult:
+    scanned: int = 0
+    last: tuple = None  # (created_at, id) of the last payment scanned
+    changes: list = field(default_factory=list)
+    unchanged: int = 0
+    errors: dict = field(default_factory=dict)  # {session id: Stripe error}
+
+    @property
+    def applied(self):
+        return sum(change.applied for change in self.changes)
+
+
+def stale_payments(cutoff):
+    return Payment.objects.filter(status='pending', created_at__lt=cutoff)
+
+
+def session_status(session):
+    """The payment status a Stripe checkout session settles at, or None while it is still pending."""
+    if session['status'] == 'expired':
+        return 'cancelled'
+    if session['status'] == 'complete' and session['payment_status'] in ('paid', 'no_payment_required'):
+        return 'completed'
+    return None
+
+
+def reconcile_payments(cutoff, client=None, batch_size=100, workers=8, after=None, dry_run=False):
+    """Check payments pending since before cutoff against Stripe; yields a BatchResult per batch."""
+    client = client or gateway.get_gateway()
+    last = after
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as pool:
+        while True:
+            payments = stale_payments(cutoff).order_by('created_at', 'id')
+            if last is not None:
+                payments = payments.filter(
+                    models.Q(created_at__gt=last[0]) | models.Q(created_at=last[0], id__gt=last[1])
+                )
+            rows = list(payments.values_list('created_at', 'id', 'stripe_checkout_session_id')[:batch_size])
+            if not rows:
+                return
+            last = rows[-1][:2]
+            result = reconcile_batch(rows, pool, client, dry_run)
+            result.last = last
+            yield result
+
+
+def reconcile_batch(rows, pool, client, dry_run=False):
+    """Fetch the sessions of rows (created_at, id, session id) on the pool and settle the finished ones."""
+    result = BatchResult(scanned=len(rows))
+    sessions = pool.map(partial(retrieve, client), [session_id for _, _, session_id in rows])
+    for (_, payment_id, session_id), session in zip(rows, sessions):
+        if isinstance(session, stripe.error.StripeError):
+            result.errors[session_id] = session
+            continue
+        status = session_status(session)
+        if status is None:
+            result.unchanged += 1
+        else:
+            cart = (session.get('metadata') or {}).get('cart_checkout') == 'true'
+            result.changes.append(Change(payment_id, session_id, status, cart))
+    if result.changes and not dry_run:
+        applied = apply_changes(result.changes)
+        for change in result.changes:
+            change.applied = change.payment_id in applied
+    return result
+
+
+def retrieve(client, session_id):
+    """The session, or the StripeError retrieving it failed with, so one bad session does not stop the batch."""
+    try:
+        return client.retrieve_checkout_session(session_id)
+    except stripe.error.StripeError as error:
+        return error
+
+
+def apply_changes(changes):
+    """Settle the changed payments that are still pending, as their webhooks would; returns the ids settled."""
+    by_id = {change.payment_id: change for change in changes}
+    now = timezone.now()
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.filter(pk__in=by_id, status='pending').select_for_update()
+            .order_by().only('pk', 'user_id', 'checkout_key')
+        )
+        if not payments:
+            return set()
+        for payment in payments:
+            payment.status = by_id[payment.pk].status
+            payment.updated_at = now
+        Payment.objects.bulk_update(payments, ['status', 'updated_at'])
+
+        by_status = {}
+        for payment in payments:
+            by_status.setdefault(payment.status, []).append(payment.pk)
+        for status, ids in by_status.items():
+            Order.objects.filter(payment_id__in=ids).settle(webhooks.ORDER_STATUSES[status])
+        paid = [payment for payment in payments if payment.status == 'completed']
+        if paid:
+            OrderItem.objects.filter(order__payment__in=paid).decrement_stock()
+        for payment in paid:
+            if by_id[payment.pk].cart:
+                ordered = OrderItem.objects.filter(order__payment=payment)
+                transaction.on_commit(partial(webhooks.remove_ordered_lines, payment.user_id, ordered), robust=True)
+        keys = [payment.checkout_key for payment in payments if payment.checkout_key]
+        if keys:
+            transaction.on_commit(partial(checkout.forget_many, keys))
+    return {payment.pk for payment in payments}
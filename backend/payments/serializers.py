@@ -1,11 +1,15 @@
 from rest_framework import serializers
+from orders.serializers import OrderSummarySerializer
 from .models import Payment
 
 class PaymentSerializer(serializers.ModelSerializer):
+    # Null for payments made before orders were recorded
+    order = OrderSummarySerializer(read_only=True)
+
     class Meta:
         model = Payment
         fields = ['id', 'stripe_checkout_session_id', 'amount', 'currency', 
-                 'status', 'product_name', 'created_at', 'updated_at']
+                 'status', 'product_name', 'order', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
 class CreateCheckoutSessionSerializer(serializers.Serializer):
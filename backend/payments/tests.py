@@ -0,0 +1,526 @@
+import hashlib
+import hmac
+import json
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+import stripe
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from cart.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from products.models import Category, Product
+from . import checkout, reconcile, webhooks
+from .fakestripe import FakeStripe
+from .gateway import StripeGateway
+from .models import Payment, WebhookEvent
+
+User = get_user_model()
+
+FIXTURES = Path(__file__).resolve().parent / 'fixtures' / 'stripe_events'
+SECRET = 'whsec_test_secret'
+
+
+def load_event(name, session_id=None):
+    """A recorded Stripe event, optionally pointed at another checkout session."""
+    event = json.loads((FIXTURES / f'{name}.json').read_text())
+    if session_id is not None:
+        event['data']['object']['id'] = session_id
+    return event
+
+
+def sign(payload, secret=SECRET, timestamp=None):
+    """A Stripe-Signature header for payload, computed the way Stripe does."""
+    timestamp = int(timestamp or time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=SECRET)
+class WebhookInboxTests(TestCase):
+    """Recorded events posted through the real signature check, then applied by the worker."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create(username='webhook-shopper', email='webhook@example.com')
+        category = Category.objects.create(name='Webhooks', slug='webhooks')
+        self.product = Product.objects.create(name='Lamp', price=Decimal('12.99'), stock=5, category=category)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=2)
+        self.cart.refresh_totals()
+        self.payment = Payment.objects.create(
+            user=self.user, stripe_checkout_session_id='cs_test_inbox', amount=Decimal('25.98'),
+            product_name='Cart Checkout (2 items)',
+        )
+        self.order = Order.objects.place(self.payment, [OrderItem.snapshot('Lamp', '12.99', 2, self.product)])
+
+    def post(self, event, signature=None):
+        payload = json.dumps(event)
+        return self.client.generic(
+            'POST', reverse('payments:stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature or sign(payload),
+        )
+
+    def test_event_is_queued_once_and_applied_by_the_worker(self):
+        event = load_event('checkout.session.completed', 'cs_test_inbox')
+        for _ in range(3):  # Stripe redelivers until it sees a 2xx
+            self.assertEqual(self.post(event).status_code, 200)
+        self.assertEqual(WebhookEvent.objects.count(), 1)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')  # Nothing applied in the request
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(webhooks.process_pending(), {'processed': 1})
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.cart.refresh_from_db()
+        self.assertEqual(self.payment.status, 'completed')
+        self.assertEqual(self.order.status, 'paid')
+        self.assertIsNotNone(self.order.paid_at)
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(self.cart.total_items, 0)
+        self.assertEqual(webhooks.process_pending(), {})
+
+    def test_bad_signature_is_rejected(self):
+        event = load_event('checkout.session.completed', 'cs_test_inbox')
+        response = self.post(event, signature=sign(json.dumps(event), secret='whsec_wrong'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_per_type_handlers(self):
+        self.post(load_event('checkout.session.completed.unpaid', 'cs_test_inbox'))
+        self.post(load_event('payment_intent.created'))
+        self.assertEqual(webhooks.process_pending(), {'processed': 1, 'skipped': 1})
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'pending')  # Delayed payment not settled yet
+
+        self.post(load_event('checkout.session.async_payment_failed', 'cs_test_inbox'))
+        webhooks.process_pending()
+        self.payment.refresh_from_db()
+        self.order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.payment.status, 'failed')
+        self.assertEqual(self.order.status, 'failed')
+        self.assertEqual(self.product.stock, 5)
+
+    def test_failures_are_retried_with_backoff_until_max_attempts(self):
+        self.post(load_event('checkout.session.expired', 'cs_test_unknown'))
+        event = WebhookEvent.objects.get()
+
+        self.assertEqual(webhooks.process_pending(max_attempts=2), {'pending': 1})
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 1)
+        self.assertIn('PaymentNotFound', event.last_error)
+        self.assertGreater(event.next_attempt_at, timezone.now() + timedelta(seconds=10))
+        self.assertEqual(webhooks.process_pending(max_attempts=2), {})  # Not due yet
+
+        WebhookEvent.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(webhooks.process_pending(max_attempts=2), {'failed': 1})
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 2))
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET=SECRET)
+class CheckoutOrderTests(TestCase):
+    """The order snapshot taken at cart checkout and its finalization by the webhook worker."""
+
+    def setUp(self):
+        cache.clear()  # Sessions remembered by other tests' checkouts
+        self.fake = self.enterContext(FakeStripe())
+        self.enterContext(override_settings(STRIPE_API_BASE=self.fake.url, STRIPE_SECRET_KEY='sk_test_fake'))
+        self.client = APIClient()
+        self.user = User.objects.create(username='order-shopper', email='order@example.com')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Orders', slug='orders')
+        self.lamp = Product.objects.create(name='Lamp', sku='LAMP-1', price=Decimal('12.99'), stock=5,
+                                           category=category)
+        self.vase = Product.objects.create(name='Vase', price=Decimal('0.29'), stock=1, category=category)
+        self.cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.lamp, quantity=2)
+        CartItem.objects.create(cart=self.cart, product=self.vase, quantity=1)
+        self.cart.refresh_totals()
+
+    def checkout(self):
+        response = self.client.post(reverse('payments:create_cart_checkout_session'))
+        self.assertEqual(response.status_code, 201)
+        return self.fake.sessions[response.data['session_id']]
+
+    def complete(self):
+        event = load_event('checkout.session.completed', Payment.objects.get().stripe_checkout_session_id)
+        WebhookEvent.objects.create(event_id=event['id'], type=event['type'], payload=event)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(webhooks.process_pending(), {'processed': 1})
+
+    def test_checkout_snapshots_the_cart_in_cents(self):
+        session = self.checkout()
+        self.assertEqual(session['amount_total'], 2627)
+
+        order = Order.objects.select_related('payment').get()
+        self.assertEqual(order.payment.stripe_checkout_session_id, session['id'])
+        self.assertEqual((order.status, order.total_cents, order.item_count), ('pending', 2627, 3))
+        self.assertEqual(order.payment.amount, Decimal('26.27'))
+        self.assertEqual(
+            list(order.items.values_list('product_name', 'sku', 'unit_price_cents', 'quantity', 'line_total_cents')),
+            [('Vase', '', 29, 1, 29), ('Lamp', 'LAMP-1', 1299, 2, 2598)],
+        )
+
+        # Later price changes do not touch what was charged
+        Product.objects.filter(pk=self.lamp.pk).update(price=Decimal('99.00'))
+        self.assertEqual(order.items.get(product=self.lamp).unit_price_cents, 1299)
+
+    def test_price_change_during_checkout_saves_nothing(self):
+        create = StripeGateway.create_checkout_session
+
+        def create_while_repricing(gateway, params, idempotency_key=None):
+            Product.objects.filter(pk=self.lamp.pk).update(price=Decimal('13.49'))
+            return create(gateway, params, idempotency_key)
+
+        with mock.patch.object(StripeGateway, 'create_checkout_session', create_while_repricing):
+            response = self.client.post(reverse('payments:create_cart_checkout_session'))
+        self.assertEqual(response.status_code, 409)
+        [session] = self.fake.sessions.values()
+        self.assertEqual(session['status'], 'expired')
+        self.assertFalse(Payment.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_any_database_error_expires_the_session(self):
+        with mock.patch.object(Order.objects, 'place_from_cart', side_effect=DatabaseError('disk I/O error')):
+            response = self.client.post(reverse('payments:create_cart_checkout_session'))
+        self.assertEqual(response.status_code, 500)
+        [session] = self.fake.sessions.values()
+        self.assertEqual(session['status'], 'expired')
+        self.assertFalse(Payment.objects.exists())
+
+    def test_paid_order_takes_stock_and_only_the_bought_lines(self):
+        self.checkout()
+        self.vase.stock = 0  # Sold elsewhere meanwhile; stock stops at zero
+        self.vase.save()
+        extra = Product.objects.create(name='Rug', price=Decimal('5.00'), stock=3)
+        CartItem.objects.create(cart=self.cart, product=extra, quantity=1)
+        self.cart.refresh_totals()
+
+        self.complete()
+        self.lamp.refresh_from_db()
+        self.vase.refresh_from_db()
+        self.cart.refresh_from_db()
+        self.assertEqual((self.lamp.stock, self.vase.stock), (3, 0))
+        self.assertEqual(Order.objects.get().status, 'paid')
+        self.assertEqual(list(self.cart.items.values_list('product', flat=True)), [extra.pk])
+        self.assertEqual(self.cart.total_items, 1)
+
+    def test_history_includes_the_order_in_one_query(self):
+        self.checkout()
+        self.complete()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('payments:payment_history'))
+        order = response.data['results'][0]['order']
+        self.assertEqual((order['status'], order['total_cents'], order['item_count']), ('paid', 2627, 3))
+
+
+
+class CheckoutReuseTests(TestCase):
+    """Repeated checkouts get the session already open instead of a new one."""
+
+    def setUp(self):
+        cache.clear()
+        checkout.reset_metrics()
+        self.fake = self.enterContext(FakeStripe())
+        self.enterContext(override_settings(STRIPE_API_BASE=self.fake.url, STRIPE_SECRET_KEY='sk_test_fake'))
+        self.client = APIClient()
+        self.user = User.objects.create(username='reuse-shopper', email='reuse@example.com')
+        self.client.force_authenticate(self.user)
+        self.url = reverse('payments:create_checkout_session')
+
+    def post(self, amount='12.99', idempotency_key=None):
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key is not None else {}
+        return self.client.post(self.url, {'product_name': 'Lamp', 'amount': amount}, format='json', headers=headers)
+
+    def test_double_submit_reuses_the_open_session(self):
+        first = self.post()
+        self.assertEqual(first.status_code, 201)
+        second = self.post()
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data, first.data)
+
+        cache.clear()  # Another process, or an evicted cache entry: the payment row still has it
+        with self.assertNumQueries(1):
+            third = self.post()
+        self.assertEqual((third.status_code, third.data), (200, first.data))
+
+        self.assertEqual(len(self.fake.sessions), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(checkout.metrics(), {
+            'cache': 1, 'database': 1, 'coalesced': 0, 'created': 1,
+            'requests': 3, 'stripe_calls_saved': 2, 'hit_rate': 2 / 3,
+        })
+
+    def test_other_amounts_and_idempotency_keys_get_their_own_session(self):
+        ids = {self.post().data['session_id'], self.post('13.99').data['session_id']}
+        first = self.post(idempotency_key='order-attempt-1')
+        self.assertEqual(first.status_code, 201)
+        retried = self.post(idempotency_key='order-attempt-1')
+        self.assertEqual((retried.status_code, retried.data), (200, first.data))
+        ids.add(first.data['session_id'])
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(len(self.fake.sessions), 3)
+
+        self.assertEqual(self.post(idempotency_key='x' * 256).status_code, 400)
+
+    def test_concurrent_duplicate_waits_for_the_session_being_created(self):
+        key = checkout.checkout_key(self.user.id, [OrderItem.snapshot('Lamp', '12.99')])
+        cache.add(checkout.LOCK_KEY.format(key), True)  # Another request is creating it
+        session = checkout.CheckoutSession('cs_other_request', 'https://stripe.test/pay',
+                                           timezone.now() + timedelta(hours=1))
+        sleep = mock.patch('payments.checkout.time.sleep', side_effect=lambda _: checkout.remember(key, session))
+        with sleep:
+            response = self.post()
+        self.assertEqual((response.status_code, response.data['session_id']), (200, 'cs_other_request'))
+        self.assertEqual(self.fake.sessions, {})
+
+        with override_settings(CHECKOUT_LOCK_SECONDS=0), mock.patch('payments.checkout.time.sleep'):
+            cache.clear()
+            cache.add(checkout.LOCK_KEY.format(key), True)
+            self.assertEqual(self.post().status_code, 409)
+        self.assertEqual(checkout.metrics()['coalesced'], 1)
+
+    def test_expiring_and_settled_sessions_are_not_reused(self):
+        first = self.post().data
+        Payment.objects.update(expires_at=timezone.now() + timedelta(minutes=5))  # Inside the reuse margin
+        cache.clear()
+        second = self.post()
+        self.assertEqual(second.status_code, 201)
+        self.assertNotEqual(second.data['session_id'], first['session_id'])
+        self.assertEqual(Payment.objects.filter(checkout_key__isnull=False).get().stripe_checkout_session_id,
+                         second.data['session_id'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            webhooks.settle_payment(second.data['session_id'], 'completed')
+        self.assertEqual(self.post().status_code, 201)  # Paid; buying the same again is a new checkout
+
+
+
+class ReconcileTests(TestCase):
+    """Payments whose webhooks never came, settled from their sessions by reconcile_payments."""
+
+    def setUp(self):
+        self.fake = self.enterContext(FakeStripe())
+        self.enterContext(override_settings(STRIPE_API_BASE=self.fake.url, STRIPE_SECRET_KEY='sk_test_fake'))
+        self.user = User.objects.create(username='reconcile-shopper', email='reconcile@example.com')
+        self.lamp = Product.objects.create(name='Lamp', price=Decimal('12.99'), stock=5)
+        self.payments = []
+        for i, (status, payment_status) in enumerate([('complete', 'paid'), ('expired', 'unpaid'),
+                                                      ('open', 'unpaid'), ('complete', 'unpaid'),
+                                                      ('complete', 'paid')]):
+            session = self.fake.create_session({'line_items': []})
+            session.update(status=status, payment_status=payment_status)
+            payment = Payment.objects.create(
+                user=self.user, stripe_checkout_session_id=session['id'], amount=Decimal('12.99'),
+                product_name='Lamp', created_at=timezone.now() - timedelta(hours=2, minutes=i),
+            )
+            Order.objects.place(payment, [OrderItem.snapshot('Lamp', '12.99', product=self.lamp)])
+            self.payments.append(payment)
+        # Too recent to reconcile, though its session is paid
+        recent = self.fake.create_session({'line_items': []})
+        recent.update(status='complete', payment_status='paid')
+        Payment.objects.create(user=self.user, stripe_checkout_session_id=recent['id'], amount=Decimal('1.00'),
+                               product_name='Recent')
+
+    def call(self, *args):
+        out = StringIO()
+        call_command('reconcile_payments', '--batch-size=2', '--workers=2', *args, stdout=out)
+        return out.getvalue()
+
+    def statuses(self):
+        return [Payment.objects.get(pk=payment.pk).status for payment in self.payments]
+
+    def test_paid_and_expired_sessions_settle_their_payments_and_orders(self):
+        self.assertIn('pending -> completed: 2 would change', self.call('--dry-run'))
+        self.assertEqual(set(self.statuses()), {'pending'})
+
+        output = self.call()
+        self.assertIn('pending -> completed: 2 changed', output)
+        self.assertIn('pending -> cancelled: 1 changed', output)
+        self.assertIn('Checked 5 payments', output)
+        self.assertEqual(self.statuses(), ['completed', 'cancelled', 'pending', 'pending', 'completed'])
+        self.assertEqual([Order.objects.get(payment=payment).status for payment in self.payments],
+                         ['paid', 'cancelled', 'pending', 'pending', 'paid'])
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 3)
+
+        self.assertIn('Checked 2 payments', self.call())  # Only the ones Stripe still has open
+
+    def test_checkpoint_resumes_after_the_last_finished_batch(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'reconcile.json'
+            # A run interrupted after its first batch, the two oldest payments
+            path.write_text(json.dumps({
+                'cutoff': (timezone.now() - timedelta(hours=1)).isoformat(),
+                'created_at': self.payments[3].created_at.isoformat(),
+                'id': self.payments[3].pk,
+            }))
+            output = self.call(f'--checkpoint={path}')
+            self.assertIn(f'Resuming from payment {self.payments[3].pk}', output)
+            self.assertIn('Checked 3 payments', output)
+            self.assertFalse(path.exists())
+        self.assertEqual(self.statuses(), ['completed', 'cancelled', 'pending', 'pending', 'pending'])
+
+    def test_stripe_errors_leave_the_payment_pending(self):
+        class StubClient:
+            def retrieve_checkout_session(self, session_id):
+                raise stripe.error.InvalidRequestError(f'No such checkout.session: {session_id}', 'id')
+
+        cutoff = timezone.now() - timedelta(hours=1)
+        [result, *rest] = list(reconcile.reconcile_payments(cutoff, client=StubClient(), batch_size=10))
+        self.assertEqual((result.scanned, len(result.errors), result.changes, rest), (5, 5, [], []))
+        self.assertEqual(set(self.statuses()), {'pending'})
+
+    def test_changes_settle_like_the_webhooks_and_lose_to_them(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.lamp, quantity=1)
+        first, second = self.payments[0], self.payments[4]
+        with self.captureOnCommitCallbacks(execute=True):
+            webhooks.complete_payment(first.stripe_checkout_session_id)  # Its webhook came after all
+
+        with self.captureOnCommitCallbacks(execute=True):
+            applied = reconcile.apply_changes([
+                reconcile.Change(first.pk, first.stripe_checkout_session_id, 'completed'),
+                reconcile.Change(second.pk, second.stripe_checkout_session_id, 'completed', cart=True),
+            ])
+        self.assertEqual(applied, {second.pk})
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 3)  # Each order taken off stock once
+        self.assertFalse(CartItem.objects.filter(cart=cart).exists())  # The cart checkout's lines left the cart
+
+
+    def test_a_batch_is_settled_with_one_update_per_table_and_status(self):
+        changes = [
+            reconcile.Change(payment.pk, payment.stripe_checkout_session_id, status)
+            for payment, status in zip(self.payments, ['completed', 'cancelled', 'completed', 'completed'])
+        ]
+        with CaptureQueriesContext(connection) as queries:
+            applied = reconcile.apply_changes(changes)
+        self.assertEqual(applied, {payment.pk for payment in self.payments[:4]})
+        updates = [query['sql'].split()[1] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(sorted(updates), ['"orders_order"', '"orders_order"', '"payments_payment"',
+                                           '"products_product"'])
+        self.assertEqual(self.statuses(), ['completed', 'cancelled', 'completed', 'completed', 'pending'])
+        self.lamp.refresh_from_db()
+        self.assertEqual(self.lamp.stock, 2)
+
+
+class StripeGatewayTests(TestCase):
+    """Retries, idempotency and timeouts against the in-process fake Stripe."""
+
+    params = {
+        'mode': 'payment',
+        'line_items': [{'price_data': {'currency': 'usd', 'product_data': {'name': 'Lamp'}, 'unit_amount': 1299},
+                        'quantity': 2}],
+    }
+
+    def setUp(self):
+        self.fake = self.enterContext(FakeStripe())
+
+    def gateway(self, **kwargs):
+        gateway = StripeGateway('sk_test_fake', api_base=self.fake.url, retry_base=0.01, **kwargs)
+        self.addCleanup(gateway.close)
+        return gateway
+
+    def test_server_errors_and_dropped_connections_are_retried_with_one_idempotency_key(self):
+        gateway = self.gateway()
+        self.fake.fail_next(500, 'reset')  # The second attempt is applied, but its response is lost
+        with self.assertLogs('payments.gateway', 'WARNING') as logs:
+            session = gateway.create_checkout_session(self.params)
+        self.assertEqual(len(logs.records), 2)
+
+        self.assertEqual(session.amount_total, 2598)
+        self.assertEqual(list(self.fake.sessions), [session.id])
+        keys = {key for _, _, key in self.fake.requests}
+        self.assertEqual(len(keys), 1)
+        stats = gateway.metrics()['checkout.sessions.create']
+        self.assertEqual(stats['outcomes'], {'retried': 2, 'ok': 1})
+        self.assertEqual(stats['count'], 3)
+
+    def test_client_errors_are_not_retried(self):
+        gateway = self.gateway()
+        with self.assertRaises(stripe.error.InvalidRequestError):
+            gateway.expire_checkout_session('cs_missing')
+        self.assertEqual(len(self.fake.requests), 1)
+
+    def test_slow_responses_time_out_after_bounded_retries(self):
+        gateway = self.gateway(read_timeout=0.05, max_retries=1)
+        self.fake.latency = 0.2
+        with self.assertRaises(stripe.error.APIConnectionError), self.assertLogs('payments.gateway', 'WARNING'):
+            gateway.create_checkout_session(self.params)
+        self.assertEqual(gateway.metrics()['checkout.sessions.create']['outcomes'],
+                         {'retried': 1, 'APIConnectionError': 1})
+
+
+class PaymentHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='history-shopper', email='history@example.com')
+        other = User.objects.create(username='history-other', email='other@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        start = timezone.now() - timedelta(days=30)
+        statuses = ['completed', 'completed', 'pending', 'failed', 'cancelled']
+        Payment.objects.bulk_create([
+            Payment(user=self.user, stripe_checkout_session_id=f'cs_history_{i}', amount=Decimal('10.50') + i,
+                    status=statuses[i % len(statuses)], product_name=f'Item {i}',
+                    created_at=start + timedelta(days=i // 2))  # Pairs share a day, so ids break ties
+            for i in range(25)
+        ] + [Payment(user=other, stripe_checkout_session_id='cs_history_other', amount=Decimal('1.00'),
+                     product_name='Not mine')])
+        self.url = reverse('payments:payment_history')
+
+    def walk(self, params=None):
+        ids, url = [], self.url
+        while url:
+            response = self.client.get(url, params if url == self.url else None)
+            self.assertEqual(response.status_code, 200)
+            ids += [payment['id'] for payment in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_pages_walk_every_payment_newest_first_without_repeats(self):
+        ids = self.walk({'page_size': 4})
+        expected = list(Payment.objects.filter(user=self.user).order_by('-created_at', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+        with self.assertNumQueries(1):
+            self.client.get(self.url, {'page_size': 4})
+
+    def test_status_and_date_filters(self):
+        cutoff = timezone.now() - timedelta(days=25)
+        ids = self.walk({'status': ['completed', 'failed'], 'created_after': cutoff.isoformat(), 'page_size': 3})
+        expected = Payment.objects.filter(user=self.user, status__in=['completed', 'failed'], created_at__gte=cutoff)
+        self.assertEqual(sorted(ids), sorted(expected.values_list('id', flat=True)))
+
+        response = self.client.get(self.url, {'status': 'refunded'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.data)
+
+    def test_summary_counts_and_totals_per_status_in_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'summary': 'true', 'status': 'completed'})
+        self.assertEqual(response.data['count'], 10)
+        completed = Payment.objects.filter(user=self.user, status='completed')
+        self.assertEqual(response.data['by_status']['completed'], {
+            'count': 10, 'total': str(sum(payment.amount for payment in completed)),
+        })
+        self.assertEqual(response.data['by_status']['pending'], {'count': 0, 'total': '0.00'})
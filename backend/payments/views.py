@@ -1,20 +1,98 @@
+import logging
+from decimal import Decimal
+
 import stripe
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
 from django.http import HttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from rest_framework import status
 from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from . import checkout, gateway, webhooks
+from .filters import PaymentHistoryFilter
 from .models import Payment
+from .pagination import PaymentHistoryPagination
 from .serializers import CreateCheckoutSessionSerializer, PaymentSerializer
+from orders.models import Order, OrderItem, SnapshotMismatch, from_cents
+from shopbase.querybudget import query_budget
+
+logger = logging.getLogger(__name__)
+
+def line_items(lines):
+    """Stripe line items charging exactly the snapshotted order lines"""
+    return [{
+        'price_data': {
+            'currency': 'usd',
+            'product_data': {
+                'name': line.product_name,
+            },
+            'unit_amount': line.unit_price_cents,
+        },
+        'quantity': line.quantity,
+    } for line in lines]
+
+def open_checkout(request, lines, product_name, metadata, place_order):
+    """
+    Reuse the open Stripe session for this exact checkout, or create one and its payment and order.
+
+    A repeat of the same lines (or of the same Idempotency-Key) gets the
+    session already open, 200; a new session is a 201.
+    """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+        return Response({
+            'error': 'Idempotency-Key must be 1 to 255 characters'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    key = checkout.checkout_key(request.user.id, lines, idempotency_key)
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
+    def create():
+        stripe_session = gateway.get_gateway().create_checkout_session({
+            'payment_method_types': ['card'],
+            'line_items': line_items(lines),
+            'mode': 'payment',
+            'success_url': request.build_absolute_uri('/') + 'payment/success?session_id={CHECKOUT_SESSION_ID}',
+            'cancel_url': request.build_absolute_uri('/') + 'payment/cancel',
+            'expires_at': checkout.expires_at(),
+            'metadata': {'user_id': request.user.id, **metadata},
+        })
+        session = checkout.CheckoutSession.from_stripe(stripe_session)
+        try:
+            # Save payment record and its order together
+            with transaction.atomic():
+                payment = Payment.objects.create(
+                    user=request.user,
+                    stripe_checkout_session_id=session.session_id,
+                    amount=from_cents(sum(line.line_total_cents for line in lines)),
+                    product_name=product_name,
+                    status='pending',
+                    checkout_key=key,
+                    checkout_url=session.url,
+                    expires_at=session.expires_at,
+                )
+                place_order(payment)
+        except Exception:
+            # Nothing was saved, whatever failed; close the session so it cannot be paid
+            try:
+                gateway.get_gateway().expire_checkout_session(session.session_id)
+            except stripe.error.StripeError:
+                logger.exception('Could not expire checkout session %s', session.session_id)
+            raise
+        return session
+
+    session, outcome = checkout.get_or_create_session(key, create)
+    return Response({
+        'session_id': session.session_id,
+        'session_url': session.url
+    }, status=status.HTTP_201_CREATED if outcome == 'created' else status.HTTP_200_OK)
 
+@query_budget(7)  # Includes releasing the key of an expired session
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_checkout_session(request):
-    """Create a Stripe checkout session for payment"""
+    """Create (or reuse) a Stripe checkout session for payment"""
     serializer = CreateCheckoutSessionSerializer(data=request.data)
     
     if not serializer.is_valid():
@@ -22,46 +100,16 @@ def create_checkout_session(request):
     
     try:
         product_name = serializer.validated_data['product_name']
-        amount = serializer.validated_data['amount']
-        
-        # Convert amount to cents for Stripe
-        amount_cents = int(float(amount) * 100)
-        
-        # Create Stripe checkout session
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=[{
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': product_name,
-                    },
-                    'unit_amount': amount_cents,
-                },
-                'quantity': 1,
-            }],
-            mode='payment',
-            success_url=request.build_absolute_uri('/') + 'payment/success?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=request.build_absolute_uri('/') + 'payment/cancel',
-            metadata={
-                'user_id': request.user.id,
-                'product_name': product_name,
-            }
-        )
-        
-        # Save payment record
-        Payment.objects.create(
-            user=request.user,
-            stripe_checkout_session_id=checkout_session.id,
-            amount=amount,
-            product_name=product_name,
-            status='pending'
+        line = OrderItem.snapshot(product_name, serializer.validated_data['amount'])
+        return open_checkout(
+            request, [line], product_name, {'product_name': product_name},
+            lambda payment: Order.objects.place(payment, [line]),
         )
         
+    except checkout.CheckoutInProgress:
         return Response({
-            'session_id': checkout_session.id,
-            'session_url': checkout_session.url
-        }, status=status.HTTP_201_CREATED)
+            'error': 'This checkout is already being created, please try again'
+        }, status=status.HTTP_409_CONFLICT)
         
     except stripe.error.StripeError as e:
         return Response({
@@ -73,66 +121,46 @@ def create_checkout_session(request):
             'error': f'Server error: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(11)  # Includes releasing an expired session's key and undoing an order repriced meanwhile
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def create_cart_checkout_session(request):
-    """Create a Stripe checkout session for entire cart"""
+    """Create (or reuse) a Stripe checkout session for entire cart"""
     try:
         # Get user's cart
         from cart.models import Cart
-        cart = Cart.objects.get(user=request.user)
+        cart = Cart.objects.with_items().get(user=request.user)
         
-        if not cart.items.exists():
+        if not cart.total_items:
             return Response({
                 'error': 'Cart is empty'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Create line items for each cart item
-        line_items = []
-        for item in cart.items.all():
-            line_items.append({
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {
-                        'name': item.product.name,
-                    },
-                    'unit_amount': int(float(item.product.price) * 100),
-                },
-                'quantity': item.quantity,
-            })
-        
-        # Create Stripe checkout session
-        checkout_session = stripe.checkout.Session.create(
-            payment_method_types=['card'],
-            line_items=line_items,
-            mode='payment',
-            success_url=request.build_absolute_uri('/') + 'payment/success?session_id={CHECKOUT_SESSION_ID}',
-            cancel_url=request.build_absolute_uri('/') + 'payment/cancel',
-            metadata={
-                'user_id': request.user.id,
-                'cart_checkout': 'true',
-                'total_items': str(cart.total_items),
-            }
+        # Snapshot the cart's lines at today's prices; Stripe charges exactly these
+        lines = [
+            OrderItem.snapshot(item.product.name, item.product.price, item.quantity, product=item.product)
+            for item in cart.items.all()
+        ]
+        return open_checkout(
+            request, lines, f"Cart Checkout ({cart.total_items} items)",
+            {'cart_checkout': 'true', 'total_items': str(cart.total_items)},
+            lambda payment: Order.objects.place_from_cart(payment, cart.items.all(), lines),
         )
         
-        # Save payment record
-        Payment.objects.create(
-            user=request.user,
-            stripe_checkout_session_id=checkout_session.id,
-            amount=cart.total_price,
-            product_name=f"Cart Checkout ({cart.total_items} items)",
-            status='pending'
-        )
-        
-        return Response({
-            'session_id': checkout_session.id,
-            'session_url': checkout_session.url
-        }, status=status.HTTP_201_CREATED)
-        
     except Cart.DoesNotExist:
         return Response({
             'error': 'Cart not found'
         }, status=status.HTTP_404_NOT_FOUND)
+
+    except SnapshotMismatch:
+        return Response({
+            'error': 'Cart changed during checkout, please try again'
+        }, status=status.HTTP_409_CONFLICT)
+        
+    except checkout.CheckoutInProgress:
+        return Response({
+            'error': 'This checkout is already being created, please try again'
+        }, status=status.HTTP_409_CONFLICT)
         
     except stripe.error.StripeError as e:
         return Response({
@@ -144,10 +172,12 @@ def create_cart_checkout_session(request):
             'error': f'Server error: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(1)
 @csrf_exempt
 @api_view(['POST'])
+@permission_classes([AllowAny])  # Stripe calls this unauthenticated; the signature is the check
 def stripe_webhook(request):
-    """Handle Stripe webhook events"""
+    """Verify a Stripe event and queue it in the webhook inbox; process_webhooks applies it"""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
@@ -161,35 +191,32 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return HttpResponse(status=400)
 
-    # Handle the checkout.session.completed event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        
-        try:
-            payment = Payment.objects.get(
-                stripe_checkout_session_id=session['id']
-            )
-            payment.status = 'completed'
-            payment.save()
-            
-            # If this was a cart checkout, clear the cart
-            if session.get('metadata', {}).get('cart_checkout') == 'true':
-                from cart.models import Cart
-                try:
-                    cart = Cart.objects.get(user=payment.user)
-                    cart.items.all().delete()
-                except Cart.DoesNotExist:
-                    pass
-                    
-        except Payment.DoesNotExist:
-            pass
-
+    webhooks.record_event(event)
     return HttpResponse(status=200)
 
+@query_budget(1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def payment_history(request):
-    """Get user's payment history"""
-    payments = Payment.objects.filter(user=request.user).order_by('-created_at')
-    serializer = PaymentSerializer(payments, many=True)
-    return Response(serializer.data)
+    """Get user's payment history a page at a time, or per-status totals with ?summary=true"""
+    filters = PaymentHistoryFilter(request.query_params, queryset=Payment.objects.filter(user=request.user))
+    if not filters.is_valid():
+        return Response(filters.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.query_params.get('summary', '').lower() in ('true', '1', 'yes'):
+        return Response(payment_summary(filters.qs))
+
+    paginator = PaymentHistoryPagination()
+    page = paginator.paginate_queryset(filters.qs.select_related('order'), request)
+    serializer = PaymentSerializer(page, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+def payment_summary(payments):
+    """Count and amount per status, from one GROUP BY over the history index."""
+    by_status = {value: {'count': 0, 'total': '0.00'} for value, _ in Payment.STATUS_CHOICES}
+    count = 0
+    for row in payments.order_by().values('status').annotate(count=Count('id'), total=Sum('amount')):
+        total = Decimal(row['total']).quantize(Decimal('0.01'))
+        by_status[row['status']] = {'count': row['count'], 'total': str(total)}
+        count += row['count']
+    return {'count': count, 'by_status': by_status}
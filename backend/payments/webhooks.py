@@ -0,0 +1,174 @@
+"""
+Stripe webhook inbox.
+
+The webhook view only verifies the signature and records the event with
+record_event(). Redeliveries of an event id are ignored by the INSERT, so
+Stripe gets its 200 after one statement. The process_webhooks command
+drains the inbox. claim_batch() leases due events with SELECT ... FOR
+UPDATE SKIP LOCKED, so several workers can run side by side; on SQLite the
+database write lock serializes them instead. process_event() runs the
+handler registered for the event type in a transaction of its own. A
+failing event is retried with exponential backoff and jitter until
+WEBHOOK_MAX_ATTEMPTS, after which it is marked failed. Handlers must be
+idempotent, since a crash between the handler and the status update runs
+the event again once its lease expires.
+
+Settling a checkout settles its Order too. A paid order takes its lines
+off stock with one UPDATE, working from the order's snapshot rather than
+the cart; the bought lines leave the cart only after that commits, in a
+short transaction of its own, so the worker never holds product and cart
+locks together.
+"""
+import random
+import traceback
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from . import checkout
+from .models import Payment, WebhookEvent
+
+HANDLERS = {}
+
+# Payment status -> status of the payment's order
+ORDER_STATUSES = {'completed': 'paid', 'failed': 'failed', 'cancelled': 'cancelled'}
+
+
+def get_max_attempts():
+    return getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 8)
+
+
+def get_lease():
+    return timedelta(seconds=getattr(settings, 'WEBHOOK_LEASE_SECONDS', 300))
+
+
+def backoff(attempts):
+    """Delay before retry number `attempts`: doubling from the base up to the cap, with jitter."""
+    base = getattr(settings, 'WEBHOOK_RETRY_BASE_SECONDS', 30)
+    cap = getattr(settings, 'WEBHOOK_RETRY_MAX_SECONDS', 60 * 60)
+    delay = min(cap, base * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def handles(*event_types):
+    """Register a handler(obj, event) for Stripe event types; obj is the event's data.object."""
+    def register(func):
+        for event_type in event_types:
+            HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def record_event(event):
+    """Store a verified event; a redelivery of an event id already in the inbox is ignored."""
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event['id'], type=event['type'], payload=event)],
+        ignore_conflicts=True,
+    )
+
+
+def claim_batch(size):
+    """Lease up to `size` due events to this worker and return them oldest first."""
+    now = timezone.now()
+    with transaction.atomic():
+        events = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:size]
+        )
+        if events:
+            WebhookEvent.objects.filter(pk__in=[event.pk for event in events]).update(
+                next_attempt_at=now + get_lease()
+            )
+    return sorted(events, key=lambda event: event.received_at)
+
+
+def process_event(event, max_attempts=None):
+    """Apply one claimed event; returns its new status."""
+    handler = HANDLERS.get(event.type)
+    events = WebhookEvent.objects.filter(pk=event.pk)
+    if handler is None:
+        events.update(status='skipped', processed_at=timezone.now())
+        return 'skipped'
+    try:
+        with transaction.atomic():
+            handler(event.payload['data']['object'], event)
+            events.update(status='processed', attempts=models.F('attempts') + 1,
+                          processed_at=timezone.now(), last_error='')
+        return 'processed'
+    except Exception:
+        attempts = event.attempts + 1
+        status = 'failed' if attempts >= (max_attempts or get_max_attempts()) else 'pending'
+        events.update(status=status, attempts=attempts, last_error=traceback.format_exc(limit=5),
+                      next_attempt_at=timezone.now() + backoff(attempts))
+        return status
+
+
+def process_pending(batch_size=100, max_attempts=None):
+    """Claim and apply one batch; returns {status: count}."""
+    counts = {}
+    for event in claim_batch(batch_size):
+        status = process_event(event, max_attempts)
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+class PaymentNotFound(Exception):
+    """The event names a checkout session with no Payment yet; retried, since the row may still be committing."""
+
+
+def settle_payment(session_id, status):
+    """Move a pending payment and its order to status. Returns its user id, or None if it was already settled."""
+    payments = Payment.objects.filter(stripe_checkout_session_id=session_id)
+    if payments.filter(status='pending').update(status=status, updated_at=timezone.now()):
+        Order.objects.filter(payment__stripe_checkout_session_id=session_id).settle(ORDER_STATUSES[status])
+        user_id, key = payments.values_list('user_id', 'checkout_key').get()
+        if key:
+            transaction.on_commit(partial(checkout.forget, key))
+        return user_id
+    if not payments.exists():
+        raise PaymentNotFound(session_id)
+    return None
+
+
+def complete_payment(session_id, cart_checkout=False):
+    """Settle a paid checkout and take its order off stock. Returns the user id, or None if it was already settled."""
+    user_id = settle_payment(session_id, 'completed')
+    if user_id is None:
+        return None
+    ordered = OrderItem.objects.filter(order__payment__stripe_checkout_session_id=session_id)
+    ordered.decrement_stock()
+    if cart_checkout:
+        transaction.on_commit(partial(remove_ordered_lines, user_id, ordered), robust=True)
+    return user_id
+
+
+@handles('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+def complete_checkout(session, event):
+    if event.type == 'checkout.session.completed' and session.get('payment_status') == 'unpaid':
+        return  # Delayed payment method; async_payment_succeeded/failed settles it
+    complete_payment(session['id'], (session.get('metadata') or {}).get('cart_checkout') == 'true')
+
+
+def remove_ordered_lines(user_id, ordered):
+    """Take the bought products out of the user's cart; lines added since checkout stay."""
+    from cart.models import Cart, CartItem
+    carts = Cart.objects.filter(user_id=user_id)
+    with transaction.atomic():
+        if carts.bump_version():
+            CartItem.objects.filter(cart__user_id=user_id, product_id__in=ordered.values('product_id')).remove()
+            carts.refresh_totals()
+
+
+@handles('checkout.session.async_payment_failed')
+def fail_checkout(session, event):
+    settle_payment(session['id'], 'failed')
+
+
+@handles('checkout.session.expired')
+def expire_checkout(session, event):
+    settle_payment(session['id'], 'cancelled')
@@ -1,18 +1,59 @@
 from django.contrib import admin
+from django.db.models import Count, OuterRef, Subquery
+from shopbase.adminscale import EstimatedCountPaginator
+from . import category_cache
 from .models import Product, Category
+from .search import get_backend
+
+class CategoryListFilter(admin.SimpleListFilter):
+    """Active categories from products.category_cache, so the filter costs no query to render"""
+    title = 'category'
+    parameter_name = 'category__id__exact'
+
+    def lookups(self, request, model_admin):
+        return [(row['id'], f"{row['name']} ({row['products_count']})") for row in category_cache.get_categories()]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(category_id=self.value())
+        return queryset
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'is_active', 'created_at']
+    list_display = ['name', 'slug', 'products_count', 'is_active', 'created_at']
     list_filter = ['is_active', 'created_at']
     search_fields = ['name', 'description']
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ['is_active']
 
+    def get_queryset(self, request):
+        # A correlated count per listed category, answered from the product category index
+        counts = Product.objects.filter(category=OuterRef('pk')).order_by().values('category').annotate(
+            count=Count('pk')
+        ).values('count')
+        return super().get_queryset(request).annotate(admin_products_count=Subquery(counts))
+
+    @admin.display(description='Products', ordering='admin_products_count')
+    def products_count(self, obj):
+        return obj.admin_products_count or 0
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ['name', 'category', 'price', 'stock', 'is_active', 'created_at']
-    list_filter = ['category', 'is_active', 'created_at']
+    list_display = ['name', 'sku', 'category', 'price', 'stock', 'is_active', 'created_at']
+    list_filter = [CategoryListFilter, 'is_active', 'created_at']
+    list_select_related = ['category']
     search_fields = ['name', 'description']
+    search_help_text = 'Full-text search over name and description'
     list_editable = ['price', 'stock', 'is_active']
     readonly_fields = ['created_at', 'updated_at']
+    autocomplete_fields = ['category']
+    # Newest first through the primary key, so the default page needs no sort
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_search_results(self, request, queryset, search_term):
+        # The product search index (products.search) instead of icontains scans
+        if not search_term.strip():
+            return queryset, False
+        return get_backend().search(queryset, search_term), False
@@ -0,0 +1,74 @@
+"""
+Keyword-based category classifier for bulk product categorization.
+
+Rules map a category slug to name keywords, in priority order. All
+keywords are compiled into one regex, so classifying a name is a single
+scan no matter how many rules there are; when keywords of several
+categories match, the earliest rule wins, also when they match at the
+same place ("headphone" and "phone" in "headphones"). Matching is a case-insensitive
+substring match, like the original per-product classifier.
+"""
+import json
+import re
+
+DEFAULT_RULES = [
+    ('electronics', ['phone', 'laptop', 'computer', 'headphone', 'electronic']),
+    ('clothing', ['shirt', 'pants', 'dress', 'shoes', 'clothing']),
+    ('books', ['book', 'novel', 'guide']),
+    ('toys-games', ['toy', 'game', 'play']),
+    ('health-beauty', ['beauty', 'health', 'care', 'cosmetic']),
+]
+
+
+def load_rules(path):
+    """
+    Read rules from a JSON file.
+
+    Accepts either {"slug": ["keyword", ...], ...} (key order is priority)
+    or [{"category": "slug", "keywords": [...]}, ...].
+    """
+    with open(path, encoding='utf-8') as handle:
+        data = json.load(handle)
+    if isinstance(data, dict):
+        data = [{'category': slug, 'keywords': keywords} for slug, keywords in data.items()]
+    rules = []
+    for rule in data:
+        keywords = rule.get('keywords') if isinstance(rule, dict) else None
+        if not isinstance(keywords, list) or not rule.get('category'):
+            raise ValueError(f'Invalid rule {rule!r}: expected a category slug and a list of keywords')
+        rules.append((rule['category'], [str(keyword) for keyword in keywords]))
+    return rules
+
+
+class KeywordClassifier:
+    def __init__(self, rules):
+        self.slugs = []
+        self.priority = {}
+        for slug, keywords in rules:
+            for keyword in keywords:
+                keyword = keyword.strip().lower()
+                if keyword and keyword not in self.priority:
+                    self.priority[keyword] = len(self.slugs)
+            self.slugs.append(slug)
+        if not self.priority:
+            raise ValueError('No keywords to classify with')
+        # The lookahead reports one match per offset, the longest; every shorter keyword matching
+        # there is a prefix of it, so each keyword is ranked by the best rule among its prefixes
+        alternatives = sorted(self.priority, key=len, reverse=True)
+        self.pattern = re.compile('(?=(%s))' % '|'.join(map(re.escape, alternatives)), re.IGNORECASE)
+        self.rank = {
+            keyword: min(self.priority[keyword[:end]] for end in range(1, len(keyword) + 1)
+                         if keyword[:end] in self.priority)
+            for keyword in self.priority
+        }
+
+    def classify(self, name):
+        """Return the slug of the highest-priority rule matching name, or None."""
+        best = None
+        for keyword in self.pattern.findall(name or ''):
+            rank = self.rank[keyword.lower()]
+            if best is None or rank < best:
+                best = rank
+                if rank == 0:
+                    break
+        return None if best is None else self.slugs[best]
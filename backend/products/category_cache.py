@@ -0,0 +1,136 @@
+"""
+Pre-serialized category listing kept in Django's cache framework.
+
+The listing is built from one annotated query and stored as plain dicts,
+under a key carrying a generation number. Model signals (see
+products.signals) invalidate it by bumping the generation; the next read
+rebuilds under the new key. Bumping is an atomic incr, so concurrent
+writers cannot undo each other, and a rebuild that read the database
+before a write stores its payload under the generation it started with,
+which nobody reads any more.
+
+Product writes only change counts, so for those update_counts() re-counts
+just the affected categories and stores the patched listing as the next
+generation. The next key is claimed with cache.add(), so of two writers
+patching the same generation one wins and the other invalidates instead.
+Writes that skip signals (queryset.update, bulk_create) call invalidate()
+themselves or are picked up when the entry expires.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Category
+from .serializers import CategorySerializer
+
+CACHE_KEY = 'products:categories:{}'
+GENERATION_KEY = 'products:categories:generation'
+STATS_KEY = 'products:categories:stats:{}'
+STAT_NAMES = ('hits', 'misses', 'rebuilds', 'invalidations', 'count_updates')
+
+
+def active_products_count():
+    return Count('products', filter=Q(products__is_active=True))
+
+
+def active_categories():
+    """Active categories annotated with their active product count."""
+    return Category.objects.filter(is_active=True).annotate(
+        active_products_count=active_products_count()
+    ).order_by('name')
+
+
+def get_timeout():
+    return getattr(settings, 'CATEGORY_CACHE_TIMEOUT', 60 * 60)
+
+
+def serialize(queryset):
+    return [dict(row) for row in CategorySerializer(queryset, many=True).data]
+
+
+def get_generation():
+    cache.add(GENERATION_KEY, 0, None)
+    return cache.get(GENERATION_KEY, 0)
+
+
+def get_categories():
+    """Return the cached listing, rebuilding it on a miss."""
+    generation = get_generation()
+    payload = cache.get(CACHE_KEY.format(generation))
+    if payload is None:
+        incr_stat('misses')
+        return rebuild(generation)
+    incr_stat('hits')
+    return payload
+
+
+def get_category(slug):
+    """Return the cached row for an active category, or None."""
+    return next((row for row in get_categories() if row['slug'] == slug), None)
+
+
+def rebuild(generation):
+    started = time.perf_counter()
+    payload = serialize(active_categories())
+    cache.set(CACHE_KEY.format(generation), payload, get_timeout())
+    cache.set(STATS_KEY.format('last_rebuild_ms'), round((time.perf_counter() - started) * 1000, 3), None)
+    incr_stat('rebuilds')
+    return payload
+
+
+def invalidate():
+    """Drop the cached listing; call it after a category or product write has committed."""
+    cache.delete(CACHE_KEY.format(get_generation()))  # Free it now rather than when it expires
+    incr(GENERATION_KEY)
+    incr_stat('invalidations')
+
+
+def update_counts(category_ids):
+    """
+    Re-count the active products of these categories in the cached listing;
+    call it after a product write has committed. With no listing cached, or
+    when another writer already moved on from this generation, it invalidates.
+    """
+    generation = get_generation()
+    payload = cache.get(CACHE_KEY.format(generation))
+    if payload is None:
+        # A rebuild may be reading the database from before the write; move it to a stale generation
+        invalidate()
+        return
+    listed = {row['id'] for row in payload} & set(category_ids)
+    if not listed:
+        return  # Inactive categories are not in the listing
+    counts = dict(Category.objects.filter(pk__in=listed).order_by().values('pk').annotate(
+        count=active_products_count()
+    ).values_list('pk', 'count'))
+    patched = [{**row, 'products_count': counts[row['id']]} if row['id'] in counts else row for row in payload]
+    if not cache.add(CACHE_KEY.format(generation + 1), patched, get_timeout()):
+        # The other writer's patch lacks this write; drop it in case it becomes current before we move on
+        cache.delete(CACHE_KEY.format(generation + 1))
+        invalidate()
+        return
+    incr(GENERATION_KEY)
+    incr_stat('count_updates')
+
+
+def incr_stat(name):
+    incr(STATS_KEY.format(name))
+
+
+def incr(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)  # Evicted between add() and incr()
+
+
+def get_stats():
+    stats = {name: cache.get(STATS_KEY.format(name), 0) for name in STAT_NAMES}
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else None
+    stats['last_rebuild_ms'] = cache.get(STATS_KEY.format('last_rebuild_ms'))
+    stats['cached'] = cache.get(CACHE_KEY.format(get_generation())) is not None
+    return stats
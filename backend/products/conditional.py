@@ -0,0 +1,120 @@
+"""
+Conditional GET and read-through payload caching for catalog reads.
+
+List ETags are derived from the catalog version, a counter kept in the
+single CatalogVersion row. Catalog writes bump it when they commit (see
+products.signals); writes that skip the signals (queryset.update,
+bulk_create) must call bump_catalog_version() themselves. Reading it is
+a primary key lookup, so it costs the same however large the catalog is.
+
+The version read is cached in Django's cache for CATALOG_VERSION_TIMEOUT
+seconds, and a bump deletes the cached copy, so with a shared cache
+writes show at once and with a per-process one within the timeout.
+Within it, a revalidating client gets its 304 without touching the
+database.
+
+Product detail payloads are cached per product under the current
+version, with a strong ETag computed from the payload itself.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+VERSION_KEY = 'products:catalog-version'
+PRODUCT_KEY = 'products:product:{version}:{host}:{pk}'
+
+
+# Last-Modified of an empty catalog
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def get_timeout():
+    return getattr(settings, 'PRODUCT_CACHE_TIMEOUT', 60 * 60)
+
+
+def get_version_timeout():
+    return getattr(settings, 'CATALOG_VERSION_TIMEOUT', 5)
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(
+        json.dumps(parts, sort_keys=True, cls=DjangoJSONEncoder).encode('utf-8'),
+        usedforsecurity=False,
+    )
+    return f'"{digest.hexdigest()}"'
+
+
+def catalog_version():
+    """Return the current (token, last_modified) pair, reading it from the database if it is not cached."""
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        version = load_catalog_version()
+        cache.set(VERSION_KEY, version, get_version_timeout())
+    return version
+
+
+def load_catalog_version():
+    from .models import CatalogVersion
+
+    row = CatalogVersion.objects.filter(pk=1).values_list('version', 'updated_at').first()
+    if row is None:
+        return make_etag(0).strip('"'), EPOCH
+    version, updated_at = row
+    return make_etag(version, updated_at).strip('"'), updated_at
+
+
+def bump_catalog_version():
+    """Count a committed catalog write; call it on commit of any product/category write."""
+    from .models import CatalogVersion
+
+    now = timezone.now()
+    if not CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1, updated_at=now):
+        CatalogVersion.objects.get_or_create(pk=1, defaults={'version': 1, 'updated_at': now})
+    cache.delete(VERSION_KEY)
+
+
+def respond(request, data, etag, last_modified):
+    """Return a 304/412 if the request's validators match, else the payload with validators set."""
+    timestamp = int(last_modified.timestamp())
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = Response(data)
+    set_validators(response, etag, last_modified)
+    return response
+
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def list_validators(request):
+    """ETag and Last-Modified for a catalog listing, without touching the database."""
+    token, last_modified = catalog_version()
+    return make_etag(token, request.get_host(), request.get_full_path()), last_modified
+
+
+def get_product_entry(request, view):
+    """Read-through cache of a product detail payload and its validators."""
+    token, _ = catalog_version()
+    key = PRODUCT_KEY.format(version=token, host=request.get_host(), pk=view.kwargs[view.lookup_field])
+    entry = cache.get(key)
+    if entry is None:
+        product = view.get_object()
+        data = view.get_serializer(product).data
+        modified = [product.updated_at]
+        if product.category is not None:
+            modified.append(product.category.updated_at)
+        entry = {'data': data, 'etag': make_etag(data), 'last_modified': max(modified)}
+        cache.set(key, entry, get_timeout())
+    return entry
@@ -0,0 +1,23 @@
+from rest_framework.filters import OrderingFilter, SearchFilter
+
+from .search import get_backend
+
+
+class ProductSearchFilter(SearchFilter):
+    """`?search=` served by the configured full-text backend instead of icontains scans."""
+
+    def filter_queryset(self, request, queryset, view):
+        term = request.query_params.get(self.search_param, '').strip()
+        if not term:
+            return queryset
+        return get_backend().search(queryset, term)
+
+
+class RankedOrderingFilter(OrderingFilter):
+    """Order search results by relevance unless the client asked for an ordering."""
+
+    def get_ordering(self, request, queryset, view):
+        # Only when the backend built a match: a term with no searchable tokens leaves the queryset unranked
+        if 'search_rank' in queryset.query.annotations and not request.query_params.get(self.ordering_param):
+            return [get_backend().rank_ordering]
+        return super().get_ordering(request, queryset, view)
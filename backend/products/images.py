@@ -0,0 +1,136 @@
+"""
+Resized and re-encoded variants of Product.image.
+
+When a product image is uploaded or replaced, render_variants() runs in a
+process pool after the transaction commits. It writes fixed-width copies
+in the original format plus WebP/AVIF next to the original under
+MEDIA_ROOT (Foo.jpg -> Foo__320w.webp). The resulting manifest is stored
+on Product.image_variants, and ProductSerializer turns it into srcset
+strings.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+ORIGINAL = 'original'
+FORMAT_EXTENSIONS = {'webp': 'webp', 'avif': 'avif', 'jpeg': 'jpg', 'png': 'png'}
+
+_executor = None
+
+
+def get_widths():
+    return tuple(getattr(settings, 'PRODUCT_IMAGE_WIDTHS', (160, 320, 640, 1280)))
+
+
+def get_formats():
+    """Formats to encode besides the original, limited to what this Pillow build supports."""
+    from PIL import features
+
+    formats = [ORIGINAL]
+    for name in getattr(settings, 'PRODUCT_IMAGE_FORMATS', ('webp', 'avif')):
+        try:
+            supported = features.check(name)
+        except ValueError:
+            supported = False
+        if supported:
+            formats.append(name)
+    return formats
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2))
+    return _executor
+
+
+def variant_name(name, width, fmt):
+    stem, ext = os.path.splitext(name)
+    ext = ext.lstrip('.') if fmt == ORIGINAL else FORMAT_EXTENSIONS[fmt]
+    return f'{stem}__{width}w.{ext}'
+
+
+def render_variants(root, name, widths, formats, quality=80):
+    """
+    Write every variant of MEDIA_ROOT/name and return {format: {width: name}}.
+
+    Runs in a worker process, so it only touches the filesystem.
+    """
+    from PIL import Image, ImageOps
+
+    manifest = {}
+    with Image.open(os.path.join(root, name)) as source:
+        source = ImageOps.exif_transpose(source)
+        original_format = (source.format or 'jpeg').lower()
+        for width in widths:
+            if width >= source.width:
+                continue  # Never upscale; the original covers this size
+            height = round(source.height * width / source.width)
+            resized = source.resize((width, height), Image.Resampling.LANCZOS)
+            for fmt in formats:
+                encoder = original_format if fmt == ORIGINAL else fmt
+                image = resized
+                if encoder == 'jpeg' and image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                target = variant_name(name, width, fmt)
+                image.save(os.path.join(root, target), format=encoder.upper(), quality=quality)
+                manifest.setdefault(fmt, {})[str(width)] = target
+    return manifest
+
+
+def schedule_variants(product):
+    """Render variants for a product's current image once the surrounding transaction commits."""
+    if not product.image:
+        return
+    pk, name = product.pk, product.image.name
+
+    def submit():
+        if getattr(settings, 'PRODUCT_IMAGE_WORKERS', 2) == 0:
+            store_manifest(pk, name, render_variants(settings.MEDIA_ROOT, name, get_widths(), get_formats()))
+            return
+        future = get_executor().submit(render_variants, settings.MEDIA_ROOT, name, get_widths(), get_formats())
+        future.add_done_callback(lambda done: _store_result(pk, name, done))
+
+    transaction.on_commit(submit)
+
+
+def _store_result(pk, name, future):
+    # Runs on the pool's callback thread, which needs its own DB connection
+    try:
+        store_manifest(pk, name, future.result())
+    except Exception:
+        logger.exception('Rendering image variants failed for product %s (%s)', pk, name)
+    finally:
+        close_old_connections()
+
+
+def store_manifest(pk, name, manifest):
+    from . import conditional
+    from .models import Product
+
+    # Skip the write if the image was replaced while we were rendering
+    updated = Product.objects.filter(pk=pk, image=name).update(image_variants=manifest, updated_at=timezone.now())
+    if updated:
+        conditional.bump_catalog_version()
+    return updated
+
+
+def delete_variants(manifest):
+    for sizes in (manifest or {}).values():
+        for name in sizes.values():
+            default_storage.delete(name)
+
+
+def srcset(manifest, build_url):
+    """{format: "url 160w, url 320w"} for a stored manifest."""
+    return {
+        fmt: ', '.join(f'{build_url(name)} {width}w' for width, name in sorted(sizes.items(), key=lambda s: int(s[0])))
+        for fmt, sizes in (manifest or {}).items()
+    }
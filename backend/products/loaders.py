@@ -0,0 +1,70 @@
+"""
+Request-scoped identity map for Product lookups.
+
+Serializers and views in the same request share one ProductLoader (see
+get_product_loader), so a product is read at most once per request.
+load_many() fetches all the ids it is missing in a single IN query, so
+callers that know their ids up front batch them through it. Loaded
+products (and ids found missing) are never refreshed within a
+request; code that needs current stock for a write should lock or re-read
+the row itself.
+
+Hits and misses are reported through QueryBudgetMiddleware's debug
+headers via request.loader_stats.
+"""
+from .models import Product
+
+
+class LoaderStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.batches = 0
+
+    def __str__(self):
+        return f'hits={self.hits} misses={self.misses} batches={self.batches}'
+
+
+class ProductLoader:
+    def __init__(self, queryset=None):
+        self.queryset = queryset if queryset is not None else Product.objects.select_related('category')
+        self.cache = {}
+        self.stats = LoaderStats()
+
+    def load(self, pk):
+        """Return the product with this id, or None if it does not exist."""
+        return self.load_many([pk]).get(self.key(pk))
+
+    def load_many(self, ids):
+        """Return {id: product} for the ids that exist, in one query at most."""
+        keys = [pk for pk in map(self.key, ids) if pk is not None]
+        missing = {pk for pk in keys if pk not in self.cache}
+        self.stats.hits += len(keys) - len(missing)
+        self.stats.misses += len(missing)
+        if missing:
+            found = {product.pk: product for product in self.queryset.filter(pk__in=missing)}
+            self.stats.batches += 1
+            for pk in missing:
+                self.cache[pk] = found.get(pk)
+        return {pk: self.cache[pk] for pk in keys if self.cache[pk] is not None}
+
+    @staticmethod
+    def key(pk):
+        try:
+            return int(pk)
+        except (TypeError, ValueError):
+            return None
+
+
+def get_product_loader(request=None):
+    """Return the request's ProductLoader, creating it on first use."""
+    if request is None:
+        return ProductLoader()
+    request = getattr(request, '_request', request)  # Share one loader between DRF and Django requests
+    loader = getattr(request, 'product_loader', None)
+    if loader is None:
+        loader = request.product_loader = ProductLoader()
+        stats = getattr(request, 'loader_stats', None)
+        if stats is not None:
+            stats['product'] = loader.stats
+    return loader
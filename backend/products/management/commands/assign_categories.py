@@ -1,48 +1,93 @@
-from django.core.management.base import BaseCommand
-from products.models import Product, Category
 import random
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from products import category_cache, conditional
+from products.categorizer import DEFAULT_RULES, KeywordClassifier, load_rules
+from products.models import Product, Category
+
+UNMATCHED = '(unmatched)'
+
 
 class Command(BaseCommand):
-    help = 'Assign existing products to random categories'
+    help = 'Assign products to categories by keywords in their names'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rules', help='JSON file of {"category-slug": ["keyword", ...]} rules in priority order')
+        parser.add_argument('--all', action='store_true',
+                            help='Re-classify the whole catalog, not only uncategorized products')
+        parser.add_argument('--no-random', action='store_true',
+                            help='Leave unmatched uncategorized products alone instead of picking a random category')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Products read and written per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only print what would change')
 
     def handle(self, *args, **options):
-        products = Product.objects.filter(category__isnull=True)
-        categories = list(Category.objects.all())
-        
+        categories = dict(Category.objects.values_list('slug', 'id'))
         if not categories:
             self.stdout.write(
                 self.style.ERROR('No categories found. Run populate_categories first.')
             )
             return
-        
-        updated_count = 0
-        for product in products:
-            # Assign random category based on product name
-            category = self.assign_category_by_name(product.name, categories)
-            product.category = category
-            product.save()
-            updated_count += 1
-            self.stdout.write(
-                self.style.SUCCESS(f'Assigned {product.name} to {category.name}')
-            )
-        
+        names = {pk: slug for slug, pk in categories.items()}
+
+        try:
+            rules = load_rules(options['rules']) if options['rules'] else DEFAULT_RULES
+            classifier = KeywordClassifier(rules)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Could not load rules: {exc}')
+        unknown = sorted({slug for slug, _ in rules} - set(categories))
+        if unknown:
+            self.stdout.write(self.style.WARNING(f'Ignoring rules for unknown categories: {", ".join(unknown)}'))
+
+        products = Product.objects.all() if options['all'] else Product.objects.filter(category__isnull=True)
+        products = products.only('id', 'name', 'category_id').order_by('pk')
+        fallback = None if options['no_random'] else list(categories.values())
+        dry_run = options['dry_run']
+
+        started = time.perf_counter()
+        histogram = Counter()
+        scanned = changed = 0
+        last_pk = 0
+        while True:
+            # Keyset batches rather than one long-lived cursor: writing to the table
+            # while a SQLite cursor is still reading it is undefined behaviour
+            batch = list(products.filter(pk__gt=last_pk)[:options['chunk_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            scanned += len(batch)
+            now = timezone.now()
+            updates = []
+            for product in batch:
+                category_id = categories.get(classifier.classify(product.name))
+                if category_id is None and product.category_id is None and fallback:
+                    category_id = random.choice(fallback)
+                if category_id is None:
+                    histogram[names.get(product.category_id, UNMATCHED)] += 1
+                    continue
+                histogram[names[category_id]] += 1
+                if category_id != product.category_id:
+                    product.category_id = category_id
+                    product.updated_at = now
+                    updates.append(product)
+            changed += len(updates)
+            if updates and not dry_run:
+                Product.objects.bulk_update(updates, ['category', 'updated_at'])
+
+        if changed and not dry_run:
+            # bulk_update skips model signals, so refresh the catalog caches once
+            category_cache.invalidate()
+            conditional.bump_catalog_version()
+
+        elapsed = time.perf_counter() - started
+        for slug, count in histogram.most_common():
+            self.stdout.write(f'{slug:<24} {count:>10}')
+        rate = scanned / elapsed if elapsed else 0
+        verb = 'Would update' if dry_run else 'Updated'
         self.stdout.write(
-            self.style.SUCCESS(f'Successfully updated {updated_count} products')
+            self.style.SUCCESS(
+                f'{verb} {changed} of {scanned} products in {elapsed:.2f}s ({rate:.0f} products/sec)'
+            )
         )
-    
-    def assign_category_by_name(self, product_name, categories):
-        name_lower = product_name.lower()
-        
-        # Simple keyword-based category assignment
-        if any(word in name_lower for word in ['phone', 'laptop', 'computer', 'headphone', 'electronic']):
-            return next((cat for cat in categories if cat.slug == 'electronics'), random.choice(categories))
-        elif any(word in name_lower for word in ['shirt', 'pants', 'dress', 'shoes', 'clothing']):
-            return next((cat for cat in categories if cat.slug == 'clothing'), random.choice(categories))
-        elif any(word in name_lower for word in ['book', 'novel', 'guide']):
-            return next((cat for cat in categories if cat.slug == 'books'), random.choice(categories))
-        elif any(word in name_lower for word in ['toy', 'game', 'play']):
-            return next((cat for cat in categories if cat.slug == 'toys-games'), random.choice(categories))
-        elif any(word in name_lower for word in ['beauty', 'health', 'care', 'cosmetic']):
-            return next((cat for cat in categories if cat.slug == 'health-beauty'), random.choice(categories))
-        else:
-            return random.choice(categories)
@@ -0,0 +1,58 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from products import conditional
+from products.images import get_formats, get_widths, render_variants
+from products.models import Product
+
+class Command(BaseCommand):
+    help = 'Render thumbnail/WebP/AVIF variants for existing product images in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=200, help='Products saved per bulk_update')
+        parser.add_argument('--force', action='store_true', help='Re-render products that already have variants')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            products = products.filter(image_variants={})
+        jobs = list(products.values_list('pk', 'image'))
+        if not jobs:
+            self.stdout.write(self.style.WARNING('No product images need variants'))
+            return
+
+        widths, formats = get_widths(), get_formats()
+        self.stdout.write(f'Rendering {len(jobs)} images at {widths} as {formats}')
+        started = time.perf_counter()
+        done, failed, pending = 0, 0, []
+
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            futures = {
+                pool.submit(render_variants, settings.MEDIA_ROOT, name, widths, formats): (pk, name)
+                for pk, name in jobs
+            }
+            for future in as_completed(futures):
+                pk, name = futures[future]
+                try:
+                    pending.append(Product(pk=pk, image_variants=future.result(), updated_at=timezone.now()))
+                    done += 1
+                except Exception as exc:
+                    failed += 1
+                    self.stdout.write(self.style.ERROR(f'Product {pk} ({name}): {exc}'))
+                if len(pending) >= options['batch_size']:
+                    Product.objects.bulk_update(pending, ['image_variants', 'updated_at'])
+                    pending = []
+        if pending:
+            Product.objects.bulk_update(pending, ['image_variants', 'updated_at'])
+        conditional.bump_catalog_version()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rendered {done} images ({failed} failed) in {elapsed:.1f}s, {done / elapsed:.1f} images/sec'
+            )
+        )
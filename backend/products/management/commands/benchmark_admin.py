@@ -0,0 +1,135 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from cart.models import Cart, CartItem
+from payments.models import Payment
+from products import category_cache
+from products.models import Category, Product
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Seed large tables and time every ShopBase admin changelist against a fixed budget (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000,
+                            help='Rows to seed into each of products, users, carts, cart items and payments')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed renders per changelist')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+        parser.add_argument('--max-ms', type=float, default=500, help='Render time budget per changelist (p50)')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            category = self.seed(options['rows'], options['categories'], options['batch_size'])
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+            category_cache.invalidate()
+
+            admin_user = User.objects.create_superuser('admin-benchmark', 'admin-benchmark@example.com', None)
+            self.client = Client()
+            self.client.force_login(admin_user)
+            pages = [
+                ('products', 'admin:products_product_changelist', {}),
+                ('products by category', 'admin:products_product_changelist', {'category__id__exact': category.pk}),
+                ('products search', 'admin:products_product_changelist', {'q': 'benchmark'}),
+                ('categories', 'admin:products_category_changelist', {}),
+                ('carts', 'admin:cart_cart_changelist', {}),
+                ('carts search', 'admin:cart_cart_changelist', {'q': 'admin-bench-0000042'}),
+                ('cart items', 'admin:cart_cartitem_changelist', {}),
+                ('payments', 'admin:payments_payment_changelist', {}),
+                ('payments by status', 'admin:payments_payment_changelist', {'status__exact': 'completed'}),
+                ('users', 'admin:accounts_user_changelist', {}),
+                ('users search', 'admin:accounts_user_changelist', {'q': 'admin-bench-00001'}),
+            ]
+            results = [(label, *self.measure(name, params, options['repeat'])) for label, name, params in pages]
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{options["rows"]} rows per table, p50 of {options["repeat"]} renders')
+        self.stdout.write(f'{"changelist":<22} {"p50":>10} {"queries":>8}')
+        slow = 0
+        for label, p50, queries in results:
+            within = p50 <= options['max_ms']
+            slow += not within
+            line = f'{label:<22} {p50:>8.1f}ms {queries:>8}'
+            self.stdout.write(line if within else self.style.WARNING(f'{line}  over {options["max_ms"]:.0f}ms'))
+        if slow:
+            self.stdout.write(self.style.WARNING(f'{slow} changelists over budget; seeded rows were rolled back'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All changelists within budget; seeded rows were rolled back'))
+
+    def seed(self, rows, category_count, batch_size):
+        rng = random.Random(42)
+        now = timezone.now()
+        categories = Category.objects.bulk_create([
+            Category(name=f'Admin Benchmark {i}', slug=f'admin-benchmark-{i}') for i in range(category_count)
+        ])
+        self.seed_model(Product, rows, batch_size, lambda i: Product(
+            name=f'Benchmark Product {i:07d}',
+            sku=f'ADMIN-BENCH-{i:07d}',
+            price=Decimal(rng.randint(100, 50_000)) / 100,
+            stock=rng.randint(0, 100),
+            category=rng.choice(categories),
+            is_active=rng.random() < 0.9,
+            created_at=now - timedelta(seconds=rng.randint(0, 2 * 365 * 86400)),
+        ))
+        self.seed_model(User, rows, batch_size, lambda i: User(
+            username=f'admin-bench-{i:07d}', email=f'admin-bench-{i:07d}@example.com', password='!',
+            date_joined=now - timedelta(seconds=rng.randint(0, 2 * 365 * 86400)),
+        ))
+        # Seeded rows are contiguous, so ids can be derived instead of read back
+        first_user = User.objects.filter(username='admin-bench-0000000').values_list('pk', flat=True).get()
+        first_product = Product.objects.filter(sku='ADMIN-BENCH-0000000').values_list('pk', flat=True).get()
+        self.seed_model(Cart, rows, batch_size, lambda i: Cart(
+            user_id=first_user + i, total_items=2, total_price=Decimal('10.00'),
+            updated_at=now - timedelta(seconds=rng.randint(0, 90 * 86400)),
+        ))
+        first_cart = Cart.objects.filter(user_id=first_user).values_list('pk', flat=True).get()
+        self.seed_model(CartItem, rows, batch_size, lambda i: CartItem(
+            cart_id=first_cart + i, product_id=first_product + rng.randrange(rows), quantity=2,
+        ))
+        statuses = [status for status, _ in Payment.STATUS_CHOICES]
+        self.seed_model(Payment, rows, batch_size, lambda i: Payment(
+            user_id=first_user + rng.randrange(rows),
+            stripe_checkout_session_id=f'cs_admin_bench_{i:07d}',
+            amount=Decimal(rng.randint(100, 50_000)) / 100,
+            status=rng.choice(statuses),
+            product_name=f'Benchmark Product {rng.randrange(rows):07d}',
+            created_at=now - timedelta(seconds=rng.randint(0, 2 * 365 * 86400)),
+        ))
+        return categories[len(categories) // 2]
+
+    def seed_model(self, model, rows, batch_size, build):
+        seeded = 0
+        while seeded < rows:
+            count = min(batch_size, rows - seeded)
+            model.objects.bulk_create([build(seeded + i) for i in range(count)])
+            seeded += count
+            self.stdout.write(f'Seeded {seeded}/{rows} {model._meta.verbose_name_plural}', ending='\r')
+        self.stdout.write('')
+
+    def measure(self, name, params, repeat):
+        url = reverse(name)
+        self.render(url, params)  # Warm caches
+        samples = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                self.render(url, params)
+                samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples), len(queries)
+
+    def render(self, url, params):
+        response = self.client.get(url, params)
+        assert response.status_code == 200, (url, response.status_code)
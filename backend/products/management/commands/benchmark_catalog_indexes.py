@@ -0,0 +1,105 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory
+from products.models import Category, Product
+from products.views import ProductListView
+
+ORDERINGS = ['-created_at', 'created_at', 'price', '-price', 'name', '-name']
+
+
+class Command(BaseCommand):
+    help = 'Compare ProductListView latency with and without the catalog indexes (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=1_000_000, help='Products to seed')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed requests per combination')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        self.view = ProductListView.as_view()
+        self.factory = APIRequestFactory()
+        indexes = Product._meta.indexes
+
+        with transaction.atomic():
+            categories = self.seed(options['size'], options['categories'], options['batch_size'])
+            category = categories[len(categories) // 2]
+            filters = [
+                ('none', {}),
+                ('category', {'category': category.pk}),
+                ('category__slug', {'category__slug': category.slug}),
+            ]
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+            after = self.run_all(filters, options['repeat'])
+            # DDL is transactional on SQLite and PostgreSQL, so the rollback restores these
+            with connection.cursor() as cursor:
+                for index in indexes:
+                    cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+            before = self.run_all(filters, options['repeat'])
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{Product.objects.count() + options["size"]} products, p50 of {options["repeat"]} requests')
+        self.stdout.write(f'{"filter":<16} {"ordering":<12} {"before":>10} {"after":>10} {"speedup":>8}')
+        for key, with_indexes in after.items():
+            without = before[key]
+            self.stdout.write(
+                f'{key[0]:<16} {key[1]:<12} {without:>8.2f}ms {with_indexes:>8.2f}ms '
+                f'{without / with_indexes:>7.1f}x'
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; seeded rows were rolled back'))
+
+    def seed(self, size, category_count, batch_size):
+        rng = random.Random(42)
+        categories = Category.objects.bulk_create([
+            Category(name=f'Index Benchmark {i}', slug=f'index-benchmark-{i}') for i in range(category_count)
+        ])
+        now = timezone.now()
+        seeded = 0
+        while seeded < size:
+            count = min(batch_size, size - seeded)
+            Product.objects.bulk_create([
+                Product(
+                    name=f'Benchmark Product {seeded + i:07d}',
+                    price=Decimal(rng.randint(100, 50_000)) / 100,
+                    stock=rng.randint(0, 100),
+                    category=rng.choice(categories),
+                    is_active=rng.random() < 0.9,
+                    created_at=now - timedelta(seconds=rng.randint(0, 2 * 365 * 86400)),
+                )
+                for i in range(count)
+            ])
+            seeded += count
+            self.stdout.write(f'Seeded {seeded}/{size}', ending='\r')
+        self.stdout.write('')
+        return categories
+
+    def run_all(self, filters, repeat):
+        results = {}
+        for label, params in filters:
+            for ordering in ORDERINGS:
+                query = dict(params, ordering=ordering)
+                results[label, ordering] = self.timed(lambda: self.request(query), repeat)
+        return results
+
+    def request(self, query):
+        response = self.view(self.factory.get('/api/products/', query))
+        assert response.status_code == 200, response.status_code
+        response.render()
+
+    def timed(self, run, repeat):
+        run()  # Warm caches
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,87 @@
+import random
+import statistics
+import time
+from decimal import Decimal
+from functools import reduce
+from operator import and_
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+from products.models import Category, Product
+from products.search import get_backend
+
+WORDS = [
+    'wireless', 'organic', 'cotton', 'leather', 'smart', 'vintage', 'portable', 'ceramic',
+    'bamboo', 'steel', 'linen', 'velvet', 'oak', 'carbon', 'silk', 'wool', 'glass', 'copper',
+]
+NOUNS = [
+    'headphones', 'jacket', 'lamp', 'keyboard', 'speaker', 'mug', 'backpack', 'watch',
+    'blanket', 'table', 'shirt', 'kettle', 'charger', 'notebook', 'sneakers', 'diffuser',
+]
+QUERIES = ['lamp', 'wire', 'organic cotton', 'steel watch', 'velv', 'xyzzy']
+
+
+class Command(BaseCommand):
+    help = 'Compare icontains SearchFilter latency with the full-text backend (rolled back afterwards)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per query')
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        self.stdout.write(f'Backend: {type(backend).__name__}')
+        self.stdout.write(f'{"rows":>10} {"query":<16} {"icontains p50":>14} {"fulltext p50":>13} {"speedup":>8}')
+
+        with transaction.atomic():
+            category, _ = Category.objects.get_or_create(slug='benchmark', defaults={'name': 'Benchmark'})
+            seeded = Product.objects.count()
+            rng = random.Random(42)
+            for size in sorted(options['sizes']):
+                seeded = self.seed(category, seeded, size, options['batch_size'], rng)
+                backend.rebuild()
+                for query in QUERIES:
+                    base = Product.objects.filter(is_active=True, category=category)
+                    like = self.timed(lambda: self.icontains(base, query), options['repeat'])
+                    fulltext = self.timed(
+                        lambda: list(backend.search(base, query).order_by(backend.rank_ordering)[:20]),
+                        options['repeat'],
+                    )
+                    self.stdout.write(
+                        f'{size:>10} {query:<16} {like:>12.2f}ms {fulltext:>11.2f}ms {like / fulltext:>7.1f}x'
+                    )
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished; seeded rows were rolled back'))
+
+    def seed(self, category, seeded, target, batch_size, rng):
+        while seeded < target:
+            count = min(batch_size, target - seeded)
+            Product.objects.bulk_create([
+                Product(
+                    name=f'{rng.choice(WORDS).title()} {rng.choice(NOUNS).title()} {seeded + i}',
+                    description=' '.join(rng.choices(WORDS + NOUNS, k=12)),
+                    price=Decimal(rng.randint(100, 50_000)) / 100,
+                    stock=rng.randint(0, 100),
+                    category=category,
+                )
+                for i in range(count)
+            ])
+            seeded += count
+        return seeded
+
+    def icontains(self, queryset, query):
+        # Same filter SearchFilter builds for search_fields = ['name', 'description']
+        terms = [Q(name__icontains=term) | Q(description__icontains=term) for term in query.split()]
+        return list(queryset.filter(reduce(and_, terms)).order_by('-created_at')[:20])
+
+    def timed(self, run, repeat):
+        run()  # Warm caches
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            samples.append((time.perf_counter() - started) * 1000)
+        return statistics.median(samples)
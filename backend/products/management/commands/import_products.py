@@ -0,0 +1,201 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+from cart.signals import reprice
+from products import category_cache, conditional
+from products.models import Category, Product
+from products.search import get_backend
+
+UPDATE_FIELDS = ['name', 'description', 'price', 'stock', 'category', 'is_active', 'updated_at']
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+
+
+class RowError(ValueError):
+    pass
+
+
+def parse_bool(value, default):
+    """A CSV/JSON flag as a bool: default when missing or empty, None when it is not a flag."""
+    if value is None:
+        return default
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int):
+        return {0: False, 1: True}.get(value)
+    value = str(value).strip().lower()
+    if not value:
+        return default
+    if value in TRUE_VALUES or value in FALSE_VALUES:
+        return value in TRUE_VALUES
+    return None
+
+
+class Command(BaseCommand):
+    help = 'Stream products from a CSV or JSONL feed and upsert them by sku in chunks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file with sku, name, price and optional '
+                                         'description, stock, category (slug), is_active columns')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows per bulk upsert and transaction')
+        parser.add_argument('--rejects', help='Where to write rejected rows (default: <path>.rejects.jsonl)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'{path} does not exist')
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        chunk_size = options['chunk_size']
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+
+        # Resolve category slugs from memory instead of one lookup per row
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.search = get_backend()
+
+        started = time.perf_counter()
+        imported = self.rejected = 0
+        chunk = []
+        with open(rejects_path, 'w', encoding='utf-8') as rejects:
+            self.rejects = rejects
+            for line_no, row in self.read_rows(path, fmt):
+                try:
+                    chunk.append((line_no, row, self.build_product(row)))
+                except RowError as exc:
+                    self.reject(line_no, row, str(exc))
+                if len(chunk) >= chunk_size:
+                    imported += self.flush(chunk)
+                    chunk = []
+                    self.report(imported, started)
+            if chunk:
+                imported += self.flush(chunk)
+
+        # bulk_create skips model signals, so refresh the catalog caches once at the end
+        category_cache.invalidate()
+        conditional.bump_catalog_version()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Imported {imported} products in {elapsed:.1f}s '
+                f'({imported / elapsed if elapsed else 0:.0f} rows/sec)'
+            )
+        )
+        if self.rejected:
+            self.stdout.write(self.style.WARNING(f'{self.rejected} rows rejected, see {rejects_path}'))
+        else:
+            os.remove(rejects_path)
+
+    def read_rows(self, path, fmt):
+        """Yield (line number, row dict) without loading the file into memory."""
+        with open(path, newline='', encoding='utf-8-sig') as handle:
+            if fmt == 'csv':
+                reader = csv.DictReader(handle)
+                for row in reader:
+                    yield reader.line_num, row
+                return
+            for line_no, line in enumerate(handle, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as exc:
+                    self.reject(line_no, line.strip(), f'Invalid JSON: {exc}')
+                    continue
+                yield line_no, row
+
+    def build_product(self, row):
+        if not isinstance(row, dict):
+            raise RowError('Row is not an object')
+        sku = str(row.get('sku') or '').strip()
+        name = str(row.get('name') or '').strip()
+        if not sku:
+            raise RowError('Missing sku')
+        if len(sku) > 64:
+            raise RowError('sku is longer than 64 characters')
+        if not name:
+            raise RowError('Missing name')
+
+        try:
+            price = Decimal(str(row.get('price', '')).strip()).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f'Invalid price {row.get("price")!r}')
+        if not price.is_finite():  # NaN would raise on the comparison below
+            raise RowError(f'Invalid price {row.get("price")!r}')
+        if price < 0 or price >= Decimal('100000000'):
+            raise RowError(f'Price {price} out of range')
+
+        try:
+            stock = int(row.get('stock') or 0)
+        except (TypeError, ValueError):
+            raise RowError(f'Invalid stock {row.get("stock")!r}')
+        if stock < 0:
+            raise RowError('Stock cannot be negative')
+
+        category_id = None
+        slug = str(row.get('category') or '').strip()
+        if slug:
+            category_id = self.categories.get(slug)
+            if category_id is None:
+                raise RowError(f'Unknown category {slug!r}')
+
+        is_active = parse_bool(row.get('is_active'), default=True)
+        if is_active is None:
+            raise RowError(f'Invalid is_active {row.get("is_active")!r}')
+
+        return Product(
+            sku=sku,
+            name=name[:255],
+            description=str(row.get('description') or ''),
+            price=price,
+            stock=stock,
+            category_id=category_id,
+            is_active=is_active,
+        )
+
+    def flush(self, chunk):
+        """Upsert one chunk in its own transaction and return how many rows it imported."""
+        # The same sku twice in one statement is an error on PostgreSQL; the last row wins
+        latest = {}
+        for entry in chunk:
+            latest[entry[2].sku] = entry
+        products = [entry[2] for entry in latest.values()]
+
+        try:
+            with transaction.atomic():
+                prices = dict(Product.objects.filter(sku__in=latest).values_list('sku', 'price'))
+                saved = Product.objects.bulk_create(
+                    products,
+                    update_conflicts=True,
+                    unique_fields=['sku'],
+                    update_fields=UPDATE_FIELDS,
+                )
+                if any(product.pk is None for product in saved):
+                    ids = dict(Product.objects.filter(sku__in=latest).values_list('sku', 'id'))
+                    for product in saved:
+                        product.pk = ids[product.sku]
+                self.search.index(saved)
+                # bulk_create sends no post_save, so carts holding repriced products are refreshed here
+                repriced = [product.pk for product in saved if prices.get(product.sku, product.price) != product.price]
+                if repriced:
+                    reprice(repriced)
+        except DatabaseError as exc:
+            for line_no, row, _ in chunk:
+                self.reject(line_no, row, f'Database error: {exc}')
+            return 0
+        return len(chunk)
+
+    def reject(self, line_no, row, reason):
+        self.rejects.write(json.dumps({'line': line_no, 'reason': reason, 'row': row}, default=str) + '\n')
+        self.rejected += 1
+
+    def report(self, imported, started):
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{imported} imported, {self.rejected} rejected, {imported / elapsed if elapsed else 0:.0f} rows/sec'
+        )
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from products.search import get_backend
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text product search index in one bulk pass'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        started = time.perf_counter()
+        with transaction.atomic():
+            indexed = backend.rebuild()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Indexed {indexed} products with {type(backend).__name__} '
+                f'({connection.vendor}) in {elapsed:.2f}s'
+            )
+        )
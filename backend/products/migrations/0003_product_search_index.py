@@ -0,0 +1,50 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    from products.search import get_backend
+    backend = get_backend(schema_editor.connection.vendor)
+    backend.create_index(schema_editor)
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    from products.search import get_backend
+    get_backend(schema_editor.connection.vendor).drop_index(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_category_alter_product_options_product_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFTSEntry',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='fts_entry', serialize=False, to='products.product')),
+                ('document', models.TextField(db_column='products_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'products_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('document', models.TextField()),
+            ],
+            options={
+                'db_table': 'products_product_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
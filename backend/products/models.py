@@ -17,11 +17,15 @@ class Category(models.Model):
         return self.name
 
 class Product(models.Model):
+    # Supplier stock-keeping unit; the upsert key for import_products
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField(default=0)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # {format: {width: storage name}} written by products.images once variants are rendered
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='products', null=True, blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
@@ -29,6 +33,52 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # Catalog listings only show active products and page on (ordering field, id)
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='product_active_newest_idx'),
+            models.Index(fields=['price', 'id'], condition=models.Q(is_active=True),
+                         name='product_active_price_idx'),
+            models.Index(fields=['category', '-created_at', '-id'], condition=models.Q(is_active=True),
+                         name='product_active_cat_newest_idx'),
+            models.Index(fields=['category', 'price', 'id'], condition=models.Q(is_active=True),
+                         name='product_active_cat_price_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+class CatalogVersion(models.Model):
+    """
+    The single row counting catalog writes, for conditional GETs (see products.conditional).
+
+    bump_catalog_version() increments it when a write commits, so reading
+    the catalog's version is a primary key lookup however large it grows.
+    """
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Catalog version {self.version}"
+
+class ProductFTSEntry(models.Model):
+    """Row of the SQLite FTS5 search index; written only by products.search"""
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_column='rowid', db_constraint=False, related_name='fts_entry')
+    # FTS5 exposes a hidden column named after the table for MATCH queries
+    document = models.TextField(db_column='products_product_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'products_product_fts'
+
+class ProductSearchDocument(models.Model):
+    """Row of the PostgreSQL tsvector search index; written only by products.search"""
+    product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True,
+                                   db_constraint=False, related_name='search_document')
+    document = models.TextField()  # tsvector
+
+    class Meta:
+        managed = False
+        db_table = 'products_product_search'
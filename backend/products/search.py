@@ -0,0 +1,215 @@
+"""
+Full-text product search backends.
+
+Each backend keeps a side index of product name/description in sync with
+Product saves and deletes (see products.signals) and turns a search term
+into a filtered queryset annotated with `search_rank`. The backend is
+picked from the default database: SQLite uses an FTS5 virtual table,
+PostgreSQL a tsvector table with a GIN index, anything else falls back
+to the old icontains scan. Both index tables are mapped to unmanaged
+models so searches are plain joins against Product.
+"""
+import re
+from functools import reduce
+from operator import and_
+
+from django.db import connection
+from django.db.models import F, FloatField, Func, Lookup, Q, Value
+
+from .models import Product, ProductFTSEntry, ProductSearchDocument
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(term):
+    return TOKEN_RE.findall(term.lower())
+
+
+class BaseSearchBackend:
+    # Ordering term that puts the most relevant products first
+    rank_ordering = '-search_rank'
+
+    def search(self, queryset, term):
+        raise NotImplementedError
+
+    def index(self, products):
+        pass
+
+    def remove(self, product_ids):
+        pass
+
+    def rebuild(self):
+        """Re-index every product; returns the number of rows indexed."""
+        return 0
+
+    def create_index(self, schema_editor):
+        pass
+
+    def drop_index(self, schema_editor):
+        pass
+
+
+class LikeSearchBackend(BaseSearchBackend):
+    """The previous SearchFilter behaviour: every term must appear in name or description."""
+
+    def search(self, queryset, term):
+        tokens = term.split()
+        if not tokens:
+            return queryset
+        conditions = [Q(name__icontains=token) | Q(description__icontains=token) for token in tokens]
+        return queryset.filter(reduce(and_, conditions)).annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+
+
+@ProductFTSEntry._meta.get_field('document').register_lookup
+class Match(Lookup):
+    """`document__match=query`: an FTS5 MATCH against the index table."""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+@ProductSearchDocument._meta.get_field('document').register_lookup
+class TSMatch(Lookup):
+    """`document__tsmatch=query`: tsvector @@ to_tsquery(query)."""
+    lookup_name = 'tsmatch'
+    config = 'english'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} @@ to_tsquery('{self.config}', {rhs})", lhs_params + rhs_params
+
+
+class SqliteSearchBackend(BaseSearchBackend):
+    table = ProductFTSEntry._meta.db_table
+    # FTS5's rank column is bm25(), which is lower-is-better
+    rank_ordering = 'search_rank'
+    # Weight name matches well above description matches
+    rank_function = 'bm25(10.0, 1.0)'
+
+    def match_query(self, term):
+        # Quote each token and prefix-match it so partial words match while typing
+        return ' '.join(f'"{token}"*' for token in tokenize(term))
+
+    def search(self, queryset, term):
+        query = self.match_query(term)
+        if not query:
+            return queryset
+        return queryset.filter(fts_entry__document__match=query).annotate(
+            search_rank=F('fts_entry__rank')
+        )
+
+    def index(self, products):
+        rows = [(p.pk, p.name, p.description) for p in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, description) VALUES (%s, %s, %s)', rows
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        product_table = Product._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, description) '
+                f'SELECT id, name, description FROM {product_table}'
+            )
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}, rank) VALUES ('rank', %s)",
+                           [self.rank_function])
+            cursor.execute(f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')")
+            cursor.execute(f'SELECT COUNT(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    def create_index(self, schema_editor):
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} '
+            f"USING fts5(name, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    table = ProductSearchDocument._meta.db_table
+    config = TSMatch.config
+
+    def document_sql(self, name, description):
+        return (
+            f"setweight(to_tsvector('{self.config}', {name}), 'A') || "
+            f"setweight(to_tsvector('{self.config}', {description}), 'B')"
+        )
+
+    def ts_query(self, term):
+        # Tokens are plain word characters, so no tsquery operators can sneak in
+        return ' & '.join(f'{token}:*' for token in tokenize(term))
+
+    def search(self, queryset, term):
+        query = self.ts_query(term)
+        if not query:
+            return queryset
+        ts_query = Func(Value(self.config), Value(query), function='to_tsquery')
+        return queryset.filter(search_document__document__tsmatch=query).annotate(
+            search_rank=Func(F('search_document__document'), ts_query,
+                             function='ts_rank', output_field=FloatField())
+        )
+
+    def index(self, products):
+        rows = [(p.pk, p.name, p.description) for p in products]
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (product_id, document) '
+                f'VALUES (%s, {self.document_sql("%s", "%s")}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                rows,
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE product_id = ANY(%s)', [list(product_ids)])
+
+    def rebuild(self):
+        product_table = Product._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (product_id, document) '
+                f'SELECT id, {self.document_sql("name", "description")} FROM {product_table}'
+            )
+            return cursor.rowcount
+
+    def create_index(self, schema_editor):
+        product_table = Product._meta.db_table
+        schema_editor.execute(
+            f'CREATE TABLE IF NOT EXISTS {self.table} ('
+            f'product_id bigint PRIMARY KEY REFERENCES {product_table} (id) '
+            f'ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, '
+            f'document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {self.table}_document_gin ON {self.table} USING GIN (document)'
+        )
+
+    def drop_index(self, schema_editor):
+        schema_editor.execute(f'DROP TABLE IF EXISTS {self.table}')
+
+
+BACKENDS = {
+    'sqlite': SqliteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    """Return the search backend for a database vendor (default connection if omitted)."""
+    return BACKENDS.get(vendor or connection.vendor, LikeSearchBackend)()
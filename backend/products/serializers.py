@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Product, Category
+from .images import srcset
 
 class CategorySerializer(serializers.ModelSerializer):
     products_count = serializers.SerializerMethodField()
@@ -9,12 +10,25 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'slug', 'is_active', 'products_count']
 
     def get_products_count(self, obj):
+        # Views annotate active_products_count so listing categories stays one query
+        if hasattr(obj, 'active_products_count'):
+            return obj.active_products_count
         return obj.products.filter(is_active=True).count()
 
 class ProductSerializer(serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     category_slug = serializers.CharField(source='category.slug', read_only=True)
+    image_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'description', 'price', 'stock', 'image', 'category', 'category_name', 'category_slug', 'is_active', 'created_at', 'updated_at']
+        fields = ['id', 'sku', 'name', 'description', 'price', 'stock', 'image', 'image_srcset', 'category', 'category_name', 'category_slug', 'is_active', 'created_at', 'updated_at']
+
+    def get_image_srcset(self, obj):
+        # {format: "url 160w, url 320w, ..."}; empty until the variants have been rendered
+        storage = obj.image.storage
+        request = self.context.get('request')
+        build_url = storage.url
+        if request is not None:
+            build_url = lambda name: request.build_absolute_uri(storage.url(name))
+        return srcset(obj.image_variants, build_url)
@@ -0,0 +1,95 @@
+import threading
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+from django.dispatch import receiver
+
+from . import category_cache, conditional, images, search
+from .models import Category, Product
+
+# Catalog writes in the current transaction, flushed once on commit: the
+# catalog version that conditional GETs are keyed on is bumped, and the cached
+# category listing either re-counts the categories whose active products
+# changed or, when a category itself changed, is invalidated.
+_pending = threading.local()
+
+
+class PendingChanges:
+    def __init__(self):
+        self.counts = set()
+        self.listing = False
+
+
+def mark_catalog_changed(category_ids=(), listing=False):
+    pending = getattr(_pending, 'changes', None)
+    if pending is None:
+        pending = _pending.changes = PendingChanges()
+    pending.counts.update(pk for pk in category_ids if pk is not None)
+    pending.listing |= listing
+    transaction.on_commit(flush_catalog_changes)
+
+
+def flush_catalog_changes():
+    pending = getattr(_pending, 'changes', None)
+    if pending is None:
+        return
+    _pending.changes = None
+    if pending.listing:
+        category_cache.invalidate()
+    elif pending.counts:
+        category_cache.update_counts(pending.counts)
+    conditional.bump_catalog_version()
+
+
+@receiver(post_init, sender=Product)
+def remember_loaded_values(sender, instance, **kwargs):
+    # Read __dict__ directly so deferred loads don't trigger a query
+    instance._loaded_category_id = instance.__dict__.get('category_id')
+    instance._loaded_is_active = instance.__dict__.get('is_active')
+    image = instance.__dict__.get('image')
+    instance._loaded_image = getattr(image, 'name', image) or ''
+
+
+def image_changed(instance):
+    image = instance.image
+    return (image.name or '') != instance._loaded_image or (bool(image) and not image._committed)
+
+
+@receiver(pre_save, sender=Product)
+def reset_image_variants(sender, instance, raw=False, **kwargs):
+    instance._image_changed = not raw and image_changed(instance)
+    if instance._image_changed:
+        instance._stale_image_variants = instance.image_variants
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created=False, raw=False, **kwargs):
+    # Only a new product, or one moved or (de)activated, changes a category's count; a price edit does not
+    counted = (created or instance.category_id != instance._loaded_category_id
+               or instance.is_active != instance._loaded_is_active)
+    mark_catalog_changed((instance.category_id, instance._loaded_category_id) if counted else ())
+    instance._loaded_category_id = instance.category_id
+    instance._loaded_is_active = instance.is_active
+    if raw:
+        return
+    search.get_backend().index([instance])
+    if instance._image_changed:
+        stale = instance._stale_image_variants
+        transaction.on_commit(lambda: images.delete_variants(stale))
+        images.schedule_variants(instance)
+        instance._loaded_image = instance.image.name or ''
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    mark_catalog_changed((instance.category_id,))
+    search.get_backend().remove([instance.pk])
+    variants = instance.image_variants
+    transaction.on_commit(lambda: images.delete_variants(variants))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, instance, **kwargs):
+    mark_catalog_changed(listing=True)
@@ -1,3 +1,458 @@
-from django.test import TestCase
+import json
+import tempfile
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+
+from . import category_cache, conditional
+from .categorizer import DEFAULT_RULES, KeywordClassifier
+from .loaders import ProductLoader
+from .models import Category, Product
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.lamps = Category.objects.create(name='Lamps', slug='lamps')
+        self.rugs = Category.objects.create(name='Rugs', slug='rugs')
+
+    def product(self, name, price='10.00', category=None, **fields):
+        return Product.objects.create(name=name, price=Decimal(price), stock=5,
+                                      category=category or self.lamps, **fields)
+
+    def names(self, response):
+        data = response.data
+        return [product['name'] for product in (data['results'] if isinstance(data, dict) else data)]
+
+
+class ProductSearchTests(CatalogTestCase):
+    """Searches go through the full-text backend and are ordered by relevance."""
+
+    def setUp(self):
+        super().setUp()
+        self.product('Runner rug', category=self.rugs, description='Long enough to reach the floor lamp')
+        self.product('Floor lamp', description='Brass, with a linen shade')
+        self.product('Linen cushion', category=self.rugs, description='Goes with anything')
+
+    def search(self, term, **params):
+        return self.client.get(reverse('product-list'), {'search': term, **params})
+
+    def test_name_matches_rank_above_description_matches(self):
+        response = self.search('lamp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.names(response), ['Floor lamp', 'Runner rug'])
+
+        self.assertEqual(self.names(self.search('lin')), ['Linen cushion', 'Floor lamp'])  # Prefixes match
+        self.assertEqual(self.names(self.search('lamp', ordering='name')), ['Floor lamp', 'Runner rug'])
+        self.assertEqual(self.names(self.search('lamp', ordering='-name')), ['Runner rug', 'Floor lamp'])
+
+    def test_a_term_without_searchable_words_lists_everything(self):
+        for term in ('"', '*', '- ""'):
+            response = self.search(term)
+            self.assertEqual(response.status_code, 200, term)
+            self.assertEqual(self.names(response), ['Linen cushion', 'Floor lamp', 'Runner rug'])
+        self.assertEqual(self.client.get(reverse('products-by-category', args=['rugs']), {'search': '"'})
+                         .status_code, 200)
+
+
+class ProductPaginationTests(CatalogTestCase):
+    """Cursor pages are opt-in; without a cursor or page size the flat list comes back."""
+
+    def setUp(self):
+        super().setUp()
+        # Three prices shared by many products, so only the id keeps the order total
+        for i in range(25):
+            self.product(f'Product {i:02}', price=('5.00', '7.50', '9.99')[i % 3])
+        self.url = reverse('product-list')
+
+    def walk(self, params, key='next'):
+        ids, pages, url = [], 0, self.url
+        while url:
+            response = self.client.get(url, params if url == self.url else None)
+            self.assertEqual(response.status_code, 200)
+            ids += [product['id'] for product in response.data['results']]
+            pages += 1
+            url = response.data[key]
+        return ids, pages
+
+    def test_without_a_cursor_or_page_size_the_flat_list_comes_back(self):
+        response = self.client.get(self.url)
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(len(response.data), 25)
+
+        response = self.client.get(self.url, {'page_size': 10})
+        self.assertEqual(list(response.data), ['next', 'previous', 'results'])
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_price_ties_are_broken_by_id_without_repeats_or_gaps(self):
+        ids, pages = self.walk({'ordering': 'price', 'page_size': 4})
+        self.assertEqual(pages, 7)
+        self.assertEqual(ids, list(Product.objects.order_by('price', 'id').values_list('id', flat=True)))
+
+        ids, _ = self.walk({'ordering': '-price', 'page_size': 4})
+        self.assertEqual(ids, list(Product.objects.order_by('-price', '-id').values_list('id', flat=True)))
+
+    def test_cursors_stay_put_when_products_are_added_ahead_of_them(self):
+        first = self.client.get(self.url, {'ordering': 'price', 'page_size': 5}).data
+        self.product('Cheapest', price='1.00')
+        self.product('Tied', price='5.00')  # Sorts after every other 5.00 product: its id is the highest
+
+        second = self.client.get(first['next']).data
+        expected = list(Product.objects.exclude(name='Cheapest').order_by('price', 'id').values_list('id', flat=True))
+        self.assertEqual([product['id'] for product in first['results'] + second['results']], expected[:10])
+
+        previous = self.client.get(second['previous']).data  # Back to the page before, including what was added
+        self.assertEqual([product['id'] for product in previous['results']],
+                         list(Product.objects.order_by('price', 'id').values_list('id', flat=True))[1:6])
+
+    def test_deep_pages_are_one_keyset_query(self):
+        ids, pages = self.walk({'page_size': 2})
+        self.assertEqual(pages, 13)
+        self.assertEqual(ids, list(Product.objects.order_by('-created_at', '-id').values_list('id', flat=True)))
+
+        url = self.url
+        for _ in range(12):
+            response = self.client.get(url, {'page_size': 2} if url == self.url else None)
+            url = response.data['next']
+        with self.assertNumQueries(1) as queries:  # The catalog version is already cached
+            response = self.client.get(url)
+        self.assertEqual([product['id'] for product in response.data['results']], ids[24:])
+        self.assertIsNone(response.data['next'])
+        self.assertNotIn('OFFSET', queries.captured_queries[0]['sql'])
+
+    def test_a_cursor_that_does_not_decode_is_a_404(self):
+        response = self.client.get(self.url, {'ordering': 'price', 'page_size': 2})
+        cursor = response.data['next'].split('cursor=')[1]
+        for bad in ('not-base64!', 'eyJ2IjoibWFueSIsImlkIjoxfQ==', cursor[:-4]):  # The middle one's price is "many"
+            response = self.client.get(self.url, {'ordering': 'price', 'cursor': bad})
+            self.assertEqual(response.status_code, 404, bad)
+
+
+class ImportProductsTests(CatalogTestCase):
+    """import_products upserts good rows by sku and writes every bad one to the rejects file."""
+
+    def call(self, text, suffix='.csv'):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        path = Path(directory) / f'feed{suffix}'
+        path.write_text(text)
+        out = StringIO()
+        call_command('import_products', str(path), '--chunk-size=2', stdout=out)
+        rejects = Path(f'{path}.rejects.jsonl')
+        if not rejects.exists():
+            return out.getvalue(), []
+        return out.getvalue(), [json.loads(line) for line in rejects.read_text().splitlines()]
+
+    def test_rows_are_validated_one_by_one(self):
+        self.product('Old lamp', price='20.00', sku='LAMP-1')
+        output, rejects = self.call(
+            'sku,name,price,stock,category\n'
+            'LAMP-1,Desk lamp,24.50,3,lamps\n'
+            'RUG-1,Runner,99,1,rugs\n'
+            'NAN-1,Mystery,NaN,1,\n'
+            'INF-1,Endless,-Infinity,1,\n'
+            'NEG-1,Refund,-1,1,\n'
+            'CAT-1,Stray,5,1,chairs\n'
+            'STK-1,Lots,5,many,\n'
+            ',Nameless,5,1,\n'
+        )
+        self.assertIn('Imported 2 products', output)
+        self.assertIn('6 rows rejected', output)
+        self.assertEqual([(reject['line'], reject['reason']) for reject in rejects], [
+            (4, "Invalid price 'NaN'"),
+            (5, "Invalid price '-Infinity'"),
+            (6, 'Price -1.00 out of range'),
+            (7, "Unknown category 'chairs'"),
+            (8, "Invalid stock 'many'"),
+            (9, 'Missing sku'),
+        ])
+        lamp = Product.objects.get(sku='LAMP-1')
+        self.assertEqual((lamp.name, lamp.price, lamp.stock), ('Desk lamp', Decimal('24.50'), 3))
+        self.assertEqual(Product.objects.get(sku='RUG-1').category, self.rugs)
+        self.assertEqual(self.names(self.client.get(reverse('product-list'), {'search': 'runner'})), ['Runner'])
+
+    def test_jsonl_rejects_lines_that_do_not_parse(self):
+        output, rejects = self.call(
+            '{"sku": "A", "name": "Lamp", "price": "NaN"}\n'
+            '{"sku": "B", "name": "Rug", "price": 12.5, "is_active": "no"}\n'
+            'not json\n',
+            suffix='.jsonl',
+        )
+        self.assertIn('Imported 1 products', output)
+        self.assertEqual([reject['line'] for reject in rejects], [1, 3])
+
+    def test_jsonl_flags_keep_their_json_type(self):
+        output, rejects = self.call(
+            '{"sku": "A", "name": "Off", "price": 1, "is_active": false}\n'
+            '{"sku": "B", "name": "Zero", "price": 1, "is_active": 0}\n'
+            '{"sku": "C", "name": "On", "price": 1, "is_active": true}\n'
+            '{"sku": "D", "name": "Missing", "price": 1}\n'
+            '{"sku": "E", "name": "Empty", "price": 1, "is_active": ""}\n'
+            '{"sku": "F", "name": "Two", "price": 1, "is_active": 2}\n',
+            suffix='.jsonl',
+        )
+        self.assertIn('Imported 5 products', output)
+        self.assertEqual([reject['reason'] for reject in rejects], ['Invalid is_active 2'])
+        self.assertEqual(dict(Product.objects.values_list('sku', 'is_active')),
+                         {'A': False, 'B': False, 'C': True, 'D': True, 'E': True})
+        self.assertFalse(Product.objects.get(sku='B').is_active)
+
+
+class KeywordClassifierTests(SimpleTestCase):
+    """The earliest rule with a keyword anywhere in the name wins, however the keywords overlap."""
+
+    def test_default_rules(self):
+        classifier = KeywordClassifier(DEFAULT_RULES)
+        self.assertEqual(classifier.classify('Wireless HEADPHONES'), 'electronics')
+        self.assertEqual(classifier.classify('Board game guide book'), 'books')  # books outranks toys-games
+        self.assertEqual(classifier.classify('Skincare set'), 'health-beauty')
+        self.assertIsNone(classifier.classify('Garden hose'))
+        self.assertIsNone(classifier.classify(None))
+
+    def test_a_shorter_keyword_of_an_earlier_rule_beats_a_longer_one_at_the_same_place(self):
+        classifier = KeywordClassifier([('electronics', ['phone']), ('books', ['phonebook']), ('toys', ['toy'])])
+        self.assertEqual(classifier.classify('Phonebook 2024'), 'electronics')
+
+        classifier = KeywordClassifier([('books', ['phonebook']), ('electronics', ['phone'])])
+        self.assertEqual(classifier.classify('Phonebook 2024'), 'books')
+        self.assertEqual(classifier.classify('Phone case'), 'electronics')
+
+    def test_a_keyword_in_two_rules_belongs_to_the_first(self):
+        classifier = KeywordClassifier([('gifts', ['mug']), ('kitchen', ['mug', 'pan'])])
+        self.assertEqual(classifier.classify('Pan and mug'), 'gifts')
+        with self.assertRaises(ValueError):
+            KeywordClassifier([('empty', ['', '  '])])
+
+
+class CategoryCacheTests(CatalogTestCase):
+    """The category listing is cached, re-counted for product writes and rebuilt after category writes."""
+
+    def counts(self):
+        data = self.client.get(reverse('category-list')).data
+        return {row['slug']: row['products_count'] for row in (data['results'] if isinstance(data, dict) else data)}
+
+    def stats(self):
+        stats = category_cache.get_stats()
+        return stats['rebuilds'], stats['invalidations'], stats['count_updates']
+
+    def test_product_writes_recount_only_their_categories_once_committed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp = self.product('Lamp')  # With the categories from setUp: no listing yet, so an invalidation
+        self.assertEqual(self.counts(), {'lamps': 1, 'rugs': 0})
+        with self.assertNumQueries(0):
+            self.counts()
+        self.assertEqual(self.stats(), (1, 1, 0))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp.price = Decimal('11.00')
+            lamp.stock = 3
+            lamp.save()
+        self.assertEqual(self.stats(), (1, 1, 0))  # Nothing counted changed
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            lamp.category = self.rugs
+            lamp.save()
+            self.product('Floor lamp')
+            self.assertEqual(self.counts(), {'lamps': 1, 'rugs': 0})  # Until the commit
+        with self.assertNumQueries(2):  # One count over the two categories, and the catalog version bump
+            for callback in callbacks:
+                callback()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), {'lamps': 1, 'rugs': 1})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp.is_active = False
+            lamp.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.counts(), {'lamps': 1, 'rugs': 0})
+        self.assertEqual(self.stats(), (1, 1, 2))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rugs.is_active = False
+            self.rugs.save()
+        self.assertEqual(self.counts(), {'lamps': 1})
+        self.assertEqual(self.stats(), (2, 2, 2))
+
+    def test_a_rebuild_that_read_before_a_write_is_not_served_after_it(self):
+        generation = category_cache.get_generation()
+        stale = category_cache.serialize(category_cache.active_categories())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product('Lamp')
+        category_cache.rebuild(generation)  # Finishes after the write's invalidation
+        self.assertNotEqual(category_cache.get_categories(), stale)
+        self.assertEqual(self.counts()['lamps'], 1)
+
+        stats = category_cache.get_stats()
+        self.assertEqual((stats['invalidations'], stats['rebuilds']), (1, 2))
+
+    def test_of_two_writers_patching_one_generation_the_second_invalidates(self):
+        self.counts()
+        generation = category_cache.get_generation()
+        cache.set(category_cache.CACHE_KEY.format(generation + 1), [], None)  # Another writer's, not current yet
+        self.product('Lamp')
+        category_cache.update_counts([self.lamps.pk])
+        self.assertEqual(category_cache.get_generation(), generation + 1)
+        self.assertEqual(self.counts(), {'lamps': 1, 'rugs': 0})  # Rebuilt, not the other writer's patch
+        self.assertEqual(self.stats()[1:], (1, 0))
+
+
+class ConditionalGetTests(CatalogTestCase):
+    """Catalog reads carry validators from the catalog version row, so every process agrees on them."""
+
+    def setUp(self):
+        super().setUp()
+        self.lamp = self.product('Lamp')
+        self.url = reverse('product-list')
+
+    def test_an_unchanged_listing_is_a_304_without_queries(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+
+        cache.clear()  # Expired, or a process with its own cache: the version is read again and matches
+        with self.assertNumQueries(1):
+            self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+        self.assertNotEqual(self.client.get(self.url, {'ordering': 'name'})['ETag'], etag)
+
+    def test_writes_change_the_validators(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lamp.price = Decimal('11.00')
+            self.lamp.save()
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data[0]['price'], '11.00')
+
+        etag = response['ETag']
+        # A queryset update sends no signals; like the bulk paths, it bumps the version itself
+        Product.objects.filter(pk=self.lamp.pk).update(name='Desk lamp', updated_at=timezone.now())
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 304)
+        conditional.bump_catalog_version()
+        self.assertEqual(self.client.get(self.url, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_reading_the_version_is_a_primary_key_lookup(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            conditional.catalog_version()
+        [query] = queries.captured_queries
+        self.assertIn('FROM "products_catalogversion"', query['sql'])
+        self.assertNotIn('products_product', query['sql'])
+
+    def test_product_detail_is_a_304_when_unchanged(self):
+        url = reverse('product-detail', args=[self.lamp.pk])
+        response = self.client.get(url)
+        self.assertEqual(response.data['name'], 'Lamp')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, headers={'If-None-Match': response['ETag']}).status_code, 304)
+        self.assertEqual(conditional.catalog_version(), conditional.load_catalog_version())
+
+
+def png(name, size=(400, 200)):
+    content = BytesIO()
+    Image.new('RGB', size, 'teal').save(content, format='PNG')
+    return SimpleUploadedFile(name, content.getvalue(), content_type='image/png')
+
+
+@override_settings(PRODUCT_IMAGE_WORKERS=0, PRODUCT_IMAGE_WIDTHS=(160, 320, 640), PRODUCT_IMAGE_FORMATS=('webp',))
+class ImageVariantTests(CatalogTestCase):
+    """Uploaded images get resized variants once the save commits, served as srcsets."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        self.enterContext(override_settings(MEDIA_ROOT=str(self.media)))
+
+    def test_variants_are_rendered_on_commit_and_replaced_with_the_image(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp = self.product('Lamp', image=png('lamp.png'))
+            self.assertEqual(Product.objects.get(pk=lamp.pk).image_variants, {})  # Not before the commit
+        lamp.refresh_from_db()
+        self.assertEqual(lamp.image_variants, {  # 640 would be an upscale
+            'original': {'160': 'products/lamp__160w.png', '320': 'products/lamp__320w.png'},
+            'webp': {'160': 'products/lamp__160w.webp', '320': 'products/lamp__320w.webp'},
+        })
+        with Image.open(self.media / 'products/lamp__160w.webp') as variant:
+            self.assertEqual((variant.format, variant.size), ('WEBP', (160, 80)))
+
+        srcset = self.client.get(reverse('product-detail', args=[lamp.pk])).data['image_srcset']
+        self.assertEqual(srcset['webp'], 'http://testserver/products/products/lamp__160w.webp 160w, '
+                                         'http://testserver/products/products/lamp__320w.webp 320w')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            lamp.image = png('shade.png', (200, 100))
+            lamp.save()
+        lamp.refresh_from_db()
+        self.assertEqual(lamp.image_variants, {'original': {'160': 'products/shade__160w.png'},
+                                               'webp': {'160': 'products/shade__160w.webp'}})
+        self.assertFalse((self.media / 'products/lamp__160w.webp').exists())  # The old variants are gone
+
+
+class CatalogIndexTests(CatalogTestCase):
+    """The partial indexes behind the listing orders, and deep pages that range-scan them."""
+
+    indexes = {
+        'product_active_newest_idx': ['created_at', 'id'],
+        'product_active_price_idx': ['price', 'id'],
+        'product_active_cat_newest_idx': ['category_id', 'created_at', 'id'],
+        'product_active_cat_price_idx': ['category_id', 'price', 'id'],
+    }
+
+    def test_the_indexes_exist(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, Product._meta.db_table)
+        self.assertEqual({name: constraints[name]['columns'] for name in self.indexes if name in constraints},
+                         self.indexes)
+
+    def test_later_pages_seek_into_the_matching_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Plans are checked against SQLite; shopbase.test_query_plans covers other vendors')
+        for i in range(30):
+            self.product(f'Product {i}', price=str(5 + i % 4), category=(self.lamps, self.rugs)[i % 2])
+        for url, params, index in [
+            (reverse('product-list'), {}, 'product_active_newest_idx'),
+            (reverse('product-list'), {'ordering': 'price'}, 'product_active_price_idx'),
+            (reverse('product-list'), {'category': self.rugs.pk}, 'product_active_cat_newest_idx'),
+            (reverse('products-by-category', args=['rugs']), {'ordering': '-price'}, 'product_active_cat_price_idx'),
+        ]:
+            with self.subTest(index=index):
+                following = self.client.get(url, {**params, 'page_size': 5}).data['next']
+                with CaptureQueriesContext(connection) as queries:
+                    self.assertEqual(len(self.client.get(following).data['results']), 5)
+                with connection.cursor() as cursor:
+                    cursor.execute(f'EXPLAIN QUERY PLAN {queries.captured_queries[-1]["sql"]}')
+                    plan = ' '.join(row[-1] for row in cursor.fetchall())
+                self.assertIn(f'INDEX {index}', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class ProductLoaderTests(CatalogTestCase):
+    """One read per product per request, with the ids a lookup is missing fetched in one batch."""
+
+    def test_ids_are_fetched_in_one_batch_and_then_served_from_the_map(self):
+        lamp, rug, shade = self.product('Lamp'), self.product('Rug'), self.product('Shade')
+        loader = ProductLoader()
+        with self.assertNumQueries(1):
+            self.assertEqual(set(loader.load_many([rug.pk, str(shade.pk), 'junk', None])), {rug.pk, shade.pk})
+        with self.assertNumQueries(1):
+            self.assertEqual(loader.load(lamp.pk).name, 'Lamp')
+            self.assertEqual(set(loader.load_many([rug.pk, shade.pk, lamp.pk])), {lamp.pk, rug.pk, shade.pk})
+            self.assertEqual(loader.load(lamp.pk).category.name, 'Lamps')  # select_related
+        self.assertEqual(str(loader.stats), 'hits=4 misses=3 batches=2')
+
+    def test_missing_products_are_remembered_as_missing(self):
+        loader = ProductLoader()
+        with self.assertNumQueries(1):
+            self.assertIsNone(loader.load(404))
+            self.assertEqual(loader.load_many([404, 'x']), {})
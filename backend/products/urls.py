@@ -2,7 +2,8 @@ from django.urls import path
 from .views import (
     ProductListView, ProductDetailView,
     ProductCreateView, ProductUpdateView, ProductDeleteView,
-    CategoryListView, CategoryDetailView, ProductsByCategoryView
+    CategoryListView, CategoryDetailView, ProductsByCategoryView,
+    category_cache_stats
 )
 
 urlpatterns = [
@@ -15,6 +16,7 @@ urlpatterns = [
     
     # Category URLs
     path('categories/', CategoryListView.as_view(), name='category-list'),
+    path('stats/category-cache/', category_cache_stats, name='category-cache-stats'),
     path('categories/<slug:slug>/', CategoryDetailView.as_view(), name='category-detail'),
     path('categories/<slug:category_slug>/products/', ProductsByCategoryView.as_view(), name='products-by-category'),
 ]
@@ -1,63 +1,116 @@
 from django.shortcuts import render
+from django.utils.cache import get_conditional_response
 from rest_framework import generics, permissions
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from .filters import ProductSearchFilter, RankedOrderingFilter
 from .models import Product, Category
 from .serializers import ProductSerializer, CategorySerializer
+from .pagination import ProductCursorPagination
+from . import category_cache, conditional
+from shopbase.querybudget import query_budget
 
 # Category Views
 class CategoryListView(generics.ListAPIView):
-    queryset = Category.objects.filter(is_active=True)
+    """Active categories with product counts, served from the category cache"""
+    queryset = category_cache.active_categories()
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
+    query_budget = 1  # Only a cache miss touches the database
+
+    def list(self, request, *args, **kwargs):
+        categories = category_cache.get_categories()
+        page = self.paginate_queryset(categories)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(categories)
+
+@query_budget(0)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def category_cache_stats(request):
+    """Hit rate and rebuild timings of the category listing cache"""
+    return Response(category_cache.get_stats())
 
 class CategoryDetailView(generics.RetrieveAPIView):
-    queryset = Category.objects.filter(is_active=True)
+    queryset = category_cache.active_categories()
     serializer_class = CategorySerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = 'slug'
+    query_budget = 2  # Cache misses: the category listing and the catalog version
+
+    def retrieve(self, request, *args, **kwargs):
+        category = category_cache.get_category(self.kwargs['slug'])
+        if category is None:
+            raise NotFound()
+        _, last_modified = conditional.catalog_version()
+        return conditional.respond(request, category, conditional.make_etag(category), last_modified)
+
+class CatalogConditionalMixin:
+    """Answer If-None-Match/If-Modified-Since on catalog listings from the catalog version"""
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = conditional.list_validators(request)
+        timestamp = int(last_modified.timestamp())
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        return conditional.set_validators(response, etag, last_modified)
 
 # Product Views
-class ProductListView(generics.ListAPIView):
-    queryset = Product.objects.filter(is_active=True)
+class ProductListView(CatalogConditionalMixin, generics.ListAPIView):
+    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, ProductSearchFilter, RankedOrderingFilter]
     filterset_fields = ['category', 'category__slug']
     search_fields = ['name', 'description']
     ordering_fields = ['price', 'created_at', 'name']
     ordering = ['-created_at']
-    pagination_class = None  # Disable pagination for products
+    pagination_class = ProductCursorPagination  # Paged only with ?cursor= or ?page_size=
+    query_budget = 3  # ?category= loads the category to validate it; plus the catalog version once it expires
 
 class ProductDetailView(generics.RetrieveAPIView):
-    queryset = Product.objects.filter(is_active=True)
+    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
+    query_budget = 2  # Cache misses: the catalog version and the product
+
+    def retrieve(self, request, *args, **kwargs):
+        entry = conditional.get_product_entry(request, self)
+        return conditional.respond(request, entry['data'], entry['etag'], entry['last_modified'])
 
 class ProductCreateView(generics.CreateAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]  # Only admin
+    query_budget = 4
 
 class ProductUpdateView(generics.RetrieveUpdateAPIView):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('category')
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]  # Only admin
+    query_budget = 4
 
 class ProductDeleteView(generics.DestroyAPIView):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     permission_classes = [permissions.IsAdminUser]  # Only admin
+    query_budget = 6  # Includes refreshing the totals of carts holding the product
 
 # Products by Category
-class ProductsByCategoryView(generics.ListAPIView):
+class ProductsByCategoryView(CatalogConditionalMixin, generics.ListAPIView):
     serializer_class = ProductSerializer
     permission_classes = [permissions.AllowAny]
-    filter_backends = [SearchFilter, OrderingFilter]
+    filter_backends = [ProductSearchFilter, RankedOrderingFilter]
     search_fields = ['name', 'description']
     ordering_fields = ['price', 'created_at', 'name']
     ordering = ['-created_at']
+    pagination_class = ProductCursorPagination
+    query_budget = 2  # Includes the catalog version once it expires
 
     def get_queryset(self):
         category_slug = self.kwargs['category_slug']
-        return Product.objects.filter(category__slug=category_slug, is_active=True)
+        return Product.objects.filter(category__slug=category_slug, is_active=True).select_related('category')
@@ -0,0 +1,50 @@
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+from orders.models import Order
+from reports import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the sales rollups for a range of days from the orders, a chunk of days per transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', type=date.fromisoformat, help='First day (YYYY-MM-DD); default the first order')
+        parser.add_argument('--end', type=date.fromisoformat, help='Last day (YYYY-MM-DD); default today')
+        parser.add_argument('--chunk-days', type=int, default=31, help='Days recomputed per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_days'] < 1:
+            raise CommandError('--chunk-days must be at least 1')
+        start, end = options['start'], options['end'] or timezone.localdate()
+        if start is None:
+            first = Order.objects.aggregate(first=Min('created_at'))['first']
+            if first is None:
+                self.stdout.write(self.style.WARNING('No orders to roll up'))
+                return
+            start = timezone.localdate(first)
+        if start > end:
+            raise CommandError('--start must not be after --end')
+
+        started = time.perf_counter()
+        orders = 0
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(end, chunk_start + timedelta(days=options['chunk_days'] - 1))
+            orders += rollups.rebuild(chunk_start, chunk_end)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'{chunk_start} to {chunk_end}: {orders} settled orders so far, '
+                f'{orders / elapsed if elapsed else 0:.0f} orders/sec'
+            )
+            chunk_start = chunk_end + timedelta(days=1)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Rebuilt rollups for {(end - start).days + 1} days from {orders} settled orders in {elapsed:.1f}s'
+            )
+        )
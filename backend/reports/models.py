@@ -0,0 +1,71 @@
+from django.db import models
+from django.db.models.functions import Coalesce
+from orders.models import Order, from_cents
+from products.models import Category, Product
+
+class SalesRollup(models.Model):
+    """
+    Settled orders summed per day (the day each order was placed, in TIME_ZONE).
+
+    Rows are added to by reports.rollups as orders settle and recomputed
+    by rebuild_rollups; nothing else writes them.
+    """
+    day = models.DateField()
+    orders = models.PositiveIntegerField(default=0)
+    units = models.PositiveBigIntegerField(default=0)
+    revenue_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def revenue(self):
+        return from_cents(self.revenue_cents)
+
+class DailySales(SalesRollup):
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+
+    class Meta:
+        ordering = ['day', 'status']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='dailysales_day_status_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.status}: {self.orders} orders, ${self.revenue}"
+
+class DailyCategorySales(SalesRollup):
+    # No database constraint, so deleting a category keeps its history; null for lines without a
+    # category (single-product checkouts, uncategorized or deleted products). orders counts the
+    # orders with a line in the category, so it does not add up across categories.
+    category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, db_constraint=False,
+                                 db_index=False, null=True, blank=True, related_name='+')
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+
+    class Meta:
+        ordering = ['day', 'category_id', 'status']
+        constraints = [
+            # Coalesced so the uncategorized rows are unique too; rollups' upsert names the same expression
+            models.UniqueConstraint('day', Coalesce('category', 0), 'status', name='dailycategorysales_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['category', 'status', 'day'], name='dailycategorysales_series_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} category {self.category_id} {self.status}: ${self.revenue}"
+
+class DailyProductSales(SalesRollup):
+    """Paid lines per product and day."""
+    product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, db_index=False,
+                                related_name='+')
+    product_name = models.CharField(max_length=255)  # As last sold
+
+    class Meta:
+        ordering = ['day', 'product_id']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='dailyproductsales_day_product_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.product_name}: {self.units} sold, ${self.revenue}"
@@ -0,0 +1,102 @@
+"""
+Sales rollups, kept current as orders settle.
+
+Three tables hold settled orders summed per day, the day each order was
+placed: DailySales per status, DailyCategorySales per category and
+status, and DailyProductSales per product, paid lines only. Reports read
+these instead of scanning orders, so they cost the same however long the
+history is.
+
+record_orders() adds orders to the rollups when OrderQuerySet.settle()
+sends order_settled, in the settling transaction. Each table takes one
+INSERT ... SELECT ... ON CONFLICT DO UPDATE that sums the orders' rows
+into any already there, so concurrent workers add up instead of
+overwriting each other. rebuild() recomputes a range of days from the
+orders themselves, for backfills or after a fix; it deletes the range's
+rows and inserts them again the same way.
+"""
+from datetime import datetime, time, timedelta
+
+from django.db import connections, models, transaction
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from orders.models import Order, OrderItem
+from .models import DailyCategorySales, DailyProductSales, DailySales
+
+ROLLUPS = (DailySales, DailyCategorySales, DailyProductSales)
+
+
+def record_orders(order_ids):
+    """Add settled orders to the rollups. Call it once per order, in the transaction that settles it."""
+    orders = Order.objects.filter(pk__in=order_ids).exclude(status='pending')
+    add_orders(orders)
+
+
+def rebuild(start, end):
+    """Recompute the rollups for the days start..end (inclusive) from the orders. Returns the orders counted."""
+    orders = Order.objects.filter(created_at__gte=day_start(start), created_at__lt=day_start(end + timedelta(days=1)))
+    with transaction.atomic():
+        for model in ROLLUPS:
+            model.objects.filter(day__range=(start, end)).delete()
+        add_orders(orders.exclude(status='pending'))
+        return orders.exclude(status='pending').count()
+
+
+def day_start(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def add_orders(orders):
+    lines = OrderItem.objects.filter(order__in=orders.values('pk'))
+    upsert(DailySales, orders.values(
+        'status',
+        day=TruncDate('created_at'),
+    ).annotate(
+        orders=models.Count('id'),
+        units=models.Sum('item_count'),
+        revenue_cents=models.Sum('total_cents'),
+    ), conflict=['"day"', '"status"'])
+    upsert(DailyCategorySales, lines.values(
+        day=TruncDate('order__created_at'),
+        category_id=models.F('product__category_id'),
+        status=models.F('order__status'),
+    ).annotate(
+        orders=models.Count('order_id', distinct=True),
+        units=models.Sum('quantity'),
+        revenue_cents=models.Sum('line_total_cents'),
+    ), conflict=['"day"', 'COALESCE("category_id", 0)', '"status"'])
+    upsert(DailyProductSales, lines.filter(order__status='paid', product__isnull=False).values(
+        'product_id',
+        day=TruncDate('order__created_at'),
+    ).annotate(
+        product_name=models.Max('product_name'),
+        orders=models.Count('order_id', distinct=True),
+        units=models.Sum('quantity'),
+        revenue_cents=models.Sum('line_total_cents'),
+    ), conflict=['"day"', '"product_id"'], replace=['product_name'])
+
+
+def upsert(model, rows, conflict, replace=()):
+    """
+    INSERT the grouped rows into model's table, adding orders, units and
+    revenue_cents onto rows that already exist for the conflict key.
+
+    rows is a values() queryset whose names are model columns; conflict
+    must match a unique constraint of the model (in SQL, quoted).
+    """
+    rows = rows.order_by()
+    query = rows.query
+    names = [*query.extra_select, *query.values_select, *query.annotation_select]
+    select, params = query.sql_with_params()
+    connection = connections[rows.db]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    updates = [f'{quote(name)} = {table}.{quote(name)} + excluded.{quote(name)}'
+               for name in ('orders', 'units', 'revenue_cents')]
+    updates += [f'{quote(name)} = excluded.{quote(name)}' for name in replace]
+    # SQLite needs the WHERE that every rollup query has, to parse ON CONFLICT after a SELECT
+    sql = (f'INSERT INTO {table} ({", ".join(quote(name) for name in names)}) {select} '
+           f'ON CONFLICT ({", ".join(conflict)}) DO UPDATE SET {", ".join(updates)}')
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.utils import timezone
+from rest_framework import serializers
+from orders.models import Order
+
+# Reports read one rollup row per day (and category or product), so the range bounds their cost
+MAX_DAYS = 2 * 366
+DEFAULT_DAYS = 30
+
+class ReportRangeSerializer(serializers.Serializer):
+    """Query parameters of the sales reports: an inclusive range of days, the last 30 by default."""
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+
+    def validate(self, data):
+        data['end'] = data.get('end') or timezone.localdate()
+        data['start'] = data.get('start') or data['end'] - timedelta(days=DEFAULT_DAYS - 1)
+        if data['start'] > data['end']:
+            raise serializers.ValidationError({'start': 'Must not be after end.'})
+        if (data['end'] - data['start']).days >= MAX_DAYS:
+            raise serializers.ValidationError({'start': f'The range may span at most {MAX_DAYS} days.'})
+        return data
+
+class SalesSeriesSerializer(ReportRangeSerializer):
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES, default='paid')
+    category = serializers.IntegerField(required=False, min_value=1)
+
+class TopSalesSerializer(ReportRangeSerializer):
+    limit = serializers.IntegerField(required=False, default=10, min_value=1, max_value=100)
+    order_by = serializers.ChoiceField(choices=['revenue', 'units', 'orders'], default='revenue')
@@ -0,0 +1,9 @@
+from django.dispatch import receiver
+
+from orders.signals import order_settled
+from . import rollups
+
+
+@receiver(order_settled)
+def add_settled_orders(sender, order_ids, **kwargs):
+    rollups.record_orders(order_ids)
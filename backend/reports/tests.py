@@ -0,0 +1,125 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from orders.models import Order, OrderItem
+from payments import webhooks
+from payments.models import Payment
+from products.models import Category, Product
+from .models import DailyCategorySales, DailyProductSales, DailySales
+
+User = get_user_model()
+
+
+class SalesRollupTests(TestCase):
+    """Rollups kept current as orders settle, rebuilt from the orders, and the reports read from them."""
+
+    def setUp(self):
+        self.user = User.objects.create(username='rollup-shopper', email='rollup@example.com')
+        self.admin = User.objects.create(username='rollup-admin', is_staff=True, role='admin')
+        self.lamps = Category.objects.create(name='Lamps', slug='lamps')
+        self.rugs = Category.objects.create(name='Rugs', slug='rugs')
+        self.lamp = Product.objects.create(name='Lamp', price=Decimal('12.99'), stock=50, category=self.lamps)
+        self.rug = Product.objects.create(name='Rug', price=Decimal('40.00'), stock=50, category=self.rugs)
+        self.today = timezone.localdate()
+        self.yesterday = self.today - timedelta(days=1)
+
+        # (days ago, lines, how it settles); None leaves the order pending
+        for days_ago, lines, status in [
+            (1, [(self.lamp, 2), (self.rug, 1)], 'completed'),
+            (1, [(self.lamp, 1)], 'completed'),
+            (1, [(self.rug, 3)], 'cancelled'),
+            (0, [(self.lamp, 1), (None, 1)], 'completed'),
+            (0, [(self.rug, 1)], None),
+        ]:
+            self.checkout(days_ago, lines, status)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def checkout(self, days_ago, lines, status):
+        created_at = timezone.now() - timedelta(days=days_ago)
+        payment = Payment.objects.create(
+            user=self.user, stripe_checkout_session_id=f'cs_rollup_{Payment.objects.count()}', amount=Decimal('1'),
+            product_name='Rollup', created_at=created_at,
+        )
+        Order.objects.place(payment, [
+            OrderItem.snapshot(product.name, product.price, quantity, product=product) if product
+            else OrderItem.snapshot('Gift card', '10.00', quantity)
+            for product, quantity in lines
+        ])
+        if status:
+            webhooks.settle_payment(payment.stripe_checkout_session_id, status)
+
+    def rollups(self):
+        return (
+            sorted(DailySales.objects.values_list('day', 'status', 'orders', 'units', 'revenue_cents')),
+            sorted(DailyCategorySales.objects.values_list('day', 'category', 'status', 'orders', 'units',
+                                                          'revenue_cents'), key=str),
+            sorted(DailyProductSales.objects.values_list('day', 'product', 'product_name', 'orders', 'units',
+                                                         'revenue_cents')),
+        )
+
+    def test_settled_orders_are_rolled_up_and_rebuild_agrees(self):
+        daily, by_category, by_product = self.rollups()
+        self.assertEqual(daily, [
+            (self.yesterday, 'cancelled', 1, 3, 12000),
+            (self.yesterday, 'paid', 2, 4, 2598 + 4000 + 1299),
+            (self.today, 'paid', 1, 2, 1299 + 1000),
+        ])
+        self.assertIn((self.yesterday, self.lamps.pk, 'paid', 2, 3, 3897), by_category)
+        self.assertIn((self.today, None, 'paid', 1, 1, 1000), by_category)
+        self.assertEqual(by_product, sorted([
+            (self.yesterday, self.lamp.pk, 'Lamp', 2, 3, 3897),
+            (self.yesterday, self.rug.pk, 'Rug', 1, 1, 4000),
+            (self.today, self.lamp.pk, 'Lamp', 1, 1, 1299),
+        ]))
+
+        expected = self.rollups()
+        DailySales.objects.update(orders=0)
+        DailyProductSales.objects.filter(day=self.today).delete()
+        out = StringIO()
+        call_command('rebuild_rollups', '--chunk-days=1', stdout=out)
+        self.assertIn('from 4 settled orders', out.getvalue())
+        self.assertEqual(self.rollups(), expected)
+
+    def test_sales_by_day_fills_the_range(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('reports:sales_by_day'), {'start': self.yesterday - timedelta(days=1)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(day['day'], day['orders'], day['revenue_cents']) for day in response.data['days']], [
+            (self.yesterday - timedelta(days=1), 0, 0), (self.yesterday, 2, 7897), (self.today, 1, 2299),
+        ])
+        self.assertEqual(response.data['totals'], {'orders': 3, 'units': 6, 'revenue_cents': 10196})
+
+        response = self.client.get(reverse('reports:sales_by_day'), {'category': self.rugs.pk, 'status': 'cancelled'})
+        self.assertEqual(response.data['totals'], {'orders': 1, 'units': 3, 'revenue_cents': 12000})
+
+    def test_top_products_and_categories(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('reports:top_products'), {'order_by': 'units'})
+        self.assertEqual([(row['product_name'], row['orders'], row['units']) for row in response.data['results']],
+                         [('Lamp', 3, 4), ('Rug', 1, 1)])
+
+        response = self.client.get(reverse('reports:top_categories'), {'limit': 2})
+        self.assertEqual([(row['category_name'], row['revenue_cents']) for row in response.data['results']],
+                         [('Lamps', 5196), ('Rugs', 4000)])
+        response = self.client.get(reverse('reports:top_categories'), {'order_by': 'orders', 'limit': 3})
+        self.assertIn({'category_id': None, 'category_name': None, 'orders': 1, 'units': 1, 'revenue_cents': 1000},
+                      response.data['results'])
+
+    def test_reports_are_admin_only_and_validate_the_range(self):
+        url = reverse('reports:sales_by_day')
+        self.assertEqual(self.client.get(url, {'start': self.today, 'end': self.yesterday}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start': self.today - timedelta(days=1000)}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('reports:top_products'), {'limit': 0}).status_code, 400)
+
+        self.client.force_authenticate(self.user)
+        for name in ('reports:sales_by_day', 'reports:top_products', 'reports:top_categories'):
+            self.assertEqual(self.client.get(reverse(name)).status_code, 403)
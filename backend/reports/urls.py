@@ -0,0 +1,10 @@
+from django.urls import path
+from . import views
+
+app_name = 'reports'
+
+urlpatterns = [
+    path('sales/', views.sales_by_day, name='sales_by_day'),
+    path('top-products/', views.top_products, name='top_products'),
+    path('top-categories/', views.top_categories, name='top_categories'),
+]
@@ -0,0 +1,82 @@
+from datetime import timedelta
+
+from django.db.models import F, Max, Sum
+from rest_framework import permissions, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+from shopbase.querybudget import query_budget
+from .models import DailyCategorySales, DailyProductSales, DailySales
+from .serializers import SalesSeriesSerializer, TopSalesSerializer
+
+RANKINGS = {'revenue': 'total_revenue_cents', 'units': 'total_units', 'orders': 'total_orders'}
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def sales_by_day(request):
+    """Orders, units and revenue per day for one order status, optionally within one category"""
+    serializer = SalesSeriesSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    params = serializer.validated_data
+    start, end = params['start'], params['end']
+
+    if 'category' in params:
+        rows = DailyCategorySales.objects.filter(category=params['category'])
+    else:
+        rows = DailySales.objects.all()
+    rows = rows.filter(status=params['status'], day__range=(start, end)).order_by()
+    by_day = {row['day']: row for row in rows.values('day', 'orders', 'units', 'revenue_cents')}
+
+    days = []
+    for offset in range((end - start).days + 1):  # Days without sales are zeros, not gaps
+        day = start + timedelta(days=offset)
+        row = by_day.get(day, {'orders': 0, 'units': 0, 'revenue_cents': 0})
+        days.append({'day': day, 'orders': row['orders'], 'units': row['units'], 'revenue_cents': row['revenue_cents']})
+    return Response({
+        'start': start,
+        'end': end,
+        'status': params['status'],
+        'category': params.get('category'),
+        'totals': {key: sum(day[key] for day in days) for key in ('orders', 'units', 'revenue_cents')},
+        'days': days,
+    })
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def top_products(request):
+    """Best-selling products over a range of days, from the paid lines"""
+    serializer = TopSalesSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    params = serializer.validated_data
+
+    rows = ranked(DailyProductSales.objects.filter(day__range=(params['start'], params['end'])), 'product_id',
+                  Max('product_name'), params)
+    results = [{'product_id': row['product_id'], 'product_name': row['name'], **sums(row)} for row in rows]
+    return Response({'start': params['start'], 'end': params['end'], 'results': results})
+
+@query_budget(1)
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def top_categories(request):
+    """Best-selling categories over a range of days, from the paid lines; a null category is the uncategorized lines"""
+    serializer = TopSalesSerializer(data=request.query_params)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    params = serializer.validated_data
+
+    rows = ranked(DailyCategorySales.objects.filter(status='paid', day__range=(params['start'], params['end'])),
+                  'category_id', Max('category__name'), params)
+    results = [{'category_id': row['category_id'], 'category_name': row['name'], **sums(row)} for row in rows]
+    return Response({'start': params['start'], 'end': params['end'], 'results': results})
+
+def ranked(rows, key, name, params):
+    """The top params['limit'] keys of the rollup rows by params['order_by'], summed over the range"""
+    return rows.order_by().values(key).annotate(
+        name=name, total_orders=Sum('orders'), total_units=Sum('units'), total_revenue_cents=Sum('revenue_cents'),
+    ).order_by(F(RANKINGS[params['order_by']]).desc(), key)[:params['limit']]
+
+def sums(row):
+    return {'orders': row['total_orders'], 'units': row['total_units'], 'revenue_cents': row['total_revenue_cents']}
@@ -0,0 +1,77 @@
+"""
+Admin changelist helpers for tables with millions of rows.
+
+Django's changelist runs an exact COUNT(*) for the paginator, which on a
+table of millions of rows is a full scan on every page view. The
+EstimatedCountPaginator asks the database for its row estimate when the
+changelist is unfiltered, and otherwise counts at most MAX_COUNT matching
+rows, so a broad filter still pages through the first MAX_COUNT results.
+Admins using it should also set show_full_result_count = False, which
+drops the second, unfiltered count.
+
+IndexedSearchMixin keeps admin search on indexes: search_fields must name
+their lookups, and `__startswith` fields are matched as case-sensitive
+prefixes. SQLite's LIKE is case-insensitive and cannot use a plain index,
+so there a prefix becomes the equivalent range on the column.
+"""
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+MAX_COUNT = 10_000
+
+
+def estimated_row_count(model, using='default'):
+    """The database's estimate of the table's row count, or None when it has none."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Maintained by autovacuum/ANALYZE; -1 until the table has been analyzed
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [table])
+        elif connection.vendor == 'sqlite':
+            # The rowid high-water mark, read from the end of the primary key b-tree
+            cursor.execute(f'SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}')
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None or row[0] is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    max_count = MAX_COUNT
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimated_row_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.max_count:
+                return estimate
+        # Bounded: SELECT COUNT(*) FROM (SELECT ... LIMIT max_count)
+        return queryset.order_by()[:self.max_count].count()
+
+
+def prefix_condition(field, prefix, using='default'):
+    if connections[using].vendor == 'sqlite':
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return Q(**{f'{field}__gte': prefix, f'{field}__lt': upper})
+    return Q(**{f'{field}__startswith': prefix})
+
+
+class IndexedSearchMixin:
+    def get_search_results(self, request, queryset, search_term):
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        conditions = Q()
+        for field in self.search_fields:
+            if field.endswith('__startswith'):
+                conditions |= prefix_condition(field.removesuffix('__startswith'), term, queryset.db)
+            else:
+                conditions |= Q(**{field: term})
+        # Only forward relations are searched, so no row can match twice
+        return queryset.filter(conditions), False
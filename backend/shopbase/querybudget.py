@@ -0,0 +1,110 @@
+"""
+Per-request SQL query accounting and per-endpoint query budgets.
+
+Views declare the most queries they are allowed to run, either with a
+`query_budget` class attribute or the `@query_budget(n)` decorator (placed
+above `@api_view` on function views). QueryBudgetMiddleware counts every
+query a request runs, remembers repeated SQL, and logs (or raises, with
+QUERY_BUDGET_RAISE) when a view goes over its budget. Request-scoped
+loaders (see products.loaders) report their hit/miss counts alongside.
+"""
+import logging
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of SQL queries a view may run per request."""
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+def get_query_budget(view_func):
+    """Return the budget declared on a view function or its view class, if any."""
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None:
+        view_class = getattr(view_func, 'view_class', None)
+        budget = getattr(view_class, 'query_budget', None)
+    return budget
+
+
+class QueryRecorder:
+    """Database execute wrapper collecting the SQL run while it is installed."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duplicates(self):
+        """SQL statements (ignoring parameters) that ran more than once."""
+        return {sql: n for sql, n in Counter(self.queries).items() if n > 1}
+
+
+class QueryBudgetMiddleware:
+    """
+    Record query counts and duplicate SQL for every request.
+
+    The recorder is attached to the request as `request.query_stats`, and
+    loaders register their stats in `request.loader_stats`. With DEBUG on,
+    the count, budget and loader stats are also sent back as response
+    headers.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        request.query_stats = recorder
+        request.query_budget = None
+        request.loader_stats = {}
+
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        budget = request.query_budget
+        if settings.DEBUG:
+            response['X-Query-Count'] = str(recorder.count)
+            response['X-Query-Duplicates'] = str(sum(recorder.duplicates.values()))
+            if budget is not None:
+                response['X-Query-Budget'] = str(budget)
+            if request.loader_stats:
+                response['X-Loader-Stats'] = '; '.join(
+                    f'{name} {stats}' for name, stats in sorted(request.loader_stats.items())
+                )
+
+        if budget is not None and recorder.count > budget:
+            message = (
+                f'{request.method} {request.path} ran {recorder.count} queries '
+                f'(budget {budget}, {len(recorder.duplicates)} repeated statements)'
+            )
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
+        return None
@@ -38,6 +38,8 @@ INSTALLED_APPS = [
     'products',
     'cart',
     'payments',
+    'orders',
+    'reports',
 ]
 
 # REST Framework configuration - Modify authentication and permissions here
@@ -52,6 +54,7 @@ REST_FRAMEWORK = {
 
 # Middleware configuration - Order matters!
 MIDDLEWARE = [
+    'shopbase.querybudget.QueryBudgetMiddleware',  # Counts SQL per request, enforces view query budgets
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add WhiteNoise for static files
@@ -65,6 +68,9 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'shopbase.urls'
 
+# Raise instead of logging when a view runs more SQL queries than its query_budget
+QUERY_BUDGET_RAISE = os.getenv('QUERY_BUDGET_RAISE', 'False').lower() == 'true'
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -90,6 +96,26 @@ DATABASES = {
     )
 }
 
+# Cache - catalog payloads and conditional GET versions live here. Set REDIS_URL
+# whenever more than one worker process serves traffic, so that writes in one
+# are seen by the others at once.
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+    CATALOG_VERSION_TIMEOUT = 60
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+    # Per-process: another worker's writes show once this process's copy expires
+    CATALOG_VERSION_TIMEOUT = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -132,15 +158,28 @@ AUTH_USER_MODEL = 'accounts.User'
 MEDIA_URL = '/products/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'products')
 
-# CORS configuration
-CORS_ALLOW_ALL_ORIGINS = True
+# Product image variants - thumbnail widths, extra encodings, and worker processes (0 renders inline)
+PRODUCT_IMAGE_WIDTHS = (160, 320, 640, 1280)
+PRODUCT_IMAGE_FORMATS = ('webp', 'avif')
+PRODUCT_IMAGE_WORKERS = int(os.getenv('PRODUCT_IMAGE_WORKERS', '2'))
+
+# CORS configuration - credentialed, so only the listed origins (plus any in the
+# comma-separated CORS_EXTRA_ORIGINS) may call the API from a browser
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://localhost:3001",
     "http://127.0.0.1:3000",
     "http://127.0.0.1:3001",
     "https://shopbase.onrender.com",
-]
+    "https://shop-base-xi.vercel.app",  # The deployed storefront
+] + [origin.strip() for origin in os.getenv('CORS_EXTRA_ORIGINS', '').split(',') if origin.strip()]
+CORS_ALLOW_CREDENTIALS = True  # The guest cart cookie rides on cross-origin cart requests
+
+# Guest carts - anonymous carts live in the cache behind a signed cookie and expire after
+# this many idle seconds. Outside DEBUG the cookie is Secure and SameSite=None, since the
+# deployed storefront calls the API from another site; Lax suits a same-site local setup.
+GUEST_CART_TTL = int(os.getenv('GUEST_CART_TTL', str(7 * 24 * 60 * 60)))
+GUEST_CART_COOKIE_SAMESITE = os.getenv('GUEST_CART_COOKIE_SAMESITE', 'Lax' if DEBUG else 'None')
 
 # REST Framework configuration
 REST_FRAMEWORK = {
@@ -162,7 +201,7 @@ SIMPLE_JWT = {
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
     'ROTATE_REFRESH_TOKENS': True,
     'BLACKLIST_AFTER_ROTATION': True,
-    'UPDATE_LAST_LOGIN': True,
+    'UPDATE_LAST_LOGIN': False,  # accounts.views.LoginView sends user_logged_in, which updates it
     'ALGORITHM': 'HS256',
     'SIGNING_KEY': SECRET_KEY,
     'VERIFYING_KEY': None,
@@ -177,4 +216,29 @@ SIMPLE_JWT = {
 # Stripe Configuration
 STRIPE_PUBLISHABLE_KEY = os.getenv('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
-STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')
+
+# Stripe API calls (payments.gateway) - pooled keep-alive connections, bounded timeouts in seconds, and
+# retries of connection errors, 409/429 and 5xx with a doubling, jittered delay from the base.
+# STRIPE_API_BASE overrides https://api.stripe.com, e.g. for payments.fakestripe.
+STRIPE_API_BASE = os.getenv('STRIPE_API_BASE') or None
+STRIPE_CONNECT_TIMEOUT = 3
+STRIPE_READ_TIMEOUT = 10
+STRIPE_MAX_RETRIES = 2
+STRIPE_RETRY_BASE_SECONDS = 0.25
+STRIPE_POOL_SIZE = 10
+
+# Checkout reuse - a repeated checkout (same user and lines, or same Idempotency-Key header) gets the
+# session still open for it, unless it expires within the margin; requests for a checkout being
+# created wait up to CHECKOUT_LOCK_SECONDS for it (see payments/checkout.py)
+CHECKOUT_SESSION_TTL = 24 * 60 * 60
+CHECKOUT_REUSE_MARGIN_SECONDS = 10 * 60
+CHECKOUT_LOCK_SECONDS = 30
+
+# Webhook inbox - process_webhooks retries a failing event after a delay doubling from the base up to
+# the max (with jitter), gives up after WEBHOOK_MAX_ATTEMPTS, and re-runs claimed events a worker
+# did not finish once their lease expires.
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+WEBHOOK_RETRY_BASE_SECONDS = 30
+WEBHOOK_RETRY_MAX_SECONDS = 60 * 60
+WEBHOOK_LEASE_SECONDS = 300
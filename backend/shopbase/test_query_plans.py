@@ -0,0 +1,157 @@
+"""
+EXPLAIN snapshots for the hottest read endpoints.
+
+Each case requests an endpoint against a seeded database, captures every
+SELECT it ran and compares the normalized plans with the snapshot checked
+in under shopbase/query_plans/<vendor>.json. Losing an index or gaining a
+sort (SQLite's temp B-tree, a PostgreSQL Sort node) is reported as a
+regression; any other change only needs the snapshot re-recorded:
+
+    UPDATE_PLAN_SNAPSHOTS=1 python manage.py test shopbase.test_query_plans
+
+On PostgreSQL sequential scans are disabled while explaining, so a plan
+shows whether a usable index exists rather than what the planner prefers
+for a small test table.
+"""
+import json
+import os
+import re
+from pathlib import Path
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from shopbase.tests import seed
+
+SNAPSHOT_DIR = Path(__file__).resolve().parent / 'query_plans'
+
+# case -> (client user, url name, url kwargs builder, query params builder)
+CASES = {
+    'product-list': (None, 'product-list', None, None),
+    'product-list-price': (None, 'product-list', None, lambda d: {'ordering': 'price'}),
+    'product-list-category': (None, 'product-list', None, lambda d: {'category': d.category.pk}),
+    'product-list-category-price': (None, 'product-list', None, lambda d: {
+        'category': d.category.pk, 'ordering': 'price'}),
+    'product-list-category-slug': (None, 'product-list', None, lambda d: {'category__slug': d.category.slug}),
+    'products-by-category': (None, 'products-by-category', lambda d: {'category_slug': d.category.slug}, None),
+    'products-by-category-price': (None, 'products-by-category', lambda d: {'category_slug': d.category.slug},
+                                   lambda d: {'ordering': 'price'}),
+    'cart': ('shopper', 'cart:cart', None, None),
+    'payment-history': ('shopper', 'payments:payment_history', None, None),
+    'payment-history-filtered': ('shopper', 'payments:payment_history', None, lambda d: {
+        'status': 'pending', 'created_after': '2000-01-01T00:00:00Z'}),
+    'payment-history-summary': ('shopper', 'payments:payment_history', None, lambda d: {'summary': 'true'}),
+    'user-list': ('admin', 'user-list-create', None, None),
+    'sales-by-day': ('admin', 'reports:sales_by_day', None, None),
+    'sales-by-day-category': ('admin', 'reports:sales_by_day', None, lambda d: {'category': d.category.pk}),
+    'top-products': ('admin', 'reports:top_products', None, None),
+    'top-categories': ('admin', 'reports:top_categories', None, lambda d: {'order_by': 'units'}),
+}
+
+SQLITE_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\S+)|USING (INTEGER PRIMARY KEY)')
+POSTGRES_INDEX = re.compile(r'(?:Index (?:Only )?Scan(?: Backward)?|Bitmap Index Scan) (?:using|on) (\S+)')
+POSTGRES_COST = re.compile(r'\s*\(cost=[^)]*\)')
+
+
+def normalize(rows):
+    """Turn raw EXPLAIN rows into stable, literal-free plan lines."""
+    if connection.vendor == 'sqlite':
+        # (id, parent, notused, detail); older SQLite versions say "SCAN TABLE x"
+        return [re.sub(r'\b(SCAN|SEARCH) TABLE ', r'\1 ', row[-1]) for row in rows]
+    lines = []
+    for (line,) in rows:
+        line = POSTGRES_COST.sub('', line).strip()
+        if line.startswith('->'):
+            line = line[2:].strip()
+        if ':' in line.split(' ', 1)[0]:
+            continue  # Filter:, Index Cond:, Sort Key: ... carry literals
+        lines.append(line)
+    return lines
+
+
+def indexes_used(plan):
+    pattern = SQLITE_INDEX if connection.vendor == 'sqlite' else POSTGRES_INDEX
+    found = set()
+    for line in plan:
+        for match in pattern.finditer(line):
+            name = match.group(1) or f'{match.group(2)} of {line.split()[1]}'
+            found.add(name)
+    return found
+
+
+def sorts(plan):
+    if connection.vendor == 'sqlite':
+        return sum('USE TEMP B-TREE' in line for line in plan)
+    return sum(bool(re.match(r'(Incremental )?Sort\b', line)) for line in plan)
+
+
+def regressions(expected, actual):
+    """Lost indexes and new sorts between two lists of per-query plans."""
+    problems = []
+    for number, (old, new) in enumerate(zip(expected, actual), start=1):
+        lost = indexes_used(old) - indexes_used(new)
+        if lost:
+            problems.append(f'query {number} no longer uses {", ".join(sorted(lost))}')
+        if sorts(new) > sorts(old):
+            problems.append(f'query {number} gained a sort')
+    return problems
+
+
+@override_settings(QUERY_BUDGET_RAISE=False)
+class QueryPlanSnapshotTests(TestCase):
+    seed_rows = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.data = seed(cls.seed_rows)
+
+    def snapshot_path(self):
+        return SNAPSHOT_DIR / f'{connection.vendor}.json'
+
+    def test_plans_match_snapshots(self):
+        path = self.snapshot_path()
+        actual = {case: self.explain_case(case) for case in CASES}
+
+        if os.environ.get('UPDATE_PLAN_SNAPSHOTS'):
+            SNAPSHOT_DIR.mkdir(exist_ok=True)
+            path.write_text(json.dumps(actual, indent=2) + '\n')
+            self.skipTest(f'Recorded {path}')
+        if not path.exists():
+            self.skipTest(f'No {connection.vendor} plan snapshot; record one with UPDATE_PLAN_SNAPSHOTS=1')
+
+        expected = json.loads(path.read_text())
+        self.assertEqual(set(expected), set(CASES), 'Plan snapshot cases are out of date')
+        for case in CASES:
+            with self.subTest(case=case):
+                problems = regressions(expected[case], actual[case])
+                self.assertFalse(problems, f'{case}: ' + '; '.join(problems))
+                self.assertEqual(
+                    expected[case], actual[case],
+                    f'{case} plan changed; re-record with UPDATE_PLAN_SNAPSHOTS=1 if this is intended',
+                )
+
+    def explain_case(self, case):
+        user, name, kwargs_for, params_for = CASES[case]
+        client = APIClient()
+        if user:
+            client.force_authenticate(getattr(self.data, user))
+        url = reverse(name, kwargs=kwargs_for(self.data) if kwargs_for else None)
+
+        cache.clear()  # Cold caches, so cached reads still show their queries
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url, params_for(self.data) if params_for else None)
+        self.assertEqual(response.status_code, 200, f'{case}: {response.content[:200]}')
+
+        selects = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')]
+        return [self.explain(sql) for sql in selects]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}')
+            return normalize(cursor.fetchall())
@@ -0,0 +1,287 @@
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from cart.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from payments.fakestripe import FakeStripe
+from payments.models import Payment
+from products.models import Category, Product
+from reports.models import DailyCategorySales, DailyProductSales, DailySales
+from .adminscale import EstimatedCountPaginator
+
+User = get_user_model()
+
+PASSWORD = 'budget-pass-123'
+
+
+def seed(n):
+    """
+    Create n rows of every catalog/cart/payment/order/rollup table around one shopper.
+
+    Returns a namespace with the shopper, an admin and one object of each
+    model that URL kwargs can point at.
+    """
+    admin = User.objects.create(username='budget-admin', is_staff=True, is_superuser=True, role='admin')
+    shopper = User(username='budget-shopper', email='shopper@example.com')
+    shopper.set_password(PASSWORD)
+    shopper.save()
+    User.objects.bulk_create([User(username=f'user-{i}') for i in range(n)])
+
+    categories = Category.objects.bulk_create([
+        Category(name=f'Category {i}', slug=f'category-{i}') for i in range(n)
+    ])
+    products = Product.objects.bulk_create([
+        Product(name=f'Product {i}', description='Seeded', price=Decimal('9.99'), stock=1000,
+                category=categories[i % len(categories)])
+        for i in range(n)
+    ])
+    cart = Cart.objects.create(user=shopper)
+    items = CartItem.objects.bulk_create([CartItem(cart=cart, product=product) for product in products])
+    Cart.objects.filter(pk=cart.pk).refresh_totals()
+    payments = Payment.objects.bulk_create([
+        Payment(user=shopper, stripe_checkout_session_id=f'cs_seed_{i}', amount=Decimal('9.99'),
+                product_name=f'Product {i}')
+        for i in range(n)
+    ])
+    orders = Order.objects.bulk_create([
+        Order(user=shopper, payment=payment, total_cents=999, item_count=1) for payment in payments
+    ])
+    lines = [OrderItem.snapshot(product.name, product.price, product=product) for product in products]
+    for order, line in zip(orders, lines):
+        line.order = order
+    OrderItem.objects.bulk_create(lines)
+    today = timezone.localdate()
+    DailySales.objects.bulk_create([
+        DailySales(day=today - timedelta(days=i), status='paid', orders=1, units=1, revenue_cents=999) for i in range(n)
+    ])
+    DailyCategorySales.objects.bulk_create([
+        DailyCategorySales(day=today - timedelta(days=i % 30), category=category, status='paid', orders=1, units=1,
+                           revenue_cents=999)
+        for i, category in enumerate(categories)
+    ])
+    DailyProductSales.objects.bulk_create([
+        DailyProductSales(day=today - timedelta(days=i % 30), product=product, product_name=product.name, orders=1,
+                          units=1, revenue_cents=999)
+        for i, product in enumerate(products)
+    ])
+    return SimpleNamespace(
+        admin=admin, shopper=shopper, category=categories[0], product=products[0],
+        cart=cart, item=items[0], payment=payments[0],
+    )
+
+
+def spare_product(data):
+    return Product.objects.create(name='Spare', price=Decimal('1.00'), stock=10, category=data.category)
+
+
+def spare_item(data):
+    return CartItem.objects.create(cart=data.cart, product=spare_product(data))
+
+
+# url name -> (client user, method, url kwargs builder, payload builder)
+ENDPOINTS = {
+    'register': (None, 'post', None, lambda d: {
+        'username': 'newcomer', 'email': 'new@example.com', 'password': 'Sturdy-Pass-987'}),
+    'login': (None, 'post', None, lambda d: {'username': 'budget-shopper', 'password': PASSWORD}),
+    'token_refresh': (None, 'post', None, lambda d: {'refresh': str(RefreshToken.for_user(d.shopper))}),
+    'user-me': ('shopper', 'get', None, None),
+    'user-profile': ('shopper', 'get', None, None),
+    'user-list-create': ('admin', 'get', None, None),
+    'user-detail': ('admin', 'get', lambda d: {'pk': d.shopper.pk}, None),
+    'toggle-user-status': ('admin', 'post', lambda d: {'user_id': d.shopper.pk}, None),
+
+    'product-list': (None, 'get', None, None),
+    'product-detail': (None, 'get', lambda d: {'pk': d.product.pk}, None),
+    'product-create': ('admin', 'post', None, lambda d: {
+        'name': 'Created', 'price': '5.00', 'stock': 3, 'category': d.category.pk}),
+    'product-update': ('admin', 'patch', lambda d: {'pk': d.product.pk}, lambda d: {'stock': 50}),
+    'product-delete': ('admin', 'delete', lambda d: {'pk': spare_product(d).pk}, None),
+    'category-list': (None, 'get', None, None),
+    'category-cache-stats': ('admin', 'get', None, None),
+    'category-detail': (None, 'get', lambda d: {'slug': d.category.slug}, None),
+    'products-by-category': (None, 'get', lambda d: {'category_slug': d.category.slug}, None),
+
+    'cart:cart': ('shopper', 'get', None, None),
+    'cart:add_to_cart': ('shopper', 'post', None, lambda d: {'product_id': d.product.pk, 'quantity': 1}),
+    'cart:update_cart_item': ('shopper', 'put', lambda d: {'item_id': d.item.pk}, lambda d: {'quantity': 2}),
+    'cart:remove_cart_item': ('shopper', 'delete', lambda d: {'item_id': spare_item(d).pk}, None),
+    'cart:clear_cart': ('shopper', 'delete', None, None),
+    'cart:batch_update_cart': ('shopper', 'post', None, lambda d: {'operations': [
+        {'op': 'add', 'product_id': spare_product(d).pk, 'quantity': 2},
+        {'op': 'set', 'item_id': d.item.pk, 'quantity': 3},
+        {'op': 'remove', 'item_id': spare_item(d).pk},
+    ]}),
+
+    'payments:create_checkout_session': ('shopper', 'post', None, lambda d: {
+        'product_name': 'Gift card', 'amount': '10.00'}),
+    'payments:create_cart_checkout_session': ('shopper', 'post', None, None),
+    'payments:stripe_webhook': (None, 'post', None, None),
+    'payments:payment_history': ('shopper', 'get', None, None),
+
+    'reports:sales_by_day': ('admin', 'get', None, None),
+    'reports:top_products': ('admin', 'get', None, None),
+    'reports:top_categories': ('admin', 'get', None, None),
+}
+
+
+def first_add(data):
+    Cart.objects.filter(pk=data.cart.pk).delete()  # The add creates the shopper's cart
+    return {'product_id': data.product.pk, 'quantity': 1}
+
+
+# The costlier requests to URLs above: case -> (url name, client user, method, url kwargs builder, payload builder)
+VARIANTS = {
+    'product-list?category': ('product-list', None, 'get', None, lambda d: {'category': d.category.pk}),
+    'product-list?category__slug': ('product-list', None, 'get', None, lambda d: {
+        'category__slug': d.category.slug, 'ordering': 'price'}),
+    'product-list?search': ('product-list', None, 'get', None, lambda d: {'search': 'product', 'page_size': 20}),
+    'products-by-category?search': ('products-by-category', None, 'get', lambda d: {'category_slug': d.category.slug},
+                                    lambda d: {'search': 'product', 'ordering': 'price'}),
+    'cart:add_to_cart (new cart)': ('cart:add_to_cart', 'shopper', 'post', None, first_add),
+}
+
+
+def iter_url_names(patterns, namespace=None):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace == 'admin':
+                continue  # Admin changelists are not API endpoints
+            nested = pattern.namespace
+            if namespace and nested:
+                nested = f'{namespace}:{nested}'
+            yield from iter_url_names(pattern.url_patterns, nested or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            yield f'{namespace}:{pattern.name}' if namespace else pattern.name
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class QueryBudgetHarnessTests(TestCase):
+    """
+    Hit every API URL with 1 and with 500 seeded rows per table.
+
+    An endpoint fails when its query count changes with the row count (an
+    N+1) or exceeds the query_budget its view declares.
+    """
+    sizes = (1, 500)
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Checkout views reach Stripe over HTTP; this answers them on a loopback port
+        fake = cls.enterClassContext(FakeStripe())
+        cls.enterClassContext(override_settings(STRIPE_API_BASE=fake.url, STRIPE_SECRET_KEY='sk_test_budget'))
+
+    def test_every_url_is_covered(self):
+        names = set(iter_url_names(get_resolver().url_patterns))
+        self.assertEqual(names, set(ENDPOINTS))
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        for name in [*ENDPOINTS, *VARIANTS]:
+            with self.subTest(endpoint=name):
+                (small, _, _), (large, budget, repeated) = [self.measure(name, n) for n in self.sizes]
+                self.assertEqual(
+                    small, large,
+                    f'{name} ran {small} queries with {self.sizes[0]} row(s) but {large} with '
+                    f'{self.sizes[1]}; repeated SQL: {repeated}',
+                )
+                if budget is not None:
+                    self.assertLessEqual(large, budget, f'{name} is over its query budget')
+
+    def measure(self, name, n):
+        if name in VARIANTS:
+            name, user, method, kwargs_for, payload_for = VARIANTS[name]
+        else:
+            user, method, kwargs_for, payload_for = ENDPOINTS[name]
+        cache.clear()  # Measure cold caches so every run does the same work
+        with transaction.atomic():
+            data = seed(n)
+            client = APIClient()
+            if user:
+                client.force_authenticate(getattr(data, user))
+            url = reverse(name, kwargs=kwargs_for(data) if kwargs_for else None)
+            payload = payload_for(data) if payload_for else None
+
+            event = {
+                'id': 'evt_budget',
+                'type': 'checkout.session.completed',
+                'data': {'object': {'id': data.payment.stripe_checkout_session_id,
+                                    'metadata': {'cart_checkout': 'true'}}},
+            }
+            with mock.patch('payments.views.stripe.Webhook.construct_event', return_value=event):
+                response = getattr(client, method)(url, payload, format='json')
+
+            self.assertLess(response.status_code, 400, f'{name}: {response.content[:200]}')
+            stats = response.wsgi_request.query_stats
+            transaction.set_rollback(True)
+        return stats.count, response.wsgi_request.query_budget, stats.duplicates
+
+
+# changelist -> query strings it is also opened with (a filter, a search)
+CHANGELISTS = {
+    'admin:products_product_changelist': ['', '?is_active__exact=1', '?q=product'],
+    'admin:products_category_changelist': ['', '?is_active__exact=1', '?q=category'],
+    'admin:cart_cart_changelist': ['', '?q=budget'],
+    'admin:cart_cartitem_changelist': ['', '?q=budget'],
+    'admin:payments_payment_changelist': ['', '?status__exact=pending', '?q=cs_seed_0'],
+    'admin:accounts_user_changelist': ['', '?role__exact=user', '?q=user-'],
+}
+
+
+class AdminChangelistTests(TestCase):
+    """The admin changelists run the same queries however many rows their tables hold."""
+    sizes = (1, 150)  # More than a page of list_per_page (100) rows
+
+    def test_query_counts_do_not_grow_with_rows(self):
+        for name, queries in CHANGELISTS.items():
+            for query in queries:
+                with self.subTest(changelist=name, query=query):
+                    small, large = [self.measure(name, query, n) for n in self.sizes]
+                    self.assertEqual(small, large, f'{name}{query} ran {small} queries with {self.sizes[0]} row(s) '
+                                                   f'but {large} with {self.sizes[1]}')
+
+    def measure(self, name, query, n):
+        cache.clear()
+        with transaction.atomic():
+            data = seed(n)
+            client = Client()
+            client.force_login(data.admin)
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get(reverse(name) + query)
+            self.assertEqual(response.status_code, 200, f'{name}{query}')
+            transaction.set_rollback(True)
+        return len(queries)
+
+    def test_counts_are_estimated_or_bounded(self):
+        seed(30)
+        paginator = EstimatedCountPaginator(Product.objects.order_by('-pk'), 10)
+        paginator.max_count = 20
+        last = Product.objects.latest('pk').pk
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.count, last)  # The rowid estimate, not a COUNT(*)
+
+        paginator = EstimatedCountPaginator(Product.objects.filter(stock__gt=0), 10)
+        paginator.max_count = 20
+        self.assertEqual(paginator.count, 20)  # Counted up to max_count
+        paginator = EstimatedCountPaginator(Product.objects.filter(name='Product 1'), 10)
+        self.assertEqual(paginator.count, 1)
+
+    def test_search_matches_case_sensitive_prefixes(self):
+        data = seed(3)
+        client = Client()
+        client.force_login(data.admin)
+        response = client.get(reverse('admin:accounts_user_changelist'), {'q': 'user-'})
+        self.assertEqual({user.username for user in response.context['cl'].result_list}, {'user-0', 'user-1', 'user-2'})
+        response = client.get(reverse('admin:accounts_user_changelist'), {'q': 'USER-'})
+        self.assertEqual(list(response.context['cl'].result_list), [])